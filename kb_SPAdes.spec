@@ -4,8 +4,8 @@ A wrapper for the SPAdes assembler with hybrid features supported.
 http://bioinf.spbau.ru/spades
 
 Always runs in careful mode.
-Runs 3 threads / CPU.
-Maximum memory use is set to available memory - 1G.
+Runs 1 thread / CPU allowed by the container's CPU quota.
+Maximum memory use is set to available memory (within the container's memory limit) - 1G.
 Autodetection is used for the PHRED quality offset and k-mer sizes.
 A coverage cutoff is not specified.
 
@@ -116,6 +116,41 @@ module kb_SPAdes {
         bool create_report;
     } HybridSPAdesParams;
 
+    /* Input parameters for a SPAdes parameter sweep. The reads are downloaded, checked and
+    error corrected once, then one assembly is run per combination of k-mer sizes and
+    DNA source, and the assembly with the best N50 is saved.
+
+    workspace_name - the name of the workspace from which to take input
+                     and store output.
+    output_contigset_name - the name of the output contigset of the best assembly
+    read_libraries - a list of Illumina PairedEndLibrary files in FASTQ or BAM format.
+    kmer_size_sets - a list of k-mer size lists, one assembly is run per list
+                     (all values must be odd, less than 128 and listed in ascending order)
+    dna_sources - (optional) a list of DNA sources ('single_cell', 'metagenomic', 'plasmid'
+                     or None for a standard DNA sample), one assembly is run per DNA source
+                     and k-mer size list. Default value is [None].
+    min_contig_length - (optional) integer to filter out contigs with length < min_contig_length
+                     from the best assembly. Default value is 0 implying no filter.
+    skip_error_correction - (optional) Assembly only (No error correction).
+                     By default this is disabled.
+    max_concurrent_variants - (optional) the number of assemblies run side by side, sharing
+                     the threads and memory of the node. Default value is 1.
+    @optional dna_sources
+    @optional min_contig_length
+    @optional skip_error_correction
+    @optional max_concurrent_variants
+    */
+    typedef structure {
+        string workspace_name;
+        string output_contigset_name;
+        list<paired_end_lib> read_libraries;
+        list<list<int>> kmer_size_sets;
+        list<string> dna_sources;
+        int min_contig_length;
+        bool skip_error_correction;
+        int max_concurrent_variants;
+    } SPAdesSweepParams;
+
     /* Output parameters for SPAdes run.
 
     report_name - the name of the KBaseReport.Report workspace object.
@@ -138,5 +173,10 @@ module kb_SPAdes {
     /* Run SPAdes on paired end libraries for metagenomes */
     funcdef run_metaSPAdes(SPAdesParams params) returns(SPAdesOutput output)
         authentication required;
+
+    /* Run SPAdes with several k-mer size sets and DNA sources on the same reads and save
+       the best assembly */
+    funcdef run_SPAdes_sweep(SPAdesSweepParams params) returns(SPAdesOutput output)
+        authentication required;
 };
 
@@ -165,6 +165,50 @@ class kb_SPAdes(object):
         return self._client.call_method('kb_SPAdes.run_metaSPAdes',
                                         [params], self._service_ver, context)
 
+    def run_SPAdes_sweep(self, params, context=None):
+        """
+        Run SPAdes with several k-mer size sets and DNA sources on the same reads and save
+        the best assembly
+        :param params: instance of type "SPAdesSweepParams" (Input parameters
+           for a SPAdes parameter sweep. The reads are downloaded, checked
+           and error corrected once, then one assembly is run per combination
+           of k-mer sizes and DNA source, and the assembly with the best N50
+           is saved. workspace_name - the name of the workspace from which to
+           take input and store output. output_contigset_name - the name of
+           the output contigset of the best assembly read_libraries - a list
+           of Illumina PairedEndLibrary files in FASTQ or BAM format.
+           kmer_size_sets - a list of k-mer size lists, one assembly is run
+           per list (all values must be odd, less than 128 and listed in
+           ascending order) dna_sources - (optional) a list of DNA sources
+           ('single_cell', 'metagenomic', 'plasmid' or None for a standard
+           DNA sample), one assembly is run per DNA source and k-mer size
+           list. Default value is [None]. min_contig_length - (optional)
+           integer to filter out contigs with length < min_contig_length from
+           the best assembly. Default value is 0 implying no filter.
+           skip_error_correction - (optional) Assembly only (No error
+           correction). By default this is disabled. max_concurrent_variants
+           - (optional) the number of assemblies run side by side, sharing
+           the threads and memory of the node. Default value is 1. @optional
+           dna_sources @optional min_contig_length @optional
+           skip_error_correction @optional max_concurrent_variants) ->
+           structure: parameter "workspace_name" of String, parameter
+           "output_contigset_name" of String, parameter "read_libraries" of
+           list of type "paired_end_lib" (The workspace object name of a
+           PairedEndLibrary file, whether of the KBaseAssembly or KBaseFile
+           type.), parameter "kmer_size_sets" of list of list of Long,
+           parameter "dna_sources" of list of String, parameter
+           "min_contig_length" of Long, parameter "skip_error_correction" of
+           type "bool" (A boolean. 0 = false, anything else = true.),
+           parameter "max_concurrent_variants" of Long
+        :returns: instance of type "SPAdesOutput" (Output parameters for
+           SPAdes run. report_name - the name of the KBaseReport.Report
+           workspace object. report_ref - the workspace reference of the
+           report.) -> structure: parameter "report_name" of String,
+           parameter "report_ref" of String
+        """
+        return self._client.call_method('kb_SPAdes.run_SPAdes_sweep',
+                                        [params], self._service_ver, context)
+
     def status(self, context=None):
         return self._client.call_method('kb_SPAdes.status',
                                         [], self._service_ver, context)
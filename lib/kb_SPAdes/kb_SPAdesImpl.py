@@ -5,13 +5,10 @@ from __future__ import print_function
 import os
 import re
 import uuid
-import requests
 import json
-import psutil
-import subprocess
-import numpy as np
 import yaml
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pformat
 
 from installed_clients.WorkspaceClient import Workspace
@@ -23,10 +20,25 @@ from installed_clients.kb_quastClient import kb_quast
 from installed_clients.kb_ea_utilsClient import kb_ea_utils
 
 from kb_SPAdes.utils.spades_assembler import SPAdesAssembler
-
-
-class ShockException(Exception):
-    pass
+from kb_SPAdes.utils.client_pool import (pooled, configure_session_pool, configure_job_checks,
+                                         session_pool_stats, job_wait_stats)
+from kb_SPAdes.utils.fastq_utils import sniff_phred_type
+from kb_SPAdes.utils.reads_cache import (CorrectedReadsCache, READS_DOWNLOAD_OPTIONS,
+                                         merge_corrected_dataset)
+from kb_SPAdes.utils.settings import load_settings
+from kb_SPAdes.utils.resource_planner import plan_resources, input_size
+from kb_SPAdes.utils.memory_estimator import is_long_read
+from kb_SPAdes.utils.kmer_selector import plan_kmer_sizes
+from kb_SPAdes.utils.spades_supervisor import (STAGES_FILE, run_spades, load_stages,
+                                               stages_report, SPAdesCanceled,
+                                               cancel_group, current_cancel_group)
+from kb_SPAdes.utils.spades_profiler import (timed_step, steps_report, connection_report,
+                                             job_wait_report)
+from kb_SPAdes.utils.fasta_utils import (build_fasta_index, filter_fasta_by_length,
+                                         load_fasta_stats, fasta_filter_report,
+                                         fasta_stats_report)
+from kb_SPAdes.utils.shock_utils import (ShockException,  # noqa: F401
+                                         check_shock_response, upload_file_to_shock)
 
 #END_HEADER
 
@@ -42,8 +54,8 @@ A wrapper for the SPAdes assembler with hybrid features supported.
 http://bioinf.spbau.ru/spades
 
 Always runs in careful mode.
-Runs 3 threads / CPU.
-Maximum memory use is set to available memory - 1G.
+Runs 1 thread / CPU allowed by the container's CPU quota.
+Maximum memory use is set to available memory (within the container's memory limit) - 1G.
 Autodetection is used for the PHRED quality offset and k-mer sizes.
 A coverage cutoff is not specified.
     '''
@@ -72,18 +84,14 @@ A coverage cutoff is not specified.
     PARAM_IN_MIN_CONTIG_LENGTH = 'min_contig_length'
     PARAM_IN_KMER_SIZES = 'kmer_sizes'
     PARAM_IN_SKIP_ERR_CORRECT = 'skip_error_correction'
+    PARAM_IN_KMER_SIZE_SETS = 'kmer_size_sets'
+    PARAM_IN_DNA_SOURCES = 'dna_sources'
+    PARAM_IN_MAX_CONCURRENT = 'max_concurrent_variants'
 
     INVALID_WS_OBJ_NAME_RE = re.compile('[^\\w\\|._-]')
     INVALID_WS_NAME_RE = re.compile('[^\\w:._-]')
 
-    THREADS_PER_CORE = 3
-    MAX_THREADS = 64  # per email thread with Anton Korobeynikov
-    MAX_THREADS_META = 128  # Increase threads for metagenomic assemblies
-    MEMORY_OFFSET_GB = 1  # 1GB
-    MIN_MEMORY_GB = 4
-    MAX_MEMORY_GB_SPADES = 500
-    MAX_MEMORY_GB_META_SPADES = 1000
-    GB = 1000000000
+    MAX_PHRED_CHECK_WORKERS = 8  # concurrent kb_ea_utils phred type checks
 
     URL_WS = 'workspace-url'
     URL_SHOCK = 'shock-url'
@@ -97,39 +105,17 @@ A coverage cutoff is not specified.
               str(time.time()) + ': ' + str(message))
 
     def check_shock_response(self, response, errtxt):
-        if not response.ok:
-            try:
-                err = json.loads(response.content)['error'][0]
-            except:
-                # this means shock is down or not responding.
-                self.log("Couldn't parse response error content from Shock: " +
-                         response.content)
-                response.raise_for_status()
-            raise ShockException(errtxt + str(err))
+        check_shock_response(response, errtxt)
 
     # Helper script borrowed from the transform service, logger removed
     def upload_file_to_shock(self, file_path, token):
         """
-        Use HTTP multi-part POST to save a file to a SHOCK instance.
+        Save a file to a SHOCK instance, in parts of shock-chunk-size-mb sent by
+        shock-upload-workers threads if it is larger than that. A failed upload resumes with
+        the parts not sent yet when it is retried.
         """
-
-        if token is None:
-            raise Exception("Authentication token required!")
-
-        header = {'Authorization': "Oauth {0}".format(token)}
-
-        if file_path is None:
-            raise Exception("No file given for upload to SHOCK!")
-
-        with open(os.path.abspath(file_path), 'rb') as data_file:
-            files = {'upload': data_file}
-            response = requests.post(
-                self.shockURL + '/node', headers=header, files=files,
-                stream=True, allow_redirects=True)
-        self.check_shock_response(
-            response, ('Error trying to upload contig FASTA file {} to Shock: '
-                       ).format(file_path))
-        return response.json()['data']
+        return upload_file_to_shock(self.shockURL, token, file_path, self.shock_chunk_size,
+                                    self.shock_upload_workers)
 
     # spades is configured with yaml
     #
@@ -197,38 +183,34 @@ A coverage cutoff is not specified.
             yaml.safe_dump(yml, yml_file)
         return yml_path, iontorrent_present
 
-    def exec_spades(self, dna_source, reads_data, phred_type, kmer_sizes, skip_error_correction):
-        mem = (psutil.virtual_memory().available / self.GB -
-               self.MEMORY_OFFSET_GB)
-        if mem < self.MIN_MEMORY_GB:
-            raise ValueError(
-                'Only ' + str(psutil.virtual_memory().available) +
-                ' bytes of memory are available. The SPAdes wrapper will' +
-                ' not run without at least ' +
-                str(self.MIN_MEMORY_GB + self.MEMORY_OFFSET_GB) +
-                ' gigabytes available')
-
-        if dna_source == self.PARAM_IN_METAGENOME:
-            max_mem = self.MAX_MEMORY_GB_META_SPADES
-            max_threads = self.MAX_THREADS_META
+    def exec_spades(self, dna_source, reads_data, phred_type, kmer_sizes, skip_error_correction,
+                    outdir=None, dataset_yaml=None, extra_opts=None, concurrent_runs=1):
+        reads_files = [r.get(k) for r in reads_data for k in ('fwd_file', 'rev_file')]
+        plan = plan_resources(dna_source, input_size(reads_files), concurrent_runs)
+
+        # the k-mer sizes are picked for the short reads, and are of no use to a run that only
+        # error corrects them
+        only_error_correction = bool(extra_opts) and '--only-error-correction' in extra_opts
+        kmer_sizes = plan_kmer_sizes(
+            [(r[k], is_long_read(r)) for r in reads_data for k in ('fwd_file', 'rev_file')
+             if r.get(k)],
+            kmer_sizes, plan['memory_gb'], dna_source, auto=self.auto_kmer_sizes,
+            preflight=self.memory_preflight,
+            error_correction=skip_error_correction != 1 and dataset_yaml is None,
+            assembly=not only_error_correction)
+
+        if outdir is None:
+            outdir = os.path.join(self.scratch, 'spades_output_dir')
+            tmpdir = os.path.join(self.scratch, 'spades_tmp_dir')
         else:
-            max_mem = self.MAX_MEMORY_GB_SPADES
-            max_threads = self.MAX_THREADS
-
-        threads = min(max_threads, psutil.cpu_count() * self.THREADS_PER_CORE)
-
-        if mem > max_mem:
-            mem = max_mem
-
-        outdir = os.path.join(self.scratch, 'spades_output_dir')
+            tmpdir = outdir + '_tmp'
         if not os.path.exists(outdir):
             os.makedirs(outdir)
-        tmpdir = os.path.join(self.scratch, 'spades_tmp_dir')
         if not os.path.exists(tmpdir):
             os.makedirs(tmpdir)
 
-        cmd = ['spades.py', '--threads', str(threads),
-               '--memory', str(int(mem)), '-o', outdir, '--tmp-dir', tmpdir]
+        cmd = ['spades.py', '--threads', str(plan['threads']),
+               '--memory', str(plan['memory_gb']), '-o', outdir, '--tmp-dir', tmpdir]
 
         print("THE DNA SOURCE IS : " + str(dna_source))
         if dna_source == self.PARAM_IN_SINGLE_CELL:
@@ -253,17 +235,24 @@ A coverage cutoff is not specified.
                 raise ValueError(error_msg)
         else:
             cmd += ['--careful']
-        cmd += ['--phred-offset', phred_type]
+        if phred_type is not None:
+            cmd += ['--phred-offset', phred_type]
 
         if kmer_sizes is not None:
             cmd += ['-k ' + kmer_sizes]
         if skip_error_correction == 1:
             cmd += ['--only-assembler']
+        if extra_opts:
+            cmd += extra_opts
 
 #        print("LENGTH OF READSDATA IN EXEC: " + str(len(reads_data)))
 #        print("READS DATA: " + str(reads_data))
 #        print("SPADES YAML: " + str(self.generate_spades_yaml(reads_data)))
-        spades_yaml_path, iontorrent_present = self.generate_spades_yaml(reads_data)
+        if dataset_yaml is None:
+            spades_yaml_path, iontorrent_present = self.generate_spades_yaml(reads_data)
+        else:
+            spades_yaml_path = dataset_yaml
+            iontorrent_present = int(any(r['seq_tech'] == "IonTorrent" for r in reads_data))
         if iontorrent_present == 1:
             cmd += ['--iontorrent']
         cmd += ['--dataset', spades_yaml_path]
@@ -271,86 +260,92 @@ A coverage cutoff is not specified.
         print("SPADES CMD:" + str(cmd))
         self.log(cmd)
 
-        if self.DISABLE_SPADES_OUTPUT:
-            with open(os.devnull, 'w') as null:
-                p = subprocess.Popen(cmd, cwd=self.scratch, shell=False,
-                                     stdout=null)
-        else:
-            p = subprocess.Popen(cmd, cwd=self.scratch, shell=False)
-        retcode = p.wait()
+        with self.node_scheduler.reserve('spades.py -o ' + outdir, plan['threads'],
+                                         plan['memory_gb']):
+            supervisor = run_spades(cmd, cwd=self.scratch, echo=not self.DISABLE_SPADES_OUTPUT,
+                                    stages_path=os.path.join(outdir, STAGES_FILE),
+                                    profile_interval=self.profile_interval,
+                                    scratch_dirs=[outdir, tmpdir],
+                                    scratch_policy=self.cancel_scratch_policy)
+        retcode = supervisor.process.returncode
 
         self.log('Return code: ' + str(retcode))
-        if p.returncode != 0:
+        if retcode != 0:
             raise ValueError('Error running SPAdes, return code: ' +
-                             str(retcode) + '\n')
+                             str(retcode) + '\n' + '\n'.join(supervisor.errors))
         return outdir
 
-    # adapted from
-    # https://github.com/kbase/transform/blob/master/plugins/scripts/convert/trns_transform_KBaseFile_AssemblyFile_to_KBaseGenomes_ContigSet.py
-    # which was adapted from an early version of
-    # https://github.com/kbase/transform/blob/master/plugins/scripts/upload/trns_transform_FASTA_DNA_Assembly_to_KBaseGenomes_ContigSet.py
-    def load_stats(self, input_file_name):
-        self.log('Starting conversion of FASTA to KBaseGenomeAnnotations.Assembly')
-        self.log('Building Object.')
-        if not os.path.isfile(input_file_name):
-            raise Exception('The input file name {0} is not a file!'.format(
-                input_file_name))
-        with open(input_file_name, 'r') as input_file_handle:
-            contig_id = None
-            sequence_len = 0
-            fasta_dict = dict()
-            first_header_found = False
-            # Pattern for replacing white space
-            pattern = re.compile(r'\s+')
-            for current_line in input_file_handle:
-                if (current_line[0] == '>'):
-                    # found a header line
-                    # Wrap up previous fasta sequence
-                    if not first_header_found:
-                        first_header_found = True
-                    else:
-                        fasta_dict[contig_id] = sequence_len
-                        sequence_len = 0
-                    fasta_header = current_line.replace('>', '').strip()
-                    try:
-                        contig_id = fasta_header.strip().split(' ', 1)[0]
-                    except:
-                        contig_id = fasta_header.strip()
-                else:
-                    sequence_len += len(re.sub(pattern, '', current_line))
-        # wrap up last fasta sequence, should really make this a method
-        if not first_header_found:
-            raise Exception("There are no contigs in this file")
-        else:
-            fasta_dict[contig_id] = sequence_len
-        return fasta_dict
+    def corrected_reads_key(self, reads_data, phred_type, dna_source):
+        """
+        The corrected reads cache key of a SPAdes run: the input library versions and
+        sequencing technologies, and the options changing the error correction.
+        """
+        libs = sorted([r['reads_upa'], r['type'], r['seq_tech']] for r in reads_data)
+        options = {'phred_offset': phred_type,
+                   'dna_source': dna_source,
+                   'spades_version': os.environ.get('SPADES_VERSION')}
+        return libs, options
 
-    def load_report(self, input_file_name, params, wsname):
-        fasta_stats = self.load_stats(input_file_name)
-        lengths = [fasta_stats[contig_id] for contig_id in fasta_stats]
+    def corrected_dataset(self, reads_data, corrected_yaml, dataset_path):
+        """
+        Write a SPAdes dataset file with the cached corrected reads and the reads of reads_data
+        that are not error corrected, e.g. PacBio reads.
+        """
+        yml_path, iontorrent_present = self.generate_spades_yaml(reads_data)
+        with open(yml_path) as yml_file:
+            input_data_set = yaml.safe_load(yml_file)
+        return merge_corrected_dataset(corrected_yaml, input_data_set, dataset_path)
+
+    def exec_spades_with_corrected_reads(self, dna_source, reads_data, phred_type, kmer_sizes,
+                                         skip_error_correction):
+        """
+        Run SPAdes, reusing the error corrected reads of an earlier run on the same reads when
+        they are cached, and caching the corrected reads of this run otherwise.
+        """
+        if skip_error_correction == 1:
+            return self.exec_spades(dna_source, reads_data, phred_type, kmer_sizes,
+                                    skip_error_correction)
+        libs, options = self.corrected_reads_key(reads_data, phred_type, dna_source)
+        corrected_yaml = self.corrected_reads_cache.get_corrected(libs, options)
+        if corrected_yaml:
+            self.log('Reusing cached error corrected reads, running only the assembler')
+            dataset_yaml = self.corrected_dataset(
+                reads_data, corrected_yaml, os.path.join(self.scratch, 'corrected_run.yaml'))
+            # corrected reads are written with offset 33, let SPAdes detect it
+            return self.exec_spades(dna_source, reads_data, None, kmer_sizes, 1,
+                                    dataset_yaml=dataset_yaml)
+
+        outdir = self.exec_spades(dna_source, reads_data, phred_type, kmer_sizes,
+                                  skip_error_correction)
+        corrected_dir = os.path.join(outdir, 'corrected')
+        if os.path.isfile(os.path.join(corrected_dir, CorrectedReadsCache.DATASET)):
+            self.corrected_reads_cache.put_corrected(libs, options, corrected_dir)
+        return outdir
+
+    def load_report(self, input_file_name, params, wsname, filter_stats=None,
+                    extra_report='', steps=None):
+        fasta_stats = load_fasta_stats(input_file_name)
 
         assembly_ref = params[self.PARAM_IN_WS] + '/' + params[self.PARAM_IN_CS_NAME]
 
         report = ''
         report += 'Assembly saved to: ' + assembly_ref + '\n'
-        report += 'Assembled into ' + str(len(lengths)) + ' contigs.\n'
-        report += 'Avg Length: ' + str(sum(lengths) / float(len(lengths))) + \
-            ' bp.\n'
-
-        # compute a simple contig length distribution
-        bins = 10
-        counts, edges = np.histogram(lengths, bins)  # @UndefinedVariable
-        report += 'Contig Length Distribution (# of contigs -- min to max ' +\
-            'basepairs):\n'
-        for c in range(bins):
-            report += '   ' + str(counts[c]) + '\t--\t' + str(edges[c]) +\
-                ' to ' + str(edges[c + 1]) + ' bp\n'
+        if filter_stats:
+            report += fasta_filter_report(filter_stats)
+        report += fasta_stats_report(fasta_stats)
+        report += extra_report
         print('Running QUAST')
-        kbq = kb_quast(self.callbackURL)
-        quastret = kbq.run_QUAST({'files': [{'path': input_file_name,
-                                             'label': params[self.PARAM_IN_CS_NAME]}]})
+        if steps is None:
+            steps = []
+        with timed_step(steps, 'QUAST'):
+            kbq = pooled(kb_quast(self.callbackURL))
+            quastret = kbq.run_QUAST({'files': [{'path': input_file_name,
+                                                 'label': params[self.PARAM_IN_CS_NAME]}]})
+        report += steps_report(steps)
+        report += connection_report(session_pool_stats())
+        report += job_wait_report(job_wait_stats())
         print('Saving report')
-        kbr = KBaseReport(self.callbackURL)
+        kbr = pooled(KBaseReport(self.callbackURL))
         report_info = kbr.create_extended_report({
             'message': report,
             'objects_created': [{'ref': assembly_ref, 'description': 'Assembled contigs'}],
@@ -369,37 +364,54 @@ A coverage cutoff is not specified.
         return str(object_info[6]) + '/' + str(object_info[0]) + \
             '/' + str(object_info[4])
 
+    def calculate_phred_type(self, file_path):
+        # a sample of the quality strings is usually enough to tell 33 from 64
+        phred_type, confidence = sniff_phred_type(file_path)
+        if phred_type is not None:
+            return phred_type
+        self.log('Phred type of {} is ambiguous in the sample, '.format(file_path) +
+                 'falling back to kb_ea_utils')
+        eautils = pooled(kb_ea_utils(self.callbackURL))
+        ea_stats_dict = eautils.calculate_fastq_stats({'read_library_path': file_path})
+        # print("EA UTILS STATS : " + str(ea_stats_dict))
+        return ea_stats_dict['phred_type']
+
     def determine_unknown_phreds(self, reads,
                                  phred64_reads,
                                  phred33_reads,
                                  unknown_phred_reads,
                                  reftoname):
         print("IN UNKNOWN CHECKING")
-        eautils = kb_ea_utils(self.callbackURL)
+        files_to_check = []
         for ref in unknown_phred_reads:
             rds = reads[ref]
-            obj_name = reftoname[ref]
-            files_to_check = []
             f = rds['files']
             if f['type'] == 'interleaved':
-                files_to_check.append(f['fwd'])
+                files_to_check.append((ref, f['fwd']))
             elif f['type'] == 'paired':
-                files_to_check.append(f['fwd'])
-                files_to_check.append(f['rev'])
+                files_to_check.append((ref, f['fwd']))
+                files_to_check.append((ref, f['rev']))
             elif f['type'] == 'single':
-                files_to_check.append(f['fwd'])
-            # print("FILES TO CHECK:" + str(files_to_check))
-            for file_path in files_to_check:
-                ea_stats_dict = eautils.calculate_fastq_stats({'read_library_path': file_path})
-                # print("EA UTILS STATS : " + str(ea_stats_dict))
-                if ea_stats_dict['phred_type'] == '33':
+                files_to_check.append((ref, f['fwd']))
+        # print("FILES TO CHECK:" + str(files_to_check))
+
+        # each check is a full pass over a FASTQ file in another container, so run them
+        # concurrently and merge the results in submission order
+        workers = max(1, min(self.MAX_PHRED_CHECK_WORKERS, len(files_to_check)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(self.calculate_phred_type, file_path)
+                       for ref, file_path in files_to_check]
+            for (ref, file_path), future in zip(files_to_check, futures):
+                obj_name = reftoname[ref]
+                phred_type = future.result()
+                if phred_type == '33':
                     phred33_reads.add(obj_name)
-                elif ea_stats_dict['phred_type'] == '64':
+                elif phred_type == '64':
                     phred64_reads.add(obj_name)
                 else:
                     raise ValueError(('Reads object {} ({}) phred type is not of the ' +
                                       'expected value of 33 or 64. It had a phred type of ' +
-                                      '{}').format(obj_name, rds, ea_stats_dict['phred_type']))
+                                      '{}').format(obj_name, reads[ref], phred_type))
         return phred64_reads, phred33_reads
 
     def check_reads(self, params, reads, reftoname):
@@ -468,6 +480,131 @@ A coverage cutoff is not specified.
         else:
             raise ValueError('The phred type of the read(s) was unable to be determined')
 
+    def get_reads_data(self, ctx, params):
+        """
+        Fetch the reads libraries of params and check them for SPAdes.
+        Returns the reads data list for exec_spades and the phred type of the reads.
+        """
+        token = ctx['token']
+
+        # get absolute refs from ws
+        wsname = params[self.PARAM_IN_WS]
+        obj_ids = []
+        for r in params[self.PARAM_IN_LIB]:
+            obj_ids.append({'ref': r if '/' in r else (wsname + '/' + r)})
+        ws = pooled(Workspace(self.workspaceURL, token=token))
+        ws_info = ws.get_object_info_new({'objects': obj_ids})
+        reads_params = []
+
+        reftoname = {}
+        reftoupa = {}
+        for wsi, oid in zip(ws_info, obj_ids):
+            ref = oid['ref']
+            reads_params.append(ref)
+            obj_name = wsi[1]
+            reftoname[ref] = wsi[7] + '/' + obj_name
+            reftoupa[ref] = self.make_ref(wsi)
+
+        # reuse libraries already downloaded by an earlier job on this node
+        reads = {}
+        to_download = []
+        for ref in reads_params:
+            cached = self.reads_cache.get(reftoupa[ref], READS_DOWNLOAD_OPTIONS)
+            if cached:
+                reads[ref] = cached
+            else:
+                to_download.append(ref)
+
+        readcli = pooled(ReadsUtils(self.callbackURL, token=ctx['token']))
+
+        typeerr = ('Supported types: KBaseFile.SingleEndLibrary ' +
+                   'KBaseFile.PairedEndLibrary ' +
+                   'KBaseAssembly.SingleEndLibrary ' +
+                   'KBaseAssembly.PairedEndLibrary')
+        try:
+            if to_download:
+                download_params = {'read_libraries': to_download}
+                download_params.update(READS_DOWNLOAD_OPTIONS)
+                downloaded = readcli.download_reads(download_params)['files']
+                for ref in to_download:
+                    reads[ref] = self.reads_cache.put(
+                        reftoupa[ref], READS_DOWNLOAD_OPTIONS, downloaded[ref])
+        except ServerError as se:
+            self.log('logging stacktrace from dynamic client error')
+            self.log(se.data)
+            if typeerr in se.message:
+                prefix = se.message.split('.')[0]
+                raise ValueError(
+                    prefix + '. Only the types ' +
+                    'KBaseAssembly.PairedEndLibrary ' +
+                    'and KBaseFile.PairedEndLibrary are supported')
+            else:
+                raise
+
+        self.log('Got reads data from converter:\n' + pformat(reads))
+
+        phred_type = self.check_reads(params, reads, reftoname)
+
+        reads_data = []
+        for ref in reads:
+            reads_name = reftoname[ref]
+            f = reads[ref]['files']
+#            print ("REF:" + str(ref))
+#            print ("READS REF:" + str(reads[ref]))
+            seq_tech = reads[ref]["sequencing_tech"]
+            if f['type'] == 'interleaved':
+                rds = {'fwd_file': f['fwd'], 'type': 'paired', 'seq_tech': seq_tech}
+            elif f['type'] == 'paired':
+                rds = {'fwd_file': f['fwd'], 'rev_file': f['rev'],
+                       'type': 'paired', 'seq_tech': seq_tech}
+            elif f['type'] == 'single':
+                rds = {'fwd_file': f['fwd'], 'type': 'single', 'seq_tech': seq_tech}
+            else:
+                raise ValueError('Something is very wrong with read lib' + reads_name)
+            # ReadsUtils metadata, used for the pre-flight memory estimate when set
+            rds['read_count'] = reads[ref].get('read_count')
+            rds['total_bases'] = reads[ref].get('total_bases')
+            rds['reads_upa'] = reftoupa[ref]
+            reads_data.append(rds)
+
+        return reads_data, phred_type
+
+    def save_assembly(self, ctx, params, output_contigs, extra_report='', steps=None):
+        """
+        Save the contigs of a SPAdes run to the workspace, filtered by min_contig_length,
+        and create the report. Returns the report name and ref.
+        """
+        if steps is None:
+            steps = []
+        wsname = params[self.PARAM_IN_WS]
+        # index the contigs once so the filter and the report skip rescanning the file
+        build_fasta_index(output_contigs)
+
+        self.log('Uploading FASTA file to Assembly')
+
+        assemblyUtil = pooled(AssemblyUtil(self.callbackURL, token=ctx['token'],
+                                           service_ver='release'))
+
+        filter_stats = None
+        report_file = output_contigs
+        with timed_step(steps, 'Filter and upload assembly'):
+            if params.get('min_contig_length', 0) > 0:
+                # filter locally so only the kept contigs are shipped to AssemblyUtil
+                filter_stats = filter_fasta_by_length(output_contigs,
+                                                      params['min_contig_length'])
+                if filter_stats['kept_contigs'] == 0:
+                    raise ValueError('No contigs of length >= {} bp were assembled.'.format(
+                        params['min_contig_length']))
+                # load report from scaffolds.fasta.filtered.fa
+                report_file = filter_stats['filtered_input']
+            assemblyUtil.save_assembly_from_fasta2(
+                {'file': {'path': report_file},
+                 'workspace_name': wsname,
+                 'assembly_name': params[self.PARAM_IN_CS_NAME]
+                 })
+
+        return self.load_report(report_file, params, wsname, filter_stats, extra_report, steps)
+
     def process_params(self, params):
         if (self.PARAM_IN_WS not in params or
                 not params[self.PARAM_IN_WS]):
@@ -509,6 +646,108 @@ A coverage cutoff is not specified.
         if self.PARAM_IN_SKIP_ERR_CORRECT in params and params[self.PARAM_IN_SKIP_ERR_CORRECT] is not None:
             print("SKIP ERR CORRECTION: " + str(params[self.PARAM_IN_SKIP_ERR_CORRECT]))
 
+    def process_sweep_params(self, params):
+        self.process_params(params)
+        kmer_sets = params.get(self.PARAM_IN_KMER_SIZE_SETS)
+        if not kmer_sets or type(kmer_sets) != list:
+            raise ValueError(self.PARAM_IN_KMER_SIZE_SETS +
+                             ' must be a non-empty list of k-mer size lists')
+        for kmer_sizes in kmer_sets:
+            if not kmer_sizes or type(kmer_sizes) != list:
+                raise ValueError(self.PARAM_IN_KMER_SIZE_SETS +
+                                 ' must be a non-empty list of k-mer size lists')
+            if any(not isinstance(k, int) or k % 2 == 0 or k >= 128 for k in kmer_sizes):
+                raise ValueError('k-mer sizes must be odd integers less than 128: ' +
+                                 str(kmer_sizes))
+            if sorted(kmer_sizes) != kmer_sizes:
+                raise ValueError('k-mer sizes must be listed in ascending order: ' +
+                                 str(kmer_sizes))
+        dna_sources = params.get(self.PARAM_IN_DNA_SOURCES) or [None]
+        for dna_source in dna_sources:
+            if dna_source not in [None, self.PARAM_IN_SINGLE_CELL,
+                                  self.PARAM_IN_METAGENOME, self.PARAM_IN_PLASMID]:
+                raise ValueError('Invalid DNA source ' + str(dna_source))
+        params[self.PARAM_IN_DNA_SOURCES] = dna_sources
+        max_concurrent = params.get(self.PARAM_IN_MAX_CONCURRENT) or 1
+        if not isinstance(max_concurrent, int) or max_concurrent < 1:
+            raise ValueError(self.PARAM_IN_MAX_CONCURRENT + ' must be a positive integer')
+        params[self.PARAM_IN_MAX_CONCURRENT] = max_concurrent
+
+    def run_sweep(self, params, reads_data, phred_type):
+        """
+        Error correct the reads once per DNA source, or reuse their cached corrected reads, then
+        assemble the corrected reads once per k-mer size set. Returns a list of variant dicts
+        with the SPAdes output dir and contig statistics of each assembly, or the error it
+        failed with.
+        """
+        sweep_dir = os.path.join(self.scratch, 'spades_sweep_' + str(uuid.uuid4()))
+        os.makedirs(sweep_dir)
+        skip_error_correction = params.get(self.PARAM_IN_SKIP_ERR_CORRECT) == 1
+
+        variants = []
+        for dna_source in params[self.PARAM_IN_DNA_SOURCES]:
+            dataset_yaml = None
+            if not skip_error_correction:
+                libs, options = self.corrected_reads_key(reads_data, phred_type, dna_source)
+                dataset_yaml = self.corrected_reads_cache.get_corrected(libs, options)
+            if not skip_error_correction and dataset_yaml is None:
+                self.log('Running read error correction for DNA source ' + str(dna_source))
+                ec_out = self.exec_spades(dna_source, reads_data, phred_type, None, 0,
+                                          outdir=os.path.join(sweep_dir,
+                                                              'corrected_' + str(dna_source)),
+                                          extra_opts=['--only-error-correction'])
+                dataset_yaml = self.corrected_reads_cache.put_corrected(
+                    libs, options, os.path.join(ec_out, 'corrected'))
+            if dataset_yaml is not None:
+                dataset_yaml = self.corrected_dataset(
+                    reads_data, dataset_yaml,
+                    os.path.join(sweep_dir, 'corrected_{}.yaml'.format(dna_source)))
+            for kmer_sizes in params[self.PARAM_IN_KMER_SIZE_SETS]:
+                kmer_str = ",".join(str(num) for num in kmer_sizes)
+                variants.append({'dna_source': dna_source,
+                                 'kmer_sizes': kmer_str,
+                                 'dataset_yaml': dataset_yaml,
+                                 'outdir': os.path.join(sweep_dir, 'assembly_{}_{}'.format(
+                                     dna_source, kmer_str.replace(',', '_')))})
+
+        concurrent_runs = min(params[self.PARAM_IN_MAX_CONCURRENT], len(variants))
+        group = current_cancel_group()
+
+        def assemble(variant):
+            try:
+                # corrected reads are written with offset 33, let SPAdes detect it
+                with cancel_group(group, clear=False):
+                    self.exec_spades(variant['dna_source'], reads_data,
+                                     phred_type if variant['dataset_yaml'] is None else None,
+                                     variant['kmer_sizes'], 1, outdir=variant['outdir'],
+                                     dataset_yaml=variant['dataset_yaml'],
+                                     concurrent_runs=concurrent_runs)
+                variant['stats'] = load_fasta_stats(
+                    os.path.join(variant['outdir'], 'scaffolds.fasta'))
+            except SPAdesCanceled:
+                raise
+            except Exception as e:
+                self.log('SPAdes sweep variant {} failed: {}'.format(variant['outdir'], e))
+                variant['error'] = str(e)
+            return variant
+
+        with ThreadPoolExecutor(max_workers=concurrent_runs) as executor:
+            return list(executor.map(assemble, variants))
+
+    def sweep_report(self, variants, best):
+        report = 'Parameter sweep results ({} assemblies, * = saved):\n'.format(len(variants))
+        report += '   dna_source\tk-mer sizes\tcontigs\tN50\ttotal bp\n'
+        for variant in variants:
+            if 'error' in variant:
+                report += '   {}\t{}\tfailed: {}\n'.format(
+                    variant['dna_source'], variant['kmer_sizes'], variant['error'])
+                continue
+            stats = variant['stats']
+            report += '{}  {}\t{}\t{}\t{}\t{}\n'.format(
+                '*' if variant is best else ' ', variant['dna_source'], variant['kmer_sizes'],
+                stats['contig_count'], stats['n50'], stats['total_length'])
+        return report
+
     #END_CLASS_HEADER
 
     # config contains contents of config file in a hash or None if it couldn't
@@ -526,6 +765,22 @@ A coverage cutoff is not specified.
         self.scratch = os.path.abspath(config['scratch'])
         if not os.path.exists(self.scratch):
             os.makedirs(self.scratch)
+        settings = load_settings(config)
+        self.reads_cache = settings['reads_cache']
+        self.corrected_reads_cache = settings['corrected_reads_cache']
+        self.profile_interval = settings['profile_interval']
+        self.shock_chunk_size = settings['shock_chunk_size']
+        self.shock_upload_workers = settings['shock_upload_workers']
+        self.node_scheduler = settings['node_scheduler']
+        self.cancel_scratch_policy = settings['cancel_scratch_policy']
+        # pick the k-mer sizes from the read lengths when none are given, instead of spades.py
+        self.auto_kmer_sizes = settings['auto_kmer_sizes']
+        self.memory_preflight = settings['memory_preflight']
+        # connections kept alive and retries of the session shared by the service clients
+        configure_session_pool(config.get('http-pool-size'), config.get('http-retries'),
+                               config.get('http-retry-backoff'))
+        # wait between the status checks of service jobs, as a share of their run time
+        configure_job_checks(config.get('job-check-ratio'))
         #END_CONSTRUCTOR
         pass
 
@@ -571,74 +826,10 @@ A coverage cutoff is not specified.
         # https://github.com/msneddon/MEGAHIT
         self.log('Running run_SPAdes with params:\n' + pformat(params))
 
-        token = ctx['token']
-
         # the reads should really be specified as a list of absolute ws refs
         # but the narrative doesn't do that yet
         self.process_params(params)
 
-        # get absolute refs from ws
-        wsname = params[self.PARAM_IN_WS]
-        obj_ids = []
-        for r in params[self.PARAM_IN_LIB]:
-            obj_ids.append({'ref': r if '/' in r else (wsname + '/' + r)})
-        ws = Workspace(self.workspaceURL, token=token)
-        ws_info = ws.get_object_info_new({'objects': obj_ids})
-        reads_params = []
-
-        reftoname = {}
-        for wsi, oid in zip(ws_info, obj_ids):
-            ref = oid['ref']
-            reads_params.append(ref)
-            obj_name = wsi[1]
-            reftoname[ref] = wsi[7] + '/' + obj_name
-
-        readcli = ReadsUtils(self.callbackURL, token=ctx['token'])
-
-        typeerr = ('Supported types: KBaseFile.SingleEndLibrary ' +
-                   'KBaseFile.PairedEndLibrary ' +
-                   'KBaseAssembly.SingleEndLibrary ' +
-                   'KBaseAssembly.PairedEndLibrary')
-        try:
-            reads = readcli.download_reads({'read_libraries': reads_params,
-                                            'interleaved': 'false',
-                                            'gzipped': None
-                                            })['files']
-        except ServerError as se:
-            self.log('logging stacktrace from dynamic client error')
-            self.log(se.data)
-            if typeerr in se.message:
-                prefix = se.message.split('.')[0]
-                raise ValueError(
-                    prefix + '. Only the types ' +
-                    'KBaseAssembly.PairedEndLibrary ' +
-                    'and KBaseFile.PairedEndLibrary are supported')
-            else:
-                raise
-
-        self.log('Got reads data from converter:\n' + pformat(reads))
-
-        phred_type = self.check_reads(params, reads, reftoname)
-
-        reads_data = []
-        for ref in reads:
-            reads_name = reftoname[ref]
-            f = reads[ref]['files']
-#            print ("REF:" + str(ref))
-#            print ("READS REF:" + str(reads[ref]))
-            seq_tech = reads[ref]["sequencing_tech"]
-            if f['type'] == 'interleaved':
-                reads_data.append({'fwd_file': f['fwd'], 'type': 'paired',
-                                   'seq_tech': seq_tech})
-            elif f['type'] == 'paired':
-                reads_data.append({'fwd_file': f['fwd'], 'rev_file': f['rev'],
-                                   'type': 'paired', 'seq_tech': seq_tech})
-            elif f['type'] == 'single':
-                reads_data.append({'fwd_file': f['fwd'], 'type': 'single',
-                                   'seq_tech': seq_tech})
-            else:
-                raise ValueError('Something is very wrong with read lib' + reads_name)
-
         kmer_sizes = None
         if self.PARAM_IN_KMER_SIZES in params and params[self.PARAM_IN_KMER_SIZES] is not None:
             if (len(params[self.PARAM_IN_KMER_SIZES])) > 0:
@@ -649,39 +840,24 @@ A coverage cutoff is not specified.
             if params[self.PARAM_IN_SKIP_ERR_CORRECT] == 1:
                 skip_error_correction = 1
 
-        spades_out = self.exec_spades(params[self.PARAM_IN_DNA_SOURCE],
-                                      reads_data,
-                                      phred_type,
-                                      kmer_sizes,
-                                      skip_error_correction)
+        # keep the cached reads of this job from being evicted by other jobs until SPAdes is done
+        steps = []
+        with self.reads_cache.pinned(), self.corrected_reads_cache.pinned():
+            with timed_step(steps, 'Download and check reads'):
+                reads_data, phred_type = self.get_reads_data(ctx, params)
+
+            with timed_step(steps, 'SPAdes'):
+                spades_out = self.exec_spades_with_corrected_reads(
+                    params[self.PARAM_IN_DNA_SOURCE], reads_data, phred_type, kmer_sizes,
+                    skip_error_correction)
 
         self.log('SPAdes output dir: ' + spades_out)
 
         # parse the output and save back to KBase
         output_contigs = os.path.join(spades_out, 'scaffolds.fasta')
-
-        self.log('Uploading FASTA file to Assembly')
-
-        assemblyUtil = AssemblyUtil(self.callbackURL, token=ctx['token'], service_ver='release')
-
-        if params.get('min_contig_length', 0) > 0:
-            filtered_file = assemblyUtil.save_assembly_from_fasta2(
-                {'file': {'path': output_contigs},
-                 'workspace_name': wsname,
-                 'assembly_name': params[self.PARAM_IN_CS_NAME],
-                 'min_contig_length': params['min_contig_length']
-                 })['filtered_input']
-            # load report from scaffolds.fasta.filtered.fa
-            report_name, report_ref = self.load_report(filtered_file, params, wsname)
-        else:
-            assemblyUtil.save_assembly_from_fasta2(
-                {'file': {'path': output_contigs},
-                 'workspace_name': wsname,
-                 'assembly_name': params[self.PARAM_IN_CS_NAME]
-                 })
-            # load report from scaffolds.fasta
-            report_name, report_ref = self.load_report(
-                output_contigs, params, wsname)
+        report_name, report_ref = self.save_assembly(
+            ctx, params, output_contigs,
+            stages_report(load_stages(os.path.join(spades_out, STAGES_FILE))), steps)
 
         output = {'report_name': report_name,
                   'report_ref': report_ref
@@ -816,13 +992,98 @@ A coverage cutoff is not specified.
                              'output is not type dict as required.')
         # return the results
         return [output]
+
+    def run_SPAdes_sweep(self, ctx, params):
+        """
+        Run SPAdes with several k-mer size sets and DNA sources on the same reads and save
+        the best assembly
+        :param params: instance of type "SPAdesSweepParams" (Input parameters
+           for a SPAdes parameter sweep. The reads are downloaded, checked
+           and error corrected once, then one assembly is run per combination
+           of k-mer sizes and DNA source, and the assembly with the best N50
+           is saved. workspace_name - the name of the workspace from which to
+           take input and store output. output_contigset_name - the name of
+           the output contigset of the best assembly read_libraries - a list
+           of Illumina PairedEndLibrary files in FASTQ or BAM format.
+           kmer_size_sets - a list of k-mer size lists, one assembly is run
+           per list (all values must be odd, less than 128 and listed in
+           ascending order) dna_sources - (optional) a list of DNA sources
+           ('single_cell', 'metagenomic', 'plasmid' or None for a standard
+           DNA sample), one assembly is run per DNA source and k-mer size
+           list. Default value is [None]. min_contig_length - (optional)
+           integer to filter out contigs with length < min_contig_length from
+           the best assembly. Default value is 0 implying no filter.
+           skip_error_correction - (optional) Assembly only (No error
+           correction). By default this is disabled. max_concurrent_variants
+           - (optional) the number of assemblies run side by side, sharing
+           the threads and memory of the node. Default value is 1. @optional
+           dna_sources @optional min_contig_length @optional
+           skip_error_correction @optional max_concurrent_variants) ->
+           structure: parameter "workspace_name" of String, parameter
+           "output_contigset_name" of String, parameter "read_libraries" of
+           list of type "paired_end_lib" (The workspace object name of a
+           PairedEndLibrary file, whether of the KBaseAssembly or KBaseFile
+           type.), parameter "kmer_size_sets" of list of list of Long,
+           parameter "dna_sources" of list of String, parameter
+           "min_contig_length" of Long, parameter "skip_error_correction" of
+           type "bool" (A boolean. 0 = false, anything else = true.),
+           parameter "max_concurrent_variants" of Long
+        :returns: instance of type "SPAdesOutput" (Output parameters for
+           SPAdes run. report_name - the name of the KBaseReport.Report
+           workspace object. report_ref - the workspace reference of the
+           report.) -> structure: parameter "report_name" of String,
+           parameter "report_ref" of String
+        """
+        # ctx is the context object
+        # return variables are: output
+        #BEGIN run_SPAdes_sweep
+        self.log('Running run_SPAdes_sweep with params:\n' + pformat(params))
+
+        self.process_sweep_params(params)
+
+        # download, check and error correct the reads once for all variants
+        steps = []
+        with self.reads_cache.pinned(), self.corrected_reads_cache.pinned():
+            with timed_step(steps, 'Download and check reads'):
+                reads_data, phred_type = self.get_reads_data(ctx, params)
+            with timed_step(steps, 'SPAdes sweep'):
+                variants = self.run_sweep(params, reads_data, phred_type)
+
+        assembled = [v for v in variants if 'stats' in v]
+        if not assembled:
+            raise ValueError('All SPAdes sweep assemblies failed:\n' + '\n'.join(
+                '{} {}: {}'.format(v['dna_source'], v['kmer_sizes'], v['error'])
+                for v in variants))
+        best = max(assembled, key=lambda v: (v['stats']['n50'], v['stats']['total_length']))
+        self.log('Best sweep assembly: dna_source {}, k-mer sizes {}'.format(
+            best['dna_source'], best['kmer_sizes']))
+
+        output_contigs = os.path.join(best['outdir'], 'scaffolds.fasta')
+        report_name, report_ref = self.save_assembly(
+            ctx, params, output_contigs,
+            self.sweep_report(variants, best) +
+            stages_report(load_stages(os.path.join(best['outdir'], STAGES_FILE))), steps)
+
+        output = {'report_name': report_name,
+                  'report_ref': report_ref
+                  }
+        #END run_SPAdes_sweep
+
+        # At some point might do deeper type checking...
+        if not isinstance(output, dict):
+            raise ValueError('Method run_SPAdes_sweep return value ' +
+                             'output is not type dict as required.')
+        # return the results
+        return [output]
+
     def status(self, ctx):
         #BEGIN_STATUS
         returnVal = {'state': "OK",
                      'message': "",
                      'version': self.VERSION,
                      'git_url': self.GIT_URL,
-                     'git_commit_hash': self.GIT_COMMIT_HASH}
+                     'git_commit_hash': self.GIT_COMMIT_HASH,
+                     'node_reservations': self.node_scheduler.reservations()}
         del ctx  # shut up pep8
         #END_STATUS
         return [returnVal]
@@ -18,6 +18,8 @@ from jsonrpcbase import ServerError as JSONServerError
 
 from biokbase import log
 from kb_SPAdes.authclient import KBaseAuth as _KBaseAuth
+from kb_SPAdes.utils.spades_supervisor import install_cancel_handlers, cancel_group
+from kb_SPAdes.utils.server_extensions import extend_application
 
 try:
     from ConfigParser import ConfigParser
@@ -350,6 +352,10 @@ class Application(object):
                              name='kb_SPAdes.run_metaSPAdes',
                              types=[dict])
         self.method_authentication['kb_SPAdes.run_metaSPAdes'] = 'required'  # noqa
+        self.rpc_service.add(impl_kb_SPAdes.run_SPAdes_sweep,
+                             name='kb_SPAdes.run_SPAdes_sweep',
+                             types=[dict])
+        self.method_authentication['kb_SPAdes.run_SPAdes_sweep'] = 'required'  # noqa
         self.rpc_service.add(impl_kb_SPAdes.status,
                              name='kb_SPAdes.status',
                              types=[dict])
@@ -496,6 +502,9 @@ class Application(object):
         return "%s%+02d:%02d" % (dtnow.isoformat(), hh, mm)
 
 application = Application()
+# Not generated by kb-sdk, keep it when regenerating this file: adds the JSON-RPC batches and
+# the job methods, see kb_SPAdes/utils/server_extensions.py
+application = extend_application(application, impl_kb_SPAdes, config)
 
 # This is the uwsgi application dictionary. On startup uwsgi will look
 # for this dict and pull its configuration from here.
@@ -616,7 +625,13 @@ if __name__ == "__main__":
                     token = token_file.read()
             else:
                 token = sys.argv[3]
-        sys.exit(process_async_cli(sys.argv[1], sys.argv[2], token))
+        # Not generated by kb-sdk, keep it when regenerating this file: a job runner stopping
+        # the job terminates the spades.py runs too, including the runs of a sweep that have
+        # not started yet
+        with cancel_group('cli'):
+            install_cancel_handlers('cli')
+            exit_code = process_async_cli(sys.argv[1], sys.argv[2], token)
+        sys.exit(exit_code)
     try:
         opts, args = getopt(sys.argv[1:], "", ["port=", "host="])
     except GetoptError as err:
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import random
+import threading
+import time
+import traceback
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError
+from urllib3.exceptions import ProtocolError
+from urllib3.util.retry import Retry
+
+from installed_clients.baseclient import BaseClient, ServerError
+
+
+# One requests session per process is shared by the pooled clients, so JSON-RPC calls reuse
+# kept-alive connections instead of paying TCP/TLS setup each time. The pool size and the
+# retries of failed connection attempts can be set with the environment variables below or
+# with configure_session_pool. Calls are never retried once they have been sent.
+POOL_SIZE = int(os.environ.get('KB_CLIENT_POOL_SIZE', 10))
+POOL_RETRIES = int(os.environ.get('KB_CLIENT_POOL_RETRIES', 3))
+POOL_BACKOFF = float(os.environ.get('KB_CLIENT_POOL_BACKOFF', 0.5))
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+# run_job checks a job after a wait of about JOB_CHECK_RATIO times the time it has run, so
+# the time lost between a job finishing and the check that sees it stays a small share of
+# the job's run time; a larger ratio makes fewer checks and loses more time. Before a job
+# reaches the median duration of the last runs of the same method, it is checked every
+# ratio times that median and never later than it. A ratio of 0 restores the exponential
+# backoff of async_job_check_time_scale_percent.
+JOB_CHECK_RATIO = float(os.environ.get('KB_CLIENT_JOB_CHECK_RATIO', 0.1))
+JOB_HISTORY = 20  # durations kept per method
+CHECK_JOB_RETRYS = 3  # job state checks that may fail to connect before run_job gives up
+_job_durations = {}
+_job_stats = {'jobs': 0, 'checks': 0, 'wait_seconds': 0.0, 'lost_seconds_bound': 0.0}
+_job_lock = threading.Lock()
+
+
+def configure_session_pool(pool_size=None, retries=None, backoff_factor=None):
+    """
+    configure_session_pool: set the number of connections kept per host, the retries of
+    failed connection attempts and their backoff factor (seconds) of the shared session;
+    takes effect for the sessions created after the call
+    """
+    global POOL_SIZE, POOL_RETRIES, POOL_BACKOFF, _session
+    with _session_lock:
+        if pool_size is not None:
+            POOL_SIZE = int(pool_size)
+        if retries is not None:
+            POOL_RETRIES = int(retries)
+        if backoff_factor is not None:
+            POOL_BACKOFF = float(backoff_factor)
+        _session = None
+
+
+def _get_session():
+    global _session, _session_pid
+    with _session_lock:
+        # a forked child must not share the sockets of its parent
+        if _session is None or _session_pid != os.getpid():
+            retry = Retry(total=POOL_RETRIES, connect=POOL_RETRIES, read=0, status=0,
+                          redirect=POOL_RETRIES, backoff_factor=POOL_BACKOFF)
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE,
+                                  max_retries=retry)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+            _session_pid = os.getpid()
+        return _session
+
+
+def session_pool_stats():
+    """
+    session_pool_stats: the number of requests sent by the shared session of this process,
+    and the number of connections opened for them and reused by them
+    """
+    stats = {'requests': 0, 'connections_opened': 0, 'connections_reused': 0}
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            return stats
+        adapters = set(_session.adapters.values())
+    for adapter in adapters:
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats['requests'] += pool.num_requests
+            stats['connections_opened'] += pool.num_connections
+    stats['connections_reused'] = max(0, stats['requests'] - stats['connections_opened'])
+    return stats
+
+
+def configure_job_checks(ratio=None):
+    """
+    configure_job_checks: set the wait between the job state checks of run_job as a share
+    of the time the job has run, see JOB_CHECK_RATIO
+    """
+    global JOB_CHECK_RATIO
+    if ratio is not None:
+        JOB_CHECK_RATIO = float(ratio)
+
+
+def _expected_job_duration(service_method):
+    with _job_lock:
+        durations = sorted(_job_durations.get(service_method, []))
+    if not durations:
+        return None
+    return durations[len(durations) // 2]
+
+
+def _record_job(service_method, duration, checks, wait_seconds, last_wait):
+    with _job_lock:
+        durations = _job_durations.setdefault(service_method, [])
+        durations.append(duration)
+        del durations[:-JOB_HISTORY]
+        _job_stats['jobs'] += 1
+        _job_stats['checks'] += checks
+        _job_stats['wait_seconds'] += wait_seconds
+        # the job finished at some point during the last wait
+        _job_stats['lost_seconds_bound'] += last_wait
+
+
+def job_wait_stats():
+    """
+    job_wait_stats: the number of jobs run_job waited for in this process, the status checks
+    made, the total time spent waiting, and the bound on the time lost between the jobs
+    finishing and the checks that saw them: the sum of the last wait of each job, half of
+    which is lost on average
+    """
+    with _job_lock:
+        return dict(_job_stats)
+
+
+def job_check_wait(client, elapsed, expected, backoff_wait):
+    """
+    job_check_wait: the wait of a client before the next job state check of a job that has
+    run for elapsed seconds and is expected to run for expected seconds (None if unknown);
+    the client's async_job_check_ratio, if set, overrides JOB_CHECK_RATIO
+    """
+    ratio = getattr(client, 'async_job_check_ratio', None)
+    ratio = JOB_CHECK_RATIO if ratio is None else ratio
+    if ratio <= 0:
+        return backoff_wait
+    wait = ratio * elapsed
+    if expected is not None and elapsed < expected:
+        wait = min(max(wait, ratio * expected), expected - elapsed)
+    return min(max(wait, client.async_job_check_time), client.async_job_check_max_time)
+
+
+class _JSONObjectEncoder(json.JSONEncoder):
+
+    def default(self, obj):
+        if isinstance(obj, (set, frozenset)):
+            return list(obj)
+        return json.JSONEncoder.default(self, obj)
+
+
+class PooledBaseClient(BaseClient):
+    """
+    The generated BaseClient posting through a requests session, the shared session of this
+    process unless one is given, and checking the state of jobs with job_check_wait
+    """
+
+    def __init__(self, url=None, session=None, **kwargs):
+        super(PooledBaseClient, self).__init__(url, **kwargs)
+        self.session = session
+
+    @classmethod
+    def from_client(cls, client, session=None):
+        """
+        from_client: a PooledBaseClient with the url, token and settings of a BaseClient
+        """
+        pooled_client = cls.__new__(cls)
+        pooled_client.__dict__.update(vars(client))
+        pooled_client.session = session
+        return pooled_client
+
+    def _call(self, url, method, params, context=None):
+        arg_hash = {'method': method,
+                    'params': params,
+                    'version': '1.1',
+                    'id': str(random.random())[2:]
+                    }
+        if context:
+            if type(context) is not dict:
+                raise ValueError('context is not type dict as required.')
+            arg_hash['context'] = context
+
+        body = json.dumps(arg_hash, cls=_JSONObjectEncoder)
+        session = self.session if self.session is not None else _get_session()
+        ret = session.post(url, data=body, headers=self._headers, timeout=self.timeout,
+                           verify=not self.trust_all_ssl_certificates)
+        ret.encoding = 'utf-8'
+        if ret.status_code == 500:
+            if ret.headers.get('content-type') == 'application/json':
+                err = ret.json()
+                if 'error' in err:
+                    raise ServerError(**err['error'])
+                raise ServerError('Unknown', 0, ret.text)
+            raise ServerError('Unknown', 0, ret.text)
+        if not ret.ok:
+            ret.raise_for_status()
+        resp = ret.json()
+        if 'result' not in resp:
+            raise ServerError('Unknown', 0, 'An unknown server error occurred')
+        if not resp['result']:
+            return
+        if len(resp['result']) == 1:
+            return resp['result'][0]
+        return resp['result']
+
+    def run_job(self, service_method, args, service_ver=None, context=None):
+        """
+        run_job: BaseClient.run_job checking the job state with job_check_wait
+        """
+        mod, _ = service_method.split('.')
+        job_id = self._submit_job(service_method, args, service_ver, context)
+        start = time.time()
+        expected = _expected_job_duration(service_method)
+        async_job_check_time = self.async_job_check_time
+        check_job_failures = 0
+        checks = 0
+        wait_seconds = 0.0
+        while check_job_failures < CHECK_JOB_RETRYS:
+            wait = job_check_wait(self, time.time() - start, expected, async_job_check_time)
+            time.sleep(wait)
+            wait_seconds += wait
+            async_job_check_time = min(
+                async_job_check_time * self.async_job_check_time_scale_percent / 100.0,
+                self.async_job_check_max_time)
+            try:
+                checks += 1
+                job_state = self._check_job(mod, job_id)
+            except (ConnectionError, ProtocolError):
+                traceback.print_exc()
+                check_job_failures += 1
+                continue
+
+            if job_state['finished']:
+                _record_job(service_method, time.time() - start, checks, wait_seconds, wait)
+                if not job_state['result']:
+                    return
+                if len(job_state['result']) == 1:
+                    return job_state['result'][0]
+                return job_state['result']
+        raise RuntimeError('_check_job failed {} times and exceeded limit'.format(
+            check_job_failures))
+
+
+def pooled(client, session=None):
+    """
+    pooled: make a service client generated by kb-sdk, which calls its service through the
+    BaseClient in its _client attribute, use a PooledBaseClient with the same settings
+    instead; only the given client is changed, not the generated classes
+    returns the client
+    """
+    client._client = PooledBaseClient.from_client(client._client, session)
+    return client
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+import os
+import struct
+import time
+
+import numpy as np
+
+
+FASTA_BLOCK_SIZE = 16 * 1024 * 1024  # bytes read from the FASTA file per block
+WHITESPACE = b' \t\r\n\x0b\x0c'
+
+# .fai-style sidecar index: one fixed-width record per contig, memory-mapped on lookup
+FASTA_INDEX_SUFFIX = '.kbidx'
+FASTA_INDEX_MAGIC = b'KBFAIDX1'
+FASTA_INDEX_HEADER = struct.Struct('<8sQQQ')  # magic, fasta size, fasta mtime_ns, contig count
+FASTA_INDEX_DTYPE = np.dtype([('record_start', '<u8'),
+                              ('record_end', '<u8'),
+                              ('length', '<u8'),
+                              ('gc_count', '<u8'),
+                              ('n_count', '<u8')])
+FASTA_INDEX_BATCH = 100000  # contigs buffered in memory while writing the index
+
+
+def log(message, prefix_newline=False):
+    """Logging function, provides a hook to suppress or redirect log messages."""
+    print(('\n' if prefix_newline else '') + '{0:.2f}'.format(time.time()) + ': ' + str(message))
+
+
+def _contig_id(header):
+    """
+    _contig_id: the contig id is the first space-delimited token of a FASTA header line
+    """
+    return header.strip().split(b' ', 1)[0].decode('utf-8', 'replace')
+
+
+def _scan_fasta(fasta_path, block_size=FASTA_BLOCK_SIZE):
+    """
+    _scan_fasta: a single buffered pass over a FASTA file, reading fixed-size blocks instead of
+    lines, yielding a tuple of (contig_id, record_start, record_end, length, gc_count, n_count)
+    for every record, where record_start/record_end are the byte offsets of the record's '>'
+    and of the byte following its last sequence line.
+    Whitespace is stripped with bytes.translate and bases are counted with bytes.count, so the
+    per-base work is done in C rather than in a per-line Python loop.
+    """
+    contig_id = None
+    header = b''
+    in_header = False
+    at_line_start = True
+    record_start = 0
+    seq_len = gc_count = n_count = 0
+    block_offset = 0
+
+    with open(fasta_path, 'rb') as fasta_file:
+        while True:
+            block = fasta_file.read(block_size)
+            if not block:
+                break
+            pos = 0
+            end = len(block)
+            while pos < end:
+                if in_header:
+                    nl = block.find(b'\n', pos)
+                    if nl < 0:
+                        header += block[pos:]
+                        pos = end
+                        at_line_start = False
+                        continue
+                    header += block[pos:nl]
+                    contig_id = _contig_id(header)
+                    header = b''
+                    in_header = False
+                    pos = nl + 1
+                    at_line_start = True
+                    continue
+
+                # a '>' only starts a new record at the beginning of a line
+                gt = block.find(b'>', pos)
+                while gt >= 0 and not (gt == 0 and at_line_start or
+                                       gt > 0 and block[gt - 1:gt] == b'\n'):
+                    gt = block.find(b'>', gt + 1)
+                stop = gt if gt >= 0 else end
+
+                if stop > pos and contig_id is not None:
+                    seq = block[pos:stop].translate(None, WHITESPACE)
+                    seq_len += len(seq)
+                    gc_count += (seq.count(b'G') + seq.count(b'C') +
+                                 seq.count(b'g') + seq.count(b'c'))
+                    n_count += seq.count(b'N') + seq.count(b'n')
+
+                if gt < 0:
+                    at_line_start = block[end - 1:end] == b'\n'
+                    pos = end
+                else:
+                    if contig_id is not None:
+                        yield (contig_id, record_start, block_offset + gt,
+                               seq_len, gc_count, n_count)
+                    seq_len = gc_count = n_count = 0
+                    contig_id = ''
+                    record_start = block_offset + gt
+                    in_header = True
+                    pos = gt + 1
+            block_offset += end
+
+    if in_header:
+        contig_id = _contig_id(header)
+    if contig_id is not None:
+        yield contig_id, record_start, block_offset, seq_len, gc_count, n_count
+
+
+def fasta_index_path(fasta_path):
+    """
+    fasta_index_path: the path of the index sidecar file of a FASTA file
+    """
+    return fasta_path + FASTA_INDEX_SUFFIX
+
+
+def build_fasta_index(fasta_path):
+    """
+    build_fasta_index: scan a FASTA file once and write a .fai-style sidecar next to it.
+    The sidecar is a fixed-size header followed by one fixed-width FASTA_INDEX_DTYPE record per
+    contig, so it can be memory-mapped and consulted without rescanning the FASTA file.
+    The header records the size and mtime of the FASTA file the index was built from.
+    """
+    if not os.path.isfile(fasta_path):
+        raise Exception('The input file name {0} is not a file!'.format(fasta_path))
+
+    log('Building the contig index of {}'.format(fasta_path))
+    fasta_st = os.stat(fasta_path)
+    idx_path = fasta_index_path(fasta_path)
+    tmp_path = idx_path + '.tmp'
+    count = 0
+    with open(tmp_path, 'wb') as idx_file:
+        idx_file.write(b'\0' * FASTA_INDEX_HEADER.size)
+        batch = []
+        for record in _scan_fasta(fasta_path):
+            batch.append(record[1:])
+            if len(batch) >= FASTA_INDEX_BATCH:
+                idx_file.write(np.array(batch, dtype=FASTA_INDEX_DTYPE).tobytes())
+                count += len(batch)
+                batch = []
+        if batch:
+            idx_file.write(np.array(batch, dtype=FASTA_INDEX_DTYPE).tobytes())
+            count += len(batch)
+        idx_file.seek(0)
+        idx_file.write(FASTA_INDEX_HEADER.pack(FASTA_INDEX_MAGIC, fasta_st.st_size,
+                                               fasta_st.st_mtime_ns, count))
+    os.rename(tmp_path, idx_path)
+    log('Indexed {} contigs into {}'.format(count, idx_path))
+    return idx_path
+
+
+def load_fasta_index(fasta_path):
+    """
+    load_fasta_index: memory-map the index sidecar of a FASTA file, building it first if it
+    does not exist or was built from a different version of the FASTA file.
+    returns a read-only numpy record array with the fields of FASTA_INDEX_DTYPE
+    """
+    if not os.path.isfile(fasta_path):
+        raise Exception('The input file name {0} is not a file!'.format(fasta_path))
+
+    idx_path = fasta_index_path(fasta_path)
+    fasta_st = os.stat(fasta_path)
+    header = None
+    if os.path.isfile(idx_path):
+        with open(idx_path, 'rb') as idx_file:
+            header = idx_file.read(FASTA_INDEX_HEADER.size)
+        if len(header) == FASTA_INDEX_HEADER.size:
+            magic, size, mtime_ns, count = FASTA_INDEX_HEADER.unpack(header)
+            if (magic != FASTA_INDEX_MAGIC or size != fasta_st.st_size or
+                    mtime_ns != fasta_st.st_mtime_ns):
+                header = None
+        else:
+            header = None
+    if header is None:
+        build_fasta_index(fasta_path)
+        with open(idx_path, 'rb') as idx_file:
+            magic, size, mtime_ns, count = FASTA_INDEX_HEADER.unpack(
+                idx_file.read(FASTA_INDEX_HEADER.size))
+
+    if count == 0:
+        return np.zeros(0, dtype=FASTA_INDEX_DTYPE)
+    return np.memmap(idx_path, dtype=FASTA_INDEX_DTYPE, mode='r',
+                     offset=FASTA_INDEX_HEADER.size, shape=(count,))
+
+
+def load_fasta_stats(fasta_path, bins=10):
+    """
+    load_fasta_stats: compute contig statistics of a FASTA file from its memory-mapped index,
+    so that only the first call on a given file scans the sequences.
+    returns a dict with the following structure:
+    {
+        'contig_count': number of contigs,
+        'total_length': total number of bases,
+        'min_length': length of the shortest contig,
+        'max_length': length of the longest contig,
+        'avg_length': average contig length,
+        'n50': N50 contig length,
+        'l50': L50 contig count,
+        'gc_content': fraction of G/C bases,
+        'n_count': number of N bases,
+        'histogram': (counts, edges) of the contig length distribution
+    }
+    """
+    log('Computing contig statistics of {}'.format(fasta_path))
+    fasta_index = load_fasta_index(fasta_path)
+    if len(fasta_index) == 0:
+        raise Exception("There are no contigs in this file")
+
+    lengths = np.asarray(fasta_index['length'], dtype=np.int64)
+    contig_count = len(lengths)
+    total_length = int(lengths.sum())
+    total_gc = int(fasta_index['gc_count'].sum())
+    total_n = int(fasta_index['n_count'].sum())
+
+    sorted_lengths = np.sort(lengths)[::-1]
+    l50 = int(np.searchsorted(np.cumsum(sorted_lengths) * 2, total_length)) + 1
+    n50 = int(sorted_lengths[min(l50, contig_count) - 1])
+
+    counts, edges = np.histogram(lengths.astype(np.float64), bins)
+
+    return {'contig_count': contig_count,
+            'total_length': total_length,
+            'min_length': int(lengths.min()),
+            'max_length': int(lengths.max()),
+            'avg_length': total_length / float(contig_count),
+            'n50': n50,
+            'l50': l50,
+            'gc_content': (total_gc / float(total_length - total_n)
+                           if total_length > total_n else 0.0),
+            'n_count': total_n,
+            'histogram': (counts, edges)}
+
+
+def filter_fasta_by_length(fasta_path, min_contig_length, filtered_path=None):
+    """
+    filter_fasta_by_length: write the contigs of a FASTA file that are at least min_contig_length
+    long to filtered_path (default: <fasta_path>.filtered.fa).
+    Records to keep are picked from the memory-mapped index and adjacent kept records are copied
+    as single byte ranges, so the sequences are streamed, never parsed again.
+    returns a dict with the following structure:
+    {
+        'filtered_input': path to the filtered FASTA file,
+        'min_contig_length': the length cutoff,
+        'kept_contigs': number of contigs written,
+        'kept_bases': number of bases written,
+        'dropped_contigs': number of contigs shorter than the cutoff,
+        'dropped_bases': number of bases in the dropped contigs
+    }
+    """
+    if filtered_path is None:
+        filtered_path = fasta_path + '.filtered.fa'
+
+    fasta_index = load_fasta_index(fasta_path)
+    lengths = np.asarray(fasta_index['length'], dtype=np.int64)
+    keep = lengths >= min_contig_length
+    kept_contigs = int(keep.sum())
+    kept_bases = int(lengths[keep].sum())
+    filter_stats = {'filtered_input': filtered_path,
+                    'min_contig_length': min_contig_length,
+                    'kept_contigs': kept_contigs,
+                    'kept_bases': kept_bases,
+                    'dropped_contigs': len(lengths) - kept_contigs,
+                    'dropped_bases': int(lengths.sum()) - kept_bases}
+    log('Filtering contigs shorter than {} bp from {}: keeping {} of {} contigs'.format(
+        min_contig_length, fasta_path, kept_contigs, len(lengths)))
+
+    starts = np.asarray(fasta_index['record_start'][keep], dtype=np.int64)
+    ends = np.asarray(fasta_index['record_end'][keep], dtype=np.int64)
+    # merge runs of consecutive kept records into single byte ranges
+    breaks = np.flatnonzero(starts[1:] != ends[:-1]) + 1
+    run_starts = starts[np.concatenate(([0], breaks))] if kept_contigs else starts
+    run_ends = ends[np.concatenate((breaks - 1, [kept_contigs - 1]))] if kept_contigs else ends
+
+    with open(fasta_path, 'rb') as src, open(filtered_path, 'wb') as dst:
+        for run_start, run_end in zip(run_starts, run_ends):
+            src.seek(run_start)
+            remaining = run_end - run_start
+            while remaining > 0:
+                chunk = src.read(min(FASTA_BLOCK_SIZE, remaining))
+                if not chunk:
+                    break
+                dst.write(chunk)
+                remaining -= len(chunk)
+
+    return filter_stats
+
+
+def fasta_filter_report(filter_stats):
+    """
+    fasta_filter_report: the contig length filter section of the report text
+    """
+    return ('Filtered out {} contigs ({} bp) shorter than {} bp, '
+            'kept {} contigs ({} bp).\n').format(
+                filter_stats['dropped_contigs'], filter_stats['dropped_bases'],
+                filter_stats['min_contig_length'], filter_stats['kept_contigs'],
+                filter_stats['kept_bases'])
+
+
+def fasta_stats_report(fasta_stats):
+    """
+    fasta_stats_report: the contig statistics section of the report text
+    """
+    report_text = 'Assembled into ' + str(fasta_stats['contig_count']) + ' contigs.\n'
+    report_text += 'Avg Length: ' + str(fasta_stats['avg_length']) + ' bp.\n'
+    report_text += 'N50: {} bp, L50: {} contigs.\n'.format(fasta_stats['n50'],
+                                                            fasta_stats['l50'])
+    report_text += 'GC content: {:.2f}%, N bases: {}.\n'.format(
+        100 * fasta_stats['gc_content'], fasta_stats['n_count'])
+
+    # a simple contig length distribution
+    counts, edges = fasta_stats['histogram']
+    report_text += 'Contig Length Distribution (# of contigs -- min to max ' + 'basepairs):\n'
+    for c in range(len(counts)):
+        report_text += ('   ' + str(counts[c]) + '\t--\t' + str(edges[c]) + ' to ' +
+                        str(edges[c + 1]) + ' bp\n')
+    return report_text
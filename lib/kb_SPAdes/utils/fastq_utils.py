@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+import gzip
+import itertools
+import os
+import random
+import time
+
+
+PHRED_SAMPLE_RECORDS = 10000  # records read from the head of a FASTQ file
+PHRED_SAMPLE_BLOCKS = 4  # extra blocks read at random offsets (plain files only)
+PHRED_BLOCK_RECORDS = 1000  # records read from each random block
+PHRED_MIN_CONFIDENCE = 0.01  # minimal share of sampled records carrying decisive qualities
+
+# quality characters below ';' only exist with offset 33; characters above 'J' point to
+# offset 64, but only when no quality is below '@' (Q0 with offset 64), since recent Illumina
+# and corrected reads reach Q42 and more with offset 33; anything else is ambiguous
+PHRED33_ONLY_MAX = ord(';') - 1
+PHRED64_ONLY_MIN = ord('J') + 1
+PHRED64_MIN = ord('@')
+
+
+def log(message, prefix_newline=False):
+    """Logging function, provides a hook to suppress or redirect log messages."""
+    print(('\n' if prefix_newline else '') + '{0:.2f}'.format(time.time()) + ': ' + str(message))
+
+
+def _is_gzipped(fastq_path):
+    with open(fastq_path, 'rb') as fq:
+        return fq.read(2) == b'\x1f\x8b'
+
+
+def open_fastq(fastq_path):
+    """
+    open_fastq: open a plain or gzipped FASTQ file for binary reading
+    """
+    if _is_gzipped(fastq_path):
+        return gzip.open(fastq_path, 'rb')
+    return open(fastq_path, 'rb')
+
+
+def _read_records(lines, max_records):
+    """
+    _read_records: yield (sequence, quality) of up to max_records FASTQ records from an
+    iterator of lines positioned at the start of a record
+    """
+    count = 0
+    for header in lines:
+        seq = next(lines, None)
+        plus = next(lines, None)
+        qual = next(lines, None)
+        if qual is None:
+            return
+        if not header.startswith(b'@') or not plus.startswith(b'+'):
+            return
+        yield seq.rstrip(b'\r\n'), qual.rstrip(b'\r\n')
+        count += 1
+        if count >= max_records:
+            return
+
+
+def _resync(fq, offset):
+    """
+    _resync: seek a plain FASTQ file to offset and return an iterator of lines positioned
+    at the next record start, or None if no record start is found in the following lines
+    """
+    fq.seek(offset)
+    fq.readline()  # skip the partial line
+    window = [fq.readline() for _ in range(8)]
+    for i in range(4):
+        header, seq, plus, qual = window[i:i + 4]
+        if (header.startswith(b'@') and plus.startswith(b'+') and
+                len(seq.rstrip(b'\r\n')) == len(qual.rstrip(b'\r\n'))):
+            return itertools.chain(window[i:], iter(fq.readline, b''))
+    return None
+
+
+def sample_fastq_records(fastq_path, max_records=PHRED_SAMPLE_RECORDS,
+                         random_blocks=0, block_records=PHRED_BLOCK_RECORDS, seed=None):
+    """
+    sample_fastq_records: yield (sequence, quality) pairs of the first max_records records of
+    a FASTQ file, followed by block_records records from each of random_blocks random offsets.
+    Random blocks are only read from plain files, since seeking in a gzip stream means
+    decompressing everything before the offset.
+    """
+    head_records = 0
+    with open_fastq(fastq_path) as fq:
+        for record in _read_records(iter(fq.readline, b''), max_records):
+            head_records += 1
+            yield record
+
+    # nothing left to sample if the head already covered the whole file
+    if random_blocks <= 0 or head_records < max_records or _is_gzipped(fastq_path):
+        return
+    size = os.path.getsize(fastq_path)
+    rng = random.Random(seed)
+    with open(fastq_path, 'rb') as fq:
+        for offset in sorted(rng.randrange(size) for _ in range(random_blocks)):
+            # the block is consumed lazily, so only block_records records are ever read
+            lines = _resync(fq, offset)
+            if lines is None:
+                continue
+            for record in _read_records(lines, block_records):
+                yield record
+
+
+def sniff_phred_type(fastq_path, max_records=PHRED_SAMPLE_RECORDS,
+                     random_blocks=PHRED_SAMPLE_BLOCKS):
+    """
+    sniff_phred_type: decide the phred offset of a FASTQ file from a sample of its records.
+    returns a tuple of (phred_type, confidence) where phred_type is '33', '64' or None when the
+    sample is ambiguous, and confidence is the share of sampled records that carry quality
+    characters only valid with that offset.
+    """
+    records = phred33_records = phred64_records = 0
+    min_qual = 255
+    for seq, qual in sample_fastq_records(fastq_path, max_records, random_blocks):
+        if not qual:
+            continue
+        records += 1
+        lo = min(qual)
+        hi = max(qual)
+        min_qual = min(min_qual, lo)
+        if lo <= PHRED33_ONLY_MAX:
+            phred33_records += 1
+        if hi >= PHRED64_ONLY_MIN:
+            phred64_records += 1
+
+    phred_type = None
+    confidence = 0.0
+    if records:
+        if min_qual <= PHRED33_ONLY_MAX:
+            phred_type = '33'
+            confidence = phred33_records / float(records)
+        elif min_qual >= PHRED64_MIN and phred64_records:
+            phred_type = '64'
+            confidence = phred64_records / float(records)
+    if phred_type is not None and confidence < PHRED_MIN_CONFIDENCE:
+        phred_type = None
+
+    log('Sampled {} records of {}: phred type {}, confidence {:.3f}'.format(
+        records, fastq_path, phred_type, confidence))
+    return phred_type, confidence
+
+
+def estimate_fastq_size(fastq_path, max_records=PHRED_SAMPLE_RECORDS):
+    """
+    estimate_fastq_size: estimate the read count and total bases of a plain or gzipped FASTQ
+    file from its first max_records records, scaling by the share of the (compressed) file they
+    occupy. Exact when the file holds no more than max_records records.
+    returns a tuple of (read_count, total_bases)
+    """
+    records = bases = 0
+    with open(fastq_path, 'rb') as raw:
+        fq = gzip.GzipFile(fileobj=raw) if _is_gzipped(fastq_path) else raw
+        for seq, qual in _read_records(iter(fq.readline, b''), max_records):
+            records += 1
+            bases += len(seq)
+        consumed = raw.tell()
+    if records < max_records or not consumed:
+        return records, bases
+    scale = os.path.getsize(fastq_path) / float(consumed)
+    return int(records * scale), int(bases * scale)
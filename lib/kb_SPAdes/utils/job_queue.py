@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+
+import psutil
+
+from kb_SPAdes.utils.resource_planner import node_capacity
+from kb_SPAdes.utils.spades_supervisor import cancel_group, cancel_runs
+
+
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+ERROR = 'error'
+CANCELED = 'canceled'
+FINISHED_STATES = (COMPLETED, ERROR, CANCELED)
+
+JOB_QUEUE_DIR = 'job_queue'
+MAX_QUEUED_JOBS = 20
+JOB_THREADS = 8  # threads reserved for each running job
+JOB_MEMORY_GB = 32  # memory reserved for each running job
+DISPATCH_INTERVAL = 1  # seconds between looks for cancel requests and free resources
+CANCEL_SUFFIX = '.cancel'
+LOST_ERROR = 'JobLost'
+
+
+def log(message, prefix_newline=False):
+    """Logging function, provides a hook to suppress or redirect log messages."""
+    print(('\n' if prefix_newline else '') + '{0:.2f}'.format(time.time()) + ': ' + str(message))
+
+
+def _process_start_time(pid):
+    try:
+        return psutil.Process(pid).create_time()
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+        return None
+
+
+class JobQueue(object):
+    """
+    Runs long server methods (the assemblies) as jobs on threads of this process, so the
+    WSGI worker that submitted one is free again as soon as it has the job id.
+    Jobs start in submission order when the threads and memory reserved for each of them fit
+    into what is left of the node by the running jobs (a job that does not fit at all runs
+    alone); at most max_queued jobs wait, more are refused.
+    The state of every job is saved as JSON in queue_dir, so any server process can report it,
+    and a cancel request is a marker file there that the process running the job picks up.
+    The jobs are not persistent: they only run as long as the process that queued them, and
+    a job whose process ended first (e.g. a worker recycled or restarted) is reported as
+    failed with a JobLost error by any process on the same host.
+    """
+
+    def __init__(self, queue_dir, job_threads=JOB_THREADS, job_memory_gb=JOB_MEMORY_GB,
+                 max_queued=MAX_QUEUED_JOBS, capacity=None):
+        self.queue_dir = queue_dir
+        self.job_threads = job_threads
+        self.job_memory_gb = job_memory_gb
+        self.max_queued = max_queued
+        self.capacity = capacity or node_capacity()
+        self._queued = deque()
+        self._running = {}
+        self._jobs = {}
+        self._lock = threading.Condition()
+        self._dispatcher = None
+
+    def _job_path(self, job_id):
+        # job ids are uuids, never paths
+        return os.path.join(self.queue_dir, os.path.basename(job_id) + '.json')
+
+    def _cancel_path(self, job_id):
+        return os.path.join(self.queue_dir, os.path.basename(job_id) + CANCEL_SUFFIX)
+
+    def _save(self, job):
+        if not os.path.isdir(self.queue_dir):
+            os.makedirs(self.queue_dir, exist_ok=True)
+        path = self._job_path(job['job_id'])
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as job_file:
+            json.dump(job, job_file, default=str)
+        os.rename(tmp_path, path)
+
+    def _load(self, job_id):
+        try:
+            with open(self._job_path(job_id)) as job_file:
+                return json.load(job_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def submit(self, ctx, method_name, method, params):
+        """
+        submit: queue a call of method(ctx, *params)
+        returns the job id
+        """
+        with self._lock:
+            if len(self._queued) >= self.max_queued:
+                raise ValueError('The job queue is full ({} jobs waiting), please try again '
+                                 'later'.format(len(self._queued)))
+            job_id = str(uuid.uuid4())
+            job = {'job_id': job_id, 'method': method_name, 'user_id': ctx.get('user_id'),
+                   'job_state': QUEUED, 'creation_time': time.time(),
+                   'host': socket.gethostname(), 'pid': os.getpid(),
+                   'process_start_time': _process_start_time(os.getpid()),
+                   'exec_start_time': None, 'finish_time': None,
+                   'resources': {'threads': self.job_threads,
+                                 'memory_gb': self.job_memory_gb},
+                   'result': None, 'error': None}
+            self._jobs[job_id] = (job, ctx, method, params)
+            self._queued.append(job_id)
+            self._save(job)
+            self._start_dispatcher()
+            self._lock.notify()
+        log('Queued job {} ({}), {} jobs waiting'.format(job_id, method_name,
+                                                          len(self._queued)))
+        return job_id
+
+    def check(self, job_id, user_id=None):
+        """
+        check: the state of a job, in the form of the _check_job of the KBase job services:
+        'finished' is 1 once it has completed, failed or been canceled, 'result' holds the
+        return value of the method and 'error' the error it raised
+        """
+        job = self._load(job_id)
+        if job is None or (user_id is not None and job['user_id'] not in (None, user_id)):
+            raise ValueError('No such job: {}'.format(job_id))
+        if job['job_state'] not in FINISHED_STATES and self._lost(job):
+            job['error'] = {'name': LOST_ERROR, 'code': -32000, 'error': None,
+                            'message': 'The server process running the job ended before it '
+                                       'finished, please submit it again'}
+            job['result'] = None
+            self._finish(job, ERROR)
+        job['finished'] = 1 if job['job_state'] in FINISHED_STATES else 0
+        if job['job_state'] == QUEUED:
+            job['position'] = self._queue_position(job_id)
+        return job
+
+    def cancel(self, job_id, user_id=None):
+        """
+        cancel: ask for a job to be canceled. A queued job is dropped; the spades.py runs of a
+        running job are terminated, and the job is marked canceled when it ends.
+        returns the state of the job
+        """
+        job = self.check(job_id, user_id)
+        if not job['finished']:
+            open(self._cancel_path(job_id), 'w').close()
+            with self._lock:
+                self._lock.notify()
+        return job
+
+    @staticmethod
+    def _lost(job):
+        """
+        _lost: whether the process that queued an unfinished job is gone; the processes of
+        other hosts cannot be looked up, their jobs are never taken for lost
+        """
+        if job.get('host') != socket.gethostname() or job.get('pid') is None:
+            return False
+        return _process_start_time(job['pid']) != job.get('process_start_time')
+
+    def _queue_position(self, job_id):
+        with self._lock:
+            if job_id in self._queued:
+                return list(self._queued).index(job_id) + 1
+        return None
+
+    def _start_dispatcher(self):
+        if self._dispatcher is None or not self._dispatcher.is_alive():
+            self._dispatcher = threading.Thread(target=self._dispatch)
+            self._dispatcher.daemon = True
+            self._dispatcher.start()
+
+    def _cancel_requested(self, job_id):
+        return os.path.exists(self._cancel_path(job_id))
+
+    def _fits(self, job):
+        if not self._running:
+            return True
+        threads = sum(j['resources']['threads'] for j in self._running.values())
+        memory_gb = sum(j['resources']['memory_gb'] for j in self._running.values())
+        return (threads + job['resources']['threads'] <= self.capacity['threads'] and
+                memory_gb + job['resources']['memory_gb'] <= self.capacity['memory_gb'])
+
+    def _dispatch(self):
+        while True:
+            with self._lock:
+                for job_id in list(self._queued):
+                    if self._cancel_requested(job_id):
+                        self._queued.remove(job_id)
+                        job = self._jobs.pop(job_id)[0]
+                        self._finish(job, CANCELED)
+                for job_id, job in self._running.items():
+                    if not job.get('cancel_requested') and self._cancel_requested(job_id):
+                        job['cancel_requested'] = True
+                        self._save(job)
+                        # terminating spades.py takes up to its grace period
+                        stopper = threading.Thread(target=cancel_runs,
+                                                   args=(job_id, 'job canceled'))
+                        stopper.daemon = True
+                        stopper.start()
+                while self._queued and self._fits(self._jobs[self._queued[0]][0]):
+                    job_id = self._queued.popleft()
+                    job, ctx, method, params = self._jobs.pop(job_id)
+                    job['job_state'] = RUNNING
+                    job['exec_start_time'] = time.time()
+                    self._running[job_id] = job
+                    self._save(job)
+                    runner = threading.Thread(target=self._run, args=(job, ctx, method, params))
+                    runner.daemon = True
+                    runner.start()
+                if not self._queued and not self._running:
+                    self._dispatcher = None
+                    return
+                self._lock.wait(DISPATCH_INTERVAL)
+
+    def _run(self, job, ctx, method, params):
+        log('Starting job {} ({}) with {} threads and {} GB reserved'.format(
+            job['job_id'], job['method'], job['resources']['threads'],
+            job['resources']['memory_gb']))
+        state = COMPLETED
+        try:
+            with cancel_group(job['job_id']):
+                job['result'] = method(ctx, *params)
+        except Exception as e:
+            state = ERROR
+            job['error'] = {'name': type(e).__name__, 'code': -32000,
+                            'message': str(e), 'error': traceback.format_exc()}
+        with self._lock:
+            self._running.pop(job['job_id'], None)
+            if job.get('cancel_requested') or self._cancel_requested(job['job_id']):
+                state = CANCELED
+                job['result'] = None
+            self._finish(job, state)
+            self._lock.notify()
+
+    def _finish(self, job, state):
+        job['job_state'] = state
+        job['finish_time'] = time.time()
+        self._save(job)
+        if self._cancel_requested(job['job_id']):
+            os.remove(self._cancel_path(job['job_id']))
+        log('Job {} ({}) {}'.format(job['job_id'], job['method'], state))
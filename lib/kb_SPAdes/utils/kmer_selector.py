@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+import time
+
+from kb_SPAdes.utils.fastq_utils import sample_fastq_records
+from kb_SPAdes.utils.memory_estimator import (DEFAULT_KMER_SIZES, DEFAULT_KMER_SIZES_LONG_READS,
+                                              LONG_READ_LENGTH, fastq_stats,
+                                              preflight_memory_check)
+
+
+KMER_SAMPLE_RECORDS = 10000  # records read from the head of each FASTQ file
+KMER_SAMPLE_BLOCKS = 4  # extra blocks read at random offsets (plain files only)
+KMER_SAMPLE_SEED = 0  # the same reads give the same k-mer sizes, e.g. when a job is retried
+
+# the k-mer sizes the SPAdes manual recommends for reads of 2x150 (up to 77) and 2x250 bp
+KMER_LADDER = [21, 33, 55, 77, 99, 127]
+# largest k as a share of the median read length; larger k leave too few k-mers per read to
+# bridge the coverage gaps they are meant to resolve
+KMER_READ_FRACTION = 0.6
+# largest k by DNA source: metagenomes rarely have the coverage for k > 77, and each k costs
+# more there
+KMER_MAX = {None: 127, 'metagenomic': 77}
+# rnaSPAdes runs about a third and a half of the read length
+RNA = 'rna'
+RNA_KMER_FRACTIONS = (1 / 3.0, 1 / 2.0)
+MIN_K = 21
+MAX_K = 127
+
+# rough run time model: a K iteration costs about ITERATION_COST_K + k, the fixed part being
+# the graph simplification and read mapping that do not grow with k
+ITERATION_COST_K = 50
+
+
+def log(message, prefix_newline=False):
+    """Logging function, provides a hook to suppress or redirect log messages."""
+    print(('\n' if prefix_newline else '') + '{0:.2f}'.format(time.time()) + ': ' + str(message))
+
+
+def read_length_distribution(fastq_paths, max_records=KMER_SAMPLE_RECORDS,
+                             random_blocks=KMER_SAMPLE_BLOCKS):
+    """
+    read_length_distribution: the read lengths of a sample of the records of FASTQ files
+    returns a dict with the sampled 'reads' and the 'min', 'p10', 'median', 'p90', 'max' and
+    'mean' read length, all 0 if no read was sampled
+    """
+    lengths = []
+    for fastq_path in fastq_paths:
+        lengths.extend(len(seq) for seq, qual in sample_fastq_records(
+            fastq_path, max_records, random_blocks, seed=KMER_SAMPLE_SEED))
+    lengths.sort()
+    if not lengths:
+        return {'reads': 0, 'min': 0, 'p10': 0, 'median': 0, 'p90': 0, 'max': 0, 'mean': 0}
+
+    def percentile(p):
+        return lengths[min(len(lengths) - 1, int(len(lengths) * p))]
+    return {'reads': len(lengths),
+            'min': lengths[0],
+            'p10': percentile(0.1),
+            'median': percentile(0.5),
+            'p90': percentile(0.9),
+            'max': lengths[-1],
+            'mean': sum(lengths) / float(len(lengths))}
+
+
+def _odd(k):
+    k = int(k)
+    return k if k % 2 else k - 1
+
+
+def choose_kmer_sizes(distribution, dna_source=None):
+    """
+    choose_kmer_sizes: the k-mer sizes for reads of a read length distribution: the KMER_LADDER
+    up to KMER_READ_FRACTION of the median length, capped by DNA source, or the third and the
+    half of the median length for RNA
+    returns a tuple of (kmer_sizes, reason)
+    """
+    median = distribution['median']
+    if dna_source == RNA:
+        sizes = sorted(set(min(MAX_K, max(MIN_K, _odd(median * f)))
+                           for f in RNA_KMER_FRACTIONS))
+        return sizes, 'a third and half of the median read length {} bp'.format(median)
+    limit = min(KMER_MAX.get(dna_source, KMER_MAX[None]), median * KMER_READ_FRACTION)
+    sizes = [k for k in KMER_LADDER if k <= limit] or KMER_LADDER[:1]
+    return sizes, 'k up to {:.0f} for the median read length {} bp{}'.format(
+        limit, median, ' ({} cap)'.format(dna_source) if dna_source and dna_source in KMER_MAX
+        else '')
+
+
+def default_kmer_sizes(distribution):
+    """
+    default_kmer_sizes: the k-mer sizes spades.py picks itself for reads of a read length
+    distribution
+    """
+    if distribution['median'] >= LONG_READ_LENGTH:
+        return list(DEFAULT_KMER_SIZES_LONG_READS)
+    return list(DEFAULT_KMER_SIZES)
+
+
+def estimate_kmer_runtime(kmer_sizes):
+    """
+    estimate_kmer_runtime: the relative run time of the K iterations of an assembly with
+    kmer_sizes, in units of k
+    """
+    return sum(ITERATION_COST_K + k for k in kmer_sizes)
+
+
+def select_kmer_sizes(fastq_paths, dna_source=None, reference=None):
+    """
+    select_kmer_sizes: pick the k-mer sizes of an assembly of the reads in fastq_paths from
+    their read length distribution, see choose_kmer_sizes, and log the choice with its
+    estimated assembly run time against the reference k-mer sizes (by default those spades.py
+    would pick). The largest k-mer sizes are dropped while the assembly is estimated to take
+    longer than with the reference ones, so the choice never costs more time than them.
+    returns a dict with the 'kmer_sizes', the read length 'distribution', the 'reference'
+    k-mer sizes, the estimated run time 'savings' as a share of theirs (0 or more) and the
+    'reason'
+    """
+    distribution = read_length_distribution(fastq_paths)
+    if not distribution['reads']:
+        raise ValueError('No reads found to pick k-mer sizes from in {}'.format(
+            ', '.join(fastq_paths)))
+    sizes, reason = choose_kmer_sizes(distribution, dna_source)
+    reference = sorted(reference) if reference else default_kmer_sizes(distribution)
+    reference_runtime = estimate_kmer_runtime(reference)
+    if estimate_kmer_runtime(sizes) > reference_runtime:
+        while len(sizes) > 1 and estimate_kmer_runtime(sizes) > reference_runtime:
+            sizes = sizes[:-1]
+        if estimate_kmer_runtime(sizes) > reference_runtime:
+            sizes = list(reference)
+        reason += ', trimmed to take no longer than k-mer sizes {}'.format(reference)
+    savings = 1 - estimate_kmer_runtime(sizes) / float(estimate_kmer_runtime(reference))
+    log('Picked k-mer sizes {} for {} sampled reads of {}-{} bp (median {}, p10 {}, p90 {}): '
+        '{}; estimated assembly run time {:+.0f}% against k-mer sizes {}'.format(
+            sizes, distribution['reads'], distribution['min'], distribution['max'],
+            distribution['median'], distribution['p10'], distribution['p90'], reason,
+            0.0 - 100 * savings, reference))
+    return {'kmer_sizes': sizes,
+            'distribution': distribution,
+            'reference': reference,
+            'savings': savings,
+            'reason': reason}
+
+
+def plan_kmer_sizes(fastq_files, kmer_sizes, memory_gb, dna_source=None, auto=True,
+                    preflight=True, error_correction=True, assembly=True, reference=None):
+    """
+    plan_kmer_sizes: the k-mer sizes of a spades.py run on the FASTQ files, a list of
+    (path, long_reads) tuples:
+    - with auto, when no kmer_sizes are given and the run assembles, they are picked from the
+      short reads with select_kmer_sizes, against the reference k-mer sizes
+    - with preflight, the run is checked to fit in memory_gb with preflight_memory_check,
+      which drops the largest k-mer sizes or raises a ValueError if it does not
+    kmer_sizes is a comma separated string, or None for the spades.py defaults
+    returns the comma separated k-mer sizes to run with, or None for the spades.py defaults
+    """
+    short_read_files = [path for path, long_reads in fastq_files if not long_reads]
+    if not kmer_sizes and auto and assembly and short_read_files:
+        kmer_sizes = ','.join(str(k) for k in select_kmer_sizes(
+            short_read_files, dna_source, reference=reference)['kmer_sizes'])
+
+    # fail fast, or drop the largest k-mer sizes, rather than run out of memory hours in
+    if preflight:
+        read_count, total_bases, long_bases = fastq_stats(fastq_files)
+        run_kmer_sizes = preflight_memory_check(
+            memory_gb, total_bases, read_count,
+            [int(k) for k in kmer_sizes.split(',')] if kmer_sizes else None, dna_source,
+            error_correction=error_correction, assembly=assembly, long_bases=long_bases)
+        if run_kmer_sizes is not None:
+            kmer_sizes = ','.join(str(k) for k in run_kmer_sizes)
+    return kmer_sizes or None
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import time
+
+from kb_SPAdes.utils.fastq_utils import estimate_fastq_size
+
+
+GB = 1000000000
+
+# A rough peak memory model of spades.py, fitted to the runs we have profiled:
+# - BayesHammer holds about HAMMER_BYTES_PER_BASE bytes of k-mer counts per input base.
+# - The assembler's de Bruijn graph holds the solid k-mers plus the erroneous k-mers left
+#   after error correction. Every remaining error produces up to k erroneous k-mers, so the
+#   k-mer count grows with the largest k. Metagenomes and single cells (uneven coverage) keep
+#   more of them.
+# - Paired read info costs about READ_BYTES per read, and long reads cost about
+#   LONG_READ_BYTES_PER_BASE for their graph alignments.
+BASE_MEMORY_GB = 1.0
+HAMMER_BYTES_PER_BASE = 2.0
+KMERS_PER_BASE = {None: 0.1, 'single_cell': 0.15, 'plasmid': 0.1, 'metagenomic': 0.2}
+KMER_BYTES = 32
+REFERENCE_K = 55  # largest k the KMERS_PER_BASE rates were measured with
+READ_BYTES = 16
+LONG_READ_BYTES_PER_BASE = 2.0
+
+# the k-mer sizes spades.py picks itself when none are given
+DEFAULT_KMER_SIZES = [21, 33, 55]
+DEFAULT_KMER_SIZES_LONG_READS = [21, 33, 55, 77]
+LONG_READ_LENGTH = 150  # average read length from which spades.py adds k=77
+
+# long reads by SPAdes dataset library type, and by ReadsUtils sequencing technology (lower case)
+LONG_READ_TYPES = ('pacbio', 'nanopore')
+LONG_READ_TECHS = ('pacbio clr', 'pacbio ccs', 'nanopore', 'oxford nanopore')
+CONTIG_TYPES = ('trusted-contigs', 'untrusted-contigs')
+
+
+def log(message, prefix_newline=False):
+    """Logging function, provides a hook to suppress or redirect log messages."""
+    print(('\n' if prefix_newline else '') + '{0:.2f}'.format(time.time()) + ': ' + str(message))
+
+
+def is_long_read(lib):
+    """
+    is_long_read: whether a reads library holds long reads, from its SPAdes dataset library
+    'type' (the hybrid app) or its ReadsUtils 'seq_tech' (the SPAdes apps)
+    """
+    return (lib.get('type') in LONG_READ_TYPES or
+            str(lib.get('seq_tech') or '').lower() in LONG_READ_TECHS)
+
+
+def fastq_stats(fastq_files):
+    """
+    fastq_stats: short read count, short read bases and long read bases of FASTQ files,
+    sampled from them; fastq_files is a list of (path, long_reads) tuples
+    returns a tuple of (read_count, total_bases, long_bases)
+    """
+    read_count = total_bases = long_bases = 0
+    for fastq_path, long_reads in fastq_files:
+        count, bases = estimate_fastq_size(fastq_path)
+        if long_reads:
+            long_bases += bases
+        else:
+            read_count += count
+            total_bases += bases
+    return read_count, total_bases, long_bases
+
+
+def default_kmer_sizes(read_count, total_bases):
+    """
+    default_kmer_sizes: the k-mer sizes spades.py would pick for reads of this average length
+    """
+    if read_count and total_bases / float(read_count) >= LONG_READ_LENGTH:
+        return list(DEFAULT_KMER_SIZES_LONG_READS)
+    return list(DEFAULT_KMER_SIZES)
+
+
+def estimate_spades_memory(total_bases, read_count, kmer_sizes, dna_source=None,
+                           error_correction=True, assembly=True, long_bases=0):
+    """
+    estimate_spades_memory: predict the peak memory in GB of a spades.py run
+    returns a dict with the predicted 'peak_gb' and the 'hammer_gb' and 'assembly_gb' peaks of
+    the error correction and assembly stages
+    """
+    hammer_gb = 0.0
+    if error_correction:
+        hammer_gb = total_bases * HAMMER_BYTES_PER_BASE / GB
+    assembly_gb = 0.0
+    if assembly:
+        kmers = (total_bases * KMERS_PER_BASE.get(dna_source, KMERS_PER_BASE[None]) *
+                 max(kmer_sizes) / float(REFERENCE_K))
+        assembly_gb = (kmers * KMER_BYTES + read_count * READ_BYTES +
+                       long_bases * LONG_READ_BYTES_PER_BASE) / GB
+    return {'peak_gb': BASE_MEMORY_GB + max(hammer_gb, assembly_gb),
+            'hammer_gb': hammer_gb,
+            'assembly_gb': assembly_gb}
+
+
+def preflight_memory_check(memory_gb, total_bases, read_count, kmer_sizes=None,
+                           dna_source=None, error_correction=True, assembly=True,
+                           long_bases=0):
+    """
+    preflight_memory_check: make sure the assembly of a spades.py run is predicted to fit in
+    memory_gb before launching it. If it is not, the largest k-mer sizes are dropped one at a
+    time (each one costs less memory than the next) until it fits. Raises a ValueError if it
+    does not fit with a single k-mer size. Error correction only gets a warning when it is
+    predicted not to fit: BayesHammer splits its k-mer counting to stay within --memory, so
+    it runs slower rather than running out of memory.
+    kmer_sizes is a list of ints, or None for the spades.py defaults.
+    returns the k-mer sizes to run with: kmer_sizes unchanged if the run fits, a shorter list
+    otherwise
+    """
+    sizes = sorted(kmer_sizes) if kmer_sizes else default_kmer_sizes(read_count, total_bases)
+    while True:
+        estimate = estimate_spades_memory(total_bases, read_count, sizes, dna_source,
+                                          error_correction, assembly, long_bases)
+        log('Predicted SPAdes peak memory {:.1f} GB of {} GB available for {:.2f} Gbases, '
+            '{} reads, k-mer sizes {} (error correction {:.1f} GB, assembly {:.1f} GB)'.format(
+                estimate['peak_gb'], memory_gb, total_bases / float(GB), read_count, sizes,
+                estimate['hammer_gb'], estimate['assembly_gb']))
+        if BASE_MEMORY_GB + estimate['assembly_gb'] <= memory_gb:
+            break
+        if len(sizes) == 1:
+            raise ValueError(
+                'The SPAdes assembly is predicted to need {:.1f} GB of memory for {:.2f} Gbases '
+                'of reads even with the single k-mer size {}, but only {} GB are available. '
+                'Please run with fewer reads or on a larger node.'.format(
+                    BASE_MEMORY_GB + estimate['assembly_gb'], total_bases / float(GB), sizes[0],
+                    memory_gb))
+        log('Dropping k-mer size {} to fit the available memory'.format(sizes[-1]))
+        sizes = sizes[:-1]
+
+    if BASE_MEMORY_GB + estimate['hammer_gb'] > memory_gb:
+        log('WARNING: SPAdes error correction is predicted to need {:.1f} GB of memory for '
+            '{:.2f} Gbases of reads, but only {} GB are available; it will count k-mers in '
+            'more passes and run slower'.format(
+                BASE_MEMORY_GB + estimate['hammer_gb'], total_bases / float(GB), memory_gb))
+
+    if kmer_sizes is None and sizes == default_kmer_sizes(read_count, total_bases):
+        return None
+    return sizes
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+import fcntl
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+import psutil
+
+from kb_SPAdes.utils.resource_planner import node_capacity
+
+
+NODE_SCHEDULER_DIR = '/tmp/kb_SPAdes_node_scheduler'
+LEDGER_FILE = 'reservations.json'
+LOCK_FILE = 'reservations.lock'
+POLL_INTERVAL = 5  # seconds between looks for freed resources while waiting
+# seconds after which the entries of another host that were not renewed are dropped: their
+# process cannot be looked up from here, so they have to prove they are alive
+LEASE_SECONDS = 600
+
+_heartbeats = {}  # (state dir, reservation id) -> Event stopping the renewal of a reservation
+
+
+def log(message, prefix_newline=False):
+    """Logging function, provides a hook to suppress or redirect log messages."""
+    print(('\n' if prefix_newline else '') + '{0:.2f}'.format(time.time()) + ': ' + str(message))
+
+
+class NodeScheduler(object):
+    """
+    Shares the threads and memory of a node between the spades.py runs started on it by any
+    process: each run reserves what it plans to use before it starts and releases it when it
+    ends. Reservations and the runs waiting for one are kept in a JSON ledger in state_dir,
+    locked with flock, so every process pointed at the same state_dir (e.g. a directory of
+    the host mounted into each job container) sees them.
+    Waiting runs are served in arrival order: the first one starts as soon as what it asked
+    for fits next to the reservations, or when nothing else is reserved, and the runs behind
+    it wait for it. Entries of processes that died on this host are dropped, and so are the
+    entries of other hosts whose lease ran out: every entry is renewed by its process while it
+    waits or holds its reservation, at least every lease / 4 seconds.
+    """
+
+    def __init__(self, state_dir=NODE_SCHEDULER_DIR, capacity=None,
+                 poll_interval=POLL_INTERVAL, timeout=0, lease=LEASE_SECONDS):
+        self.state_dir = state_dir
+        if not os.path.isdir(state_dir):
+            os.makedirs(state_dir, exist_ok=True)
+        self.capacity = capacity or node_capacity(total=True)
+        self.poll_interval = poll_interval
+        self.timeout = timeout  # seconds to wait for a reservation, 0 to wait for good
+        self.lease = lease
+        self.host = socket.gethostname()
+
+    def _read_ledger(self):
+        try:
+            with open(os.path.join(self.state_dir, LEDGER_FILE)) as ledger_file:
+                return json.load(ledger_file)
+        except (IOError, OSError, ValueError):
+            return {'next_id': 1, 'reservations': [], 'waiting': []}
+
+    @contextmanager
+    def _ledger(self):
+        with open(os.path.join(self.state_dir, LOCK_FILE), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                path = os.path.join(self.state_dir, LEDGER_FILE)
+                ledger = self._read_ledger()
+                self._drop_dead(ledger)
+                yield ledger
+                tmp_path = path + '.tmp'
+                with open(tmp_path, 'w') as ledger_file:
+                    json.dump(ledger, ledger_file, indent=1)
+                os.rename(tmp_path, path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _alive(self, entry, now):
+        if entry['host'] == self.host:
+            return psutil.pid_exists(entry['pid'])
+        return now - entry.get('renewed', entry['since']) <= self.lease
+
+    def _drop_dead(self, ledger):
+        now = time.time()
+        for key in ('reservations', 'waiting'):
+            alive = [e for e in ledger[key] if self._alive(e, now)]
+            for entry in ledger[key]:
+                if entry not in alive:
+                    log('Dropping the {} of process {} on {}, which is gone: {}'.format(
+                        'reservation' if key == 'reservations' else 'wait', entry['pid'],
+                        entry['host'], entry['owner']))
+            ledger[key] = alive
+
+    @staticmethod
+    def _reserved(ledger):
+        return {'threads': sum(r['threads'] for r in ledger['reservations']),
+                'memory_gb': sum(r['memory_gb'] for r in ledger['reservations'])}
+
+    def _fits(self, ledger, entry):
+        if not ledger['reservations']:
+            return True
+        reserved = self._reserved(ledger)
+        return (reserved['threads'] + entry['threads'] <= self.capacity['threads'] and
+                reserved['memory_gb'] + entry['memory_gb'] <= self.capacity['memory_gb'])
+
+    def reservations(self):
+        """
+        reservations: the current state of the node
+        returns a dict with the 'capacity', the 'reserved' threads and memory_gb, and the
+        'reservations' and 'waiting' entries with their 'owner', 'pid', 'host', 'threads',
+        'memory_gb', 'since' and 'renewed' time
+        The ledger is read without its lock, which is safe as it is only ever replaced whole,
+        so a health check never waits for a process holding the lock. The entries of dead
+        processes are left out, and dropped from the ledger by the next process that locks it.
+        """
+        ledger = self._read_ledger()
+        now = time.time()
+        for key in ('reservations', 'waiting'):
+            ledger[key] = [e for e in ledger[key] if self._alive(e, now)]
+        return {'capacity': self.capacity,
+                'reserved': self._reserved(ledger),
+                'reservations': ledger['reservations'],
+                'waiting': ledger['waiting']}
+
+    def acquire(self, owner, threads, memory_gb):
+        """
+        acquire: reserve threads and memory_gb for owner, waiting for its turn and for them to
+        fit; raises a ValueError if that takes longer than the timeout
+        returns the reservation, to be given to release
+        """
+        start = time.time()
+        with self._ledger() as ledger:
+            entry = {'id': ledger['next_id'], 'owner': owner, 'pid': os.getpid(),
+                     'host': self.host, 'threads': threads, 'memory_gb': memory_gb,
+                     'since': start, 'renewed': start}
+            ledger['next_id'] += 1
+            ledger['waiting'].append(entry)
+        try:
+            logged = False
+            while True:
+                with self._ledger() as ledger:
+                    entry['renewed'] = time.time()
+                    waiting = [w for w in ledger['waiting'] if w['id'] != entry['id']]
+                    if len(waiting) == len(ledger['waiting']):
+                        # dropped while this process could not renew it, queue up again
+                        waiting.append(entry)
+                    else:
+                        waiting = [entry if w['id'] == entry['id'] else w
+                                   for w in ledger['waiting']]
+                    ledger['waiting'] = waiting
+                    if ledger['waiting'][0]['id'] == entry['id'] and self._fits(ledger, entry):
+                        ledger['waiting'].pop(0)
+                        entry['since'] = entry['renewed'] = time.time()
+                        ledger['reservations'].append(entry)
+                        break
+                    reserved = self._reserved(ledger)
+                    ahead = [w['id'] for w in ledger['waiting']].index(entry['id'])
+                if self.timeout and time.time() - start > self.timeout:
+                    raise ValueError(
+                        'Gave up waiting for {} threads and {} GB of memory on this node after '
+                        '{:.0f} s: {} threads and {} GB are reserved by other runs'.format(
+                            threads, memory_gb, time.time() - start, reserved['threads'],
+                            reserved['memory_gb']))
+                if not logged:
+                    log('Waiting for {} threads and {} GB of memory on this node, {} threads '
+                        'and {} GB of {} and {} are reserved, {} runs waiting ahead'.format(
+                            threads, memory_gb, reserved['threads'], reserved['memory_gb'],
+                            self.capacity['threads'], self.capacity['memory_gb'], ahead))
+                    logged = True
+                time.sleep(self.poll_interval)
+        except BaseException:
+            with self._ledger() as ledger:
+                ledger['waiting'] = [w for w in ledger['waiting'] if w['id'] != entry['id']]
+            raise
+        entry['waited'] = entry['since'] - start
+        log('Reserved {} threads and {} GB of memory for {} after waiting {:.0f} s'.format(
+            threads, memory_gb, owner, entry['waited']))
+        stop = threading.Event()
+        _heartbeats[(os.path.realpath(self.state_dir), entry['id'])] = stop
+        heartbeat = threading.Thread(target=self._heartbeat, args=(entry, stop))
+        heartbeat.daemon = True
+        heartbeat.start()
+        return entry
+
+    def _heartbeat(self, reservation, stop):
+        """
+        _heartbeat: renew the lease of a reservation every lease / 4 seconds until it is
+        released; a reservation dropped meanwhile, because this process could not renew it in
+        time, is taken back
+        """
+        while not stop.wait(self.lease / 4.0):
+            with self._ledger() as ledger:
+                if stop.is_set():
+                    return
+                reservation['renewed'] = time.time()
+                held = [r for r in ledger['reservations'] if r['id'] == reservation['id']]
+                if held:
+                    held[0]['renewed'] = reservation['renewed']
+                else:
+                    log('The reservation of {} was dropped while it could not be renewed, '
+                        'taking it back'.format(reservation['owner']))
+                    ledger['reservations'].append(
+                        {k: v for k, v in reservation.items() if k != 'waited'})
+
+    def release(self, reservation):
+        """
+        release: give back the threads and memory of a reservation
+        """
+        stop = _heartbeats.pop((os.path.realpath(self.state_dir), reservation['id']), None)
+        if stop is not None:
+            stop.set()
+        with self._ledger() as ledger:
+            ledger['reservations'] = [r for r in ledger['reservations']
+                                      if r['id'] != reservation['id']]
+        log('Released {} threads and {} GB of memory of {}, held {:.0f} s'.format(
+            reservation['threads'], reservation['memory_gb'], reservation['owner'],
+            time.time() - reservation['since']))
+
+    @contextmanager
+    def reserve(self, owner, threads, memory_gb):
+        """
+        reserve: hold a reservation of threads and memory_gb for owner in a with block
+        """
+        reservation = self.acquire(owner, threads, memory_gb)
+        try:
+            yield reservation
+        finally:
+            self.release(reservation)
+
+
+def node_scheduler(config):
+    """
+    node_scheduler: the NodeScheduler set up by the node-scheduler-dir,
+    node-scheduler-timeout-hours and node-scheduler-lease-minutes settings of config
+    """
+    return NodeScheduler(config.get('node-scheduler-dir') or NODE_SCHEDULER_DIR,
+                         timeout=float(config.get('node-scheduler-timeout-hours', 0)) * 3600,
+                         lease=float(config.get('node-scheduler-lease-minutes',
+                                                LEASE_SECONDS / 60.0)) * 60)
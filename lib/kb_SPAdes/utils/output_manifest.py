@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+from fnmatch import fnmatch
+
+
+MB = 1000000
+GB = 1000000000
+
+# categories of the files in a spades.py output dir, by pattern of their path relative to it;
+# the first category with a matching pattern wins, files matching none are 'assembly'
+OUTPUT_CATEGORIES = [
+    ('corrected_reads', ['corrected/*']),
+    ('kmer_dirs', ['K[0-9]*/*']),
+    ('tmp', ['tmp/*', 'split_input/*']),
+    ('misc', ['misc/*', 'pipeline_state/*', 'run_spades.*', 'dataset.info',
+              'input_dataset.yaml', 'before_rr.fasta', 'first_pe_contigs.fasta']),
+    ('graphs', ['*.gfa', '*.fastg', '*.paths']),
+    ('logs', ['*.log', 'params.txt', '*.json'])
+]
+ASSEMBLY = 'assembly'
+# archived by default; corrected reads, K* iterations, tmp and misc are intermediates that can
+# run to tens of GB for metagenomes
+DEFAULT_OUTPUT_CATEGORIES = (ASSEMBLY, 'graphs', 'logs')
+
+
+def log(message, prefix_newline=False):
+    """Logging function, provides a hook to suppress or redirect log messages."""
+    print(('\n' if prefix_newline else '') + '{0:.2f}'.format(time.time()) + ': ' + str(message))
+
+
+def split_setting(value):
+    """
+    split_setting: the list of the comma separated items of a config setting
+    """
+    if not value:
+        return []
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def output_category(relative_path):
+    """
+    output_category: the category of a file by its path relative to the spades.py output dir
+    """
+    for category, patterns in OUTPUT_CATEGORIES:
+        if any(fnmatch(relative_path, pattern) for pattern in patterns):
+            return category
+    return ASSEMBLY
+
+
+def build_manifest(folder_path, categories=DEFAULT_OUTPUT_CATEGORIES, include=None,
+                   exclude=None, max_file_bytes=0, max_total_bytes=0, skip_suffixes=()):
+    """
+    build_manifest: choose the files of a spades.py output dir to archive.
+    A file is chosen if its category is in categories and it matches none of the exclude
+    patterns, or if it matches one of the include patterns (patterns match the path relative
+    to folder_path). Chosen files larger than max_file_bytes are then skipped, and so are the
+    files that would take the total over max_total_bytes, taking the included files first and
+    then the categories in the order of categories; a max of 0 means no cap. Files ending with
+    skip_suffixes are left out without being listed.
+    returns a dict with the chosen 'files' as (path, relative path) tuples, their
+    'total_bytes', and the 'skipped' files as dicts of 'path', 'category', 'size' and 'reason'
+    """
+    include = include or []
+    exclude = exclude or []
+    chosen = []
+    skipped = []
+    for root, folders, files in os.walk(folder_path):
+        folders.sort()
+        for f in sorted(files):
+            if skip_suffixes and f.endswith(tuple(skip_suffixes)):
+                continue
+            path = os.path.join(root, f)
+            relative_path = os.path.relpath(path, folder_path)
+            category = output_category(relative_path)
+            size = os.path.getsize(path)
+            if any(fnmatch(relative_path, pattern) for pattern in include):
+                chosen.append((path, relative_path, category, size, True))
+            elif category not in categories:
+                skipped.append({'path': relative_path, 'category': category, 'size': size,
+                                'reason': 'category not archived'})
+            elif any(fnmatch(relative_path, pattern) for pattern in exclude):
+                skipped.append({'path': relative_path, 'category': category, 'size': size,
+                                'reason': 'excluded by pattern'})
+            else:
+                chosen.append((path, relative_path, category, size, False))
+
+    # fill the total size cap with the explicitly included files and most wanted categories first
+    order = list(categories)
+    chosen.sort(key=lambda c: (not c[4], order.index(c[2]) if c[2] in order else len(order)))
+    manifest = {'files': [], 'total_bytes': 0, 'skipped': skipped}
+    for path, relative_path, category, size, _ in chosen:
+        reason = None
+        if max_file_bytes and size > max_file_bytes:
+            reason = 'over the {:g} GB file size cap'.format(max_file_bytes / float(GB))
+        elif max_total_bytes and manifest['total_bytes'] + size > max_total_bytes:
+            reason = 'over the {:g} GB total size cap'.format(max_total_bytes / float(GB))
+        if reason:
+            skipped.append({'path': relative_path, 'category': category, 'size': size,
+                            'reason': reason})
+            continue
+        manifest['files'].append((path, relative_path))
+        manifest['total_bytes'] += size
+
+    log('Archiving {} files, {:.1f} MB; leaving out {} files, {:.1f} MB'.format(
+        len(manifest['files']), manifest['total_bytes'] / float(MB), len(skipped),
+        sum(s['size'] for s in skipped) / float(MB)))
+    return manifest
+
+
+def manifest_report(manifest):
+    """
+    manifest_report: report text listing the files left out of the archive, summed up by
+    category and reason
+    """
+    skipped = manifest['skipped']
+    if not skipped:
+        return ''
+    groups = {}
+    for item in skipped:
+        group = groups.setdefault((item['category'], item['reason']), [0, 0])
+        group[0] += 1
+        group[1] += item['size']
+    report = 'Left out of the output files: {} files, {:.1f} MB\n'.format(
+        len(skipped), sum(item['size'] for item in skipped) / float(MB))
+    for (category, reason), (count, size) in sorted(groups.items(),
+                                                    key=lambda g: -g[1][1]):
+        report += '   {}: {} files, {:.1f} MB ({})\n'.format(category, count,
+                                                            size / float(MB), reason)
+    return report
@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+import copy
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import yaml
+
+
+# the options of ReadsUtils.download_reads for the reads of every app; they are part of the
+# cache key, so the apps share the cached reads only as long as they all use these
+READS_DOWNLOAD_OPTIONS = {'interleaved': 'false', 'gzipped': None}
+
+
+def log(message, prefix_newline=False):
+    """Logging function, provides a hook to suppress or redirect log messages."""
+    print(('\n' if prefix_newline else '') + '{0:.2f}'.format(time.time()) + ': ' + str(message))
+
+
+def _mkdir_p(path):
+    """
+    _mkdir_p: make directory for given path
+    """
+    if not path:
+        return
+    try:
+        os.makedirs(path)
+    except OSError as exc:
+        if exc.errno == errno.EEXIST and os.path.isdir(path):
+            pass
+        else:
+            raise
+
+
+def _quick_hash(file_path, size):
+    """
+    _quick_hash: sha256 of the file size and of its first and last HASH_SAMPLE_BYTES, cheap
+    enough for tens of GB of reads while still catching truncated or overwritten files
+    """
+    digest = hashlib.sha256(str(size).encode())
+    with open(file_path, 'rb') as f:
+        digest.update(f.read(ReadsCache.HASH_SAMPLE_BYTES))
+        if size > ReadsCache.HASH_SAMPLE_BYTES:
+            f.seek(max(ReadsCache.HASH_SAMPLE_BYTES, size - ReadsCache.HASH_SAMPLE_BYTES))
+            digest.update(f.read(ReadsCache.HASH_SAMPLE_BYTES))
+    return digest.hexdigest()
+
+
+def _link_or_copy(src, dst):
+    """
+    _link_or_copy: hardlink src to dst, or copy it when they are on different filesystems (or
+    the filesystem has no hardlinks), leaving src in place
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def merge_corrected_dataset(corrected_yaml, input_data_set, dataset_path):
+    """
+    merge_corrected_dataset: write a SPAdes dataset file at dataset_path listing the corrected
+    libraries of a CorrectedReadsCache dataset file plus the libraries of input_data_set that
+    SPAdes does not error correct (PacBio, Nanopore, contigs, ...) and return dataset_path
+    """
+    with open(corrected_yaml) as dataset_file:
+        dataset = yaml.safe_load(dataset_file)
+    dataset += [lib for lib in input_data_set
+                if lib.get('type') not in CorrectedReadsCache.CORRECTED_TYPES]
+    with open(dataset_path, 'w') as dataset_file:
+        yaml.safe_dump(dataset, dataset_file)
+    return dataset_path
+
+
+class ReadsCache(object):
+    """
+    A node-local cache of downloaded reads libraries.
+    Entries are keyed by the resolved workspace object reference (ws/obj/ver, which is
+    immutable) plus the ReadsUtils.download_reads options, and hold the downloaded files with the
+    ReadsUtils metadata of the library. The cache is bounded in size and evicts the least
+    recently used entries first, except for the entries pinned by a job that is still using
+    them, see pinned.
+    """
+    MANIFEST = 'manifest.json'
+    LOCK_FILE = '.lock'
+    PIN_PREFIX = '.pin_'  # the pin file of an entry is PIN_PREFIX + its key
+    HASH_SAMPLE_BYTES = 1024 * 1024
+    FILE_KEYS = ('fwd', 'rev')  # keys of the ReadsUtils 'files' dict that are file paths
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        _mkdir_p(self.cache_dir)
+
+    @contextmanager
+    def _locked(self):
+        with open(os.path.join(self.cache_dir, self.LOCK_FILE), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @contextmanager
+    def pinned(self):
+        """
+        pinned: a with block in which the entries this thread gets or puts stay pinned: each
+        one holds a shared flock on its pin file, which _evict of any process sharing the cache
+        dir skips, until the block ends; nested blocks pin into the outermost one
+        """
+        if self._pins() is not None:
+            yield
+            return
+        self._local.pins = {}
+        try:
+            yield
+        finally:
+            pins, self._local.pins = self._local.pins, None
+            for pin_file in pins.values():
+                pin_file.close()  # releases the flock
+
+    def _pins(self):
+        return getattr(self._local, 'pins', None)
+
+    def _pin_path(self, key):
+        return os.path.join(self.cache_dir, self.PIN_PREFIX + key)
+
+    def _pin(self, key):
+        """
+        _pin: pin the entry of key until the end of the pinned block of this thread, if any;
+        must be called with the cache lock held
+        """
+        pins = self._pins()
+        if pins is None or key in pins:
+            return
+        pin_file = open(self._pin_path(key), 'a')
+        fcntl.flock(pin_file, fcntl.LOCK_SH)
+        pins[key] = pin_file
+
+    def _is_pinned(self, key):
+        """
+        _is_pinned: whether a pinned block of any thread or process holds the entry of key;
+        must be called with the cache lock held
+        """
+        pin_path = self._pin_path(key)
+        if not os.path.exists(pin_path):
+            return False
+        with open(pin_path, 'a') as pin_file:
+            try:
+                fcntl.flock(pin_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                return True
+            fcntl.flock(pin_file, fcntl.LOCK_UN)
+        return False
+
+    def _key(self, upa, options):
+        key_src = json.dumps({'upa': upa, 'options': options}, sort_keys=True)
+        return hashlib.sha256(key_src.encode()).hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _read_manifest(self, entry_dir):
+        try:
+            with open(os.path.join(entry_dir, self.MANIFEST)) as manifest_file:
+                return json.load(manifest_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _entry_size(self, manifest):
+        return sum(f['size'] for f in manifest['files'].values())
+
+    def _verify(self, entry_dir, manifest):
+        for name, file_info in manifest['files'].items():
+            file_path = os.path.join(entry_dir, name)
+            if not os.path.isfile(file_path):
+                return False
+            size = os.path.getsize(file_path)
+            if size != file_info['size'] or _quick_hash(file_path, size) != file_info['hash']:
+                return False
+        return True
+
+    def get(self, upa, options):
+        """
+        get: return the ReadsUtils reads info of a cached library with its file paths pointing
+        into the cache, or None if the library is not cached or failed the integrity check;
+        a cached library is pinned in a pinned block
+        """
+        key = self._key(upa, options)
+        entry_dir = self._entry_dir(key)
+        with self._locked():
+            manifest = self._read_manifest(entry_dir)
+            if manifest is None:
+                return None
+            if not self._verify(entry_dir, manifest):
+                log('Reads cache entry for {} failed the integrity check, dropping it'.format(upa))
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                return None
+            # the manifest mtime is the LRU clock
+            os.utime(os.path.join(entry_dir, self.MANIFEST), None)
+            self._pin(key)
+
+        reads_info = copy.deepcopy(manifest['reads_info'])
+        for file_key in self.FILE_KEYS:
+            if reads_info['files'].get(file_key):
+                reads_info['files'][file_key] = os.path.join(
+                    entry_dir, reads_info['files'][file_key])
+        log('Reads cache hit for {}'.format(upa))
+        return reads_info
+
+    def put(self, upa, options, reads_info):
+        """
+        put: move the downloaded files of a library into the cache and return its reads info
+        with the file paths pointing into the cache, evicting old entries if needed; the library
+        is pinned in a pinned block
+        """
+        key = self._key(upa, options)
+        entry_dir = self._entry_dir(key)
+        tmp_dir = os.path.join(self.cache_dir, '.tmp_' + str(uuid.uuid4()))
+        _mkdir_p(tmp_dir)
+
+        cached_info = copy.deepcopy(reads_info)
+        files = {}
+        for file_key in self.FILE_KEYS:
+            src = cached_info['files'].get(file_key)
+            if not src:
+                continue
+            name = file_key + '_' + os.path.basename(src)
+            dst = os.path.join(tmp_dir, name)
+            shutil.move(src, dst)
+            size = os.path.getsize(dst)
+            files[name] = {'size': size, 'hash': _quick_hash(dst, size)}
+            cached_info['files'][file_key] = name
+
+        manifest = {'upa': upa, 'options': options, 'files': files, 'reads_info': cached_info}
+        with open(os.path.join(tmp_dir, self.MANIFEST), 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+
+        with self._locked():
+            manifest = self._replace_entry(key, tmp_dir, manifest)
+            self._pin(key)
+            self._evict(keep=set(self._pins() or ()) | {key})
+
+        cached_info = copy.deepcopy(manifest['reads_info'])
+        for file_key in self.FILE_KEYS:
+            if cached_info['files'].get(file_key):
+                cached_info['files'][file_key] = os.path.join(
+                    entry_dir, cached_info['files'][file_key])
+        return cached_info
+
+    def _replace_entry(self, key, tmp_dir, manifest):
+        """
+        _replace_entry: make tmp_dir the entry of key and return its manifest, unless the entry
+        is pinned by another job, which then keeps it (it holds the same data) and tmp_dir is
+        dropped; must be called with the cache lock held
+        """
+        entry_dir = self._entry_dir(key)
+        if os.path.isdir(entry_dir):
+            pinned_manifest = self._read_manifest(entry_dir) if self._is_pinned(key) else None
+            if pinned_manifest is not None:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                return pinned_manifest
+            shutil.rmtree(entry_dir, ignore_errors=True)
+        os.rename(tmp_dir, entry_dir)
+        return manifest
+
+    def _evict(self, keep=()):
+        """
+        _evict: remove least recently used entries until the cache fits in max_bytes, skipping
+        the keys in keep and the pinned entries; must be called with the cache lock held
+        """
+        entries = []
+        total = 0
+        for key in os.listdir(self.cache_dir):
+            entry_dir = self._entry_dir(key)
+            if key.startswith('.') or not os.path.isdir(entry_dir):
+                continue
+            manifest = self._read_manifest(entry_dir)
+            if manifest is None:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                continue
+            size = self._entry_size(manifest)
+            total += size
+            last_used = os.path.getmtime(os.path.join(entry_dir, self.MANIFEST))
+            entries.append((last_used, key, size))
+
+        for last_used, key, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key in keep:
+                continue
+            if self._is_pinned(key):
+                log('Not evicting reads cache entry {} ({} bytes), a job is using it'.format(
+                    key, size))
+                continue
+            log('Evicting reads cache entry {} ({} bytes)'.format(key, size))
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            if os.path.exists(self._pin_path(key)):
+                os.remove(self._pin_path(key))
+            total -= size
+
+
+class CorrectedReadsCache(ReadsCache):
+    """
+    A node-local cache of the reads error corrected by SPAdes (BayesHammer / IonHammer).
+    Entries are keyed by the input libraries (resolved ws/obj/ver references with their type)
+    plus the options that change the correction (phred offset, DNA source, SPAdes version), and
+    hold the corrected reads with a SPAdes dataset file listing them, ready for a spades.py
+    --only-assembler run.
+    """
+    DATASET = 'corrected.yaml'
+    # SPAdes dataset library types that are error corrected, the others are passed through
+    CORRECTED_TYPES = ('paired-end', 'mate-pairs', 'hq-mate-pairs', 'single')
+
+    def get_corrected(self, libs, options):
+        """
+        get_corrected: return the path of the SPAdes dataset file of the cached corrected
+        reads, or None if they are not cached or failed the integrity check
+        """
+        key = self._key(libs, options)
+        entry_dir = self._entry_dir(key)
+        with self._locked():
+            manifest = self._read_manifest(entry_dir)
+            if manifest is None:
+                return None
+            if not self._verify(entry_dir, manifest):
+                log('Corrected reads cache entry {} failed the integrity check, '
+                    'dropping it'.format(key))
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                return None
+            os.utime(os.path.join(entry_dir, self.MANIFEST), None)
+            self._pin(key)
+        log('Corrected reads cache hit for {}'.format(libs))
+        return os.path.join(entry_dir, self.DATASET)
+
+    def put_corrected(self, libs, options, corrected_dir):
+        """
+        put_corrected: hardlink (or copy, across filesystems) the corrected reads listed in
+        the corrected.yaml of a SPAdes corrected/ dir into the cache and return the path of the
+        cached dataset file, which only lists the corrected libraries; evicts old entries if
+        needed. The corrected/ dir is left as it is for spades.py --restart-from and the output
+        files of the run.
+        """
+        with open(os.path.join(corrected_dir, self.DATASET)) as dataset_file:
+            dataset = yaml.safe_load(dataset_file)
+
+        key = self._key(libs, options)
+        entry_dir = self._entry_dir(key)
+        tmp_dir = os.path.join(self.cache_dir, '.tmp_' + str(uuid.uuid4()))
+        _mkdir_p(tmp_dir)
+
+        corrected_root = os.path.realpath(corrected_dir) + os.sep
+        files = {}
+        cached_dataset = []
+        for lib in dataset:
+            if lib.get('type') not in self.CORRECTED_TYPES:
+                continue
+            cached_lib = dict(lib)
+            for lib_key, value in lib.items():
+                if not isinstance(value, list):
+                    continue
+                cached_lib[lib_key] = []
+                for src in value:
+                    if not os.path.realpath(src).startswith(corrected_root):
+                        continue  # e.g. reads SPAdes left uncorrected
+                    name = os.path.basename(src)
+                    _link_or_copy(src, os.path.join(tmp_dir, name))
+                    size = os.path.getsize(os.path.join(tmp_dir, name))
+                    files[name] = {'size': size,
+                                   'hash': _quick_hash(os.path.join(tmp_dir, name), size)}
+                    cached_lib[lib_key].append(os.path.join(entry_dir, name))
+                if not cached_lib[lib_key]:
+                    del cached_lib[lib_key]
+            cached_dataset.append(cached_lib)
+
+        with open(os.path.join(tmp_dir, self.DATASET), 'w') as dataset_file:
+            yaml.safe_dump(cached_dataset, dataset_file)
+        manifest = {'upa': libs, 'options': options, 'files': files}
+        with open(os.path.join(tmp_dir, self.MANIFEST), 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+
+        with self._locked():
+            self._replace_entry(key, tmp_dir, manifest)
+            self._pin(key)
+            self._evict(keep=set(self._pins() or ()) | {key})
+        log('Cached the corrected reads of {}'.format(libs))
+        return os.path.join(entry_dir, self.DATASET)
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+import math
+import os
+import time
+
+import psutil
+
+
+GB = 1000000000
+CGROUP_ROOT = '/sys/fs/cgroup'
+CGROUP_UNLIMITED = 2 ** 60  # cgroup v1 reports "no limit" as a huge page-aligned number
+
+MIN_MEMORY_GB = 4
+MEMORY_OFFSET_GB = 1  # left to the wrapper, QUAST and the page cache
+MAX_THREADS = 64  # per email thread with Anton Korobeynikov
+MAX_THREADS_META = 128  # Increase threads for metagenomic assemblies
+MAX_MEMORY_GB_SPADES = 500
+MAX_MEMORY_GB_META_SPADES = 1000
+# small inputs finish each stage before extra threads pay for their per-thread buffers
+SMALL_INPUT_BYTES = 1 * GB
+MAX_THREADS_SMALL_INPUT = 8
+
+METAGENOME = 'metagenomic'
+
+
+def log(message, prefix_newline=False):
+    """Logging function, provides a hook to suppress or redirect log messages."""
+    print(('\n' if prefix_newline else '') + '{0:.2f}'.format(time.time()) + ': ' + str(message))
+
+
+def _read_cgroup_value(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def cgroup_cpu_limit(cgroup_root=CGROUP_ROOT):
+    """
+    cgroup_cpu_limit: the number of CPUs allowed by the cgroup v2 cpu.max or cgroup v1 CFS
+    quota of this process, or None if no quota is set
+    """
+    cpu_max = _read_cgroup_value(os.path.join(cgroup_root, 'cpu.max'))
+    if cpu_max is not None:
+        fields = cpu_max.split()
+        if len(fields) != 2 or fields[0] == 'max':
+            return None
+        quota, period = int(fields[0]), int(fields[1])
+    else:
+        quota = _read_cgroup_value(os.path.join(cgroup_root, 'cpu', 'cpu.cfs_quota_us'))
+        period = _read_cgroup_value(os.path.join(cgroup_root, 'cpu', 'cpu.cfs_period_us'))
+        if quota is None or period is None:
+            return None
+        quota, period = int(quota), int(period)
+    if quota <= 0 or period <= 0:
+        return None
+    return max(1, int(math.ceil(quota / float(period))))
+
+
+def _cgroup_memory(cgroup_root):
+    limit = _read_cgroup_value(os.path.join(cgroup_root, 'memory.max'))
+    if limit is not None:
+        usage = _read_cgroup_value(os.path.join(cgroup_root, 'memory.current'))
+    else:
+        limit = _read_cgroup_value(os.path.join(cgroup_root, 'memory', 'memory.limit_in_bytes'))
+        usage = _read_cgroup_value(os.path.join(cgroup_root, 'memory', 'memory.usage_in_bytes'))
+    if limit is None or limit == 'max' or int(limit) >= CGROUP_UNLIMITED:
+        return None, None
+    return int(limit), int(usage or 0)
+
+
+def cgroup_memory_limit(cgroup_root=CGROUP_ROOT):
+    """
+    cgroup_memory_limit: bytes allowed by the cgroup v2 memory.max or cgroup v1 memory limit
+    of this process, or None if no limit is set
+    """
+    return _cgroup_memory(cgroup_root)[0]
+
+
+def cgroup_memory_available(cgroup_root=CGROUP_ROOT):
+    """
+    cgroup_memory_available: bytes left under the cgroup v2 memory.max or cgroup v1 memory
+    limit of this process, or None if no limit is set
+    """
+    limit, usage = _cgroup_memory(cgroup_root)
+    if limit is None:
+        return None
+    return max(0, limit - usage)
+
+
+def _cpu_count():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return psutil.cpu_count()
+
+
+def node_capacity(cgroup_root=CGROUP_ROOT, total=False):
+    """
+    node_capacity: the CPUs usable by this process and the memory in GB available to it now
+    under both the host and the cgroup limits, less MEMORY_OFFSET_GB; with total, the memory
+    it may use at all rather than what is available now
+    returns a dict with the 'threads' and 'memory_gb'
+    """
+    cpus = _cpu_count()
+    cpu_limit = cgroup_cpu_limit(cgroup_root)
+    if cpu_limit is not None:
+        cpus = min(cpus, cpu_limit)
+    if total:
+        available = psutil.virtual_memory().total
+        cgroup_available = cgroup_memory_limit(cgroup_root)
+    else:
+        available = psutil.virtual_memory().available
+        cgroup_available = cgroup_memory_available(cgroup_root)
+    if cgroup_available is not None:
+        available = min(available, cgroup_available)
+    return {'threads': cpus,
+            'memory_gb': max(0, int(available / float(GB) - MEMORY_OFFSET_GB))}
+
+
+def plan_resources(dna_source=None, input_bytes=0, concurrent_runs=1,
+                   cgroup_root=CGROUP_ROOT):
+    """
+    plan_resources: decide the --threads and --memory settings of a spades.py run.
+    Threads are one per CPU usable by this process (CPU affinity and cgroup CPU quota), capped
+    for the DNA source and for small inputs. Memory is what is left under both the host and the
+    cgroup memory limits, less MEMORY_OFFSET_GB, capped for the DNA source. Both are shared
+    evenly by concurrent_runs assemblies running side by side.
+    returns a dict with the 'threads' and 'memory_gb' to use and the 'reason' for them
+    """
+    reasons = []
+
+    cpus = _cpu_count()
+    reasons.append('{} cpus usable'.format(cpus))
+    cpu_limit = cgroup_cpu_limit(cgroup_root)
+    if cpu_limit is not None and cpu_limit < cpus:
+        cpus = cpu_limit
+        reasons.append('cgroup cpu quota {}'.format(cpu_limit))
+
+    host_available = psutil.virtual_memory().available
+    available = host_available
+    reasons.append('{:.1f} GB available on host'.format(host_available / float(GB)))
+    cgroup_available = cgroup_memory_available(cgroup_root)
+    if cgroup_available is not None and cgroup_available < available:
+        available = cgroup_available
+        reasons.append('{:.1f} GB left under cgroup limit'.format(available / float(GB)))
+
+    mem = available / float(GB) - MEMORY_OFFSET_GB
+    if mem < MIN_MEMORY_GB:
+        raise ValueError(
+            'Only ' + str(available) +
+            ' bytes of memory are available. The SPAdes wrapper will' +
+            ' not run without at least ' +
+            str(MIN_MEMORY_GB + MEMORY_OFFSET_GB) +
+            ' gigabytes available')
+
+    if dna_source == METAGENOME:
+        max_mem = MAX_MEMORY_GB_META_SPADES
+        max_threads = MAX_THREADS_META
+    else:
+        max_mem = MAX_MEMORY_GB_SPADES
+        max_threads = MAX_THREADS
+    if 0 < input_bytes < SMALL_INPUT_BYTES:
+        max_threads = min(max_threads, MAX_THREADS_SMALL_INPUT)
+        reasons.append('small input of {:.2f} GB caps threads at {}'.format(
+            input_bytes / float(GB), MAX_THREADS_SMALL_INPUT))
+
+    threads = min(max_threads, cpus)
+    if mem > max_mem:
+        mem = max_mem
+        reasons.append('{} assembly caps memory at {} GB'.format(dna_source or 'standard',
+                                                                 max_mem))
+
+    if concurrent_runs > 1:
+        # share the node between assemblies running side by side
+        threads = max(1, threads // concurrent_runs)
+        mem = mem / concurrent_runs
+        reasons.append('shared by {} concurrent runs'.format(concurrent_runs))
+        if mem < MIN_MEMORY_GB:
+            raise ValueError(
+                'Only ' + str(int(mem)) + ' gigabytes of memory are available to each of ' +
+                str(concurrent_runs) + ' concurrent SPAdes runs. The SPAdes wrapper will' +
+                ' not run without at least ' + str(MIN_MEMORY_GB) +
+                ' gigabytes available')
+
+    plan = {'threads': threads,
+            'memory_gb': int(mem),
+            'reason': ', '.join(reasons)}
+    log('SPAdes resources: {} threads, {} GB memory ({})'.format(
+        plan['threads'], plan['memory_gb'], plan['reason']))
+    return plan
+
+
+def input_size(file_paths):
+    """
+    input_size: total size in bytes of the existing files among file_paths
+    """
+    return sum(os.path.getsize(f) for f in file_paths if f and os.path.isfile(f))
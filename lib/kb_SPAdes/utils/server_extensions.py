@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import os
+import threading
+
+from kb_SPAdes.utils.job_queue import (JobQueue, JOB_QUEUE_DIR, JOB_THREADS, JOB_MEMORY_GB,
+                                       MAX_QUEUED_JOBS)
+
+
+SERVICE_NAME = 'kb_SPAdes'
+# the methods that can also be submitted as jobs with SERVICE_NAME._<method>_submit
+JOB_METHODS = ('run_SPAdes', 'run_HybridSPAdes', 'run_metaSPAdes', 'run_SPAdes_sweep')
+
+
+def _invalid_request(req):
+    """
+    _invalid_request: the reason a JSON-RPC request cannot be dispatched by the generated
+    Application, or None if it can
+    """
+    if not isinstance(req, dict):
+        return 'A request must be an object'
+    method = req.get('method')
+    if not isinstance(method, str) or method.count('.') != 1:
+        return 'A request must have a module.method method'
+    return None
+
+
+class ServiceExtensions(object):
+    """
+    The service features kb-sdk does not generate, applied to the generated WSGI Application
+    of kb_SPAdesServer.py so that they survive its regeneration (see the README):
+    - JSON-RPC 2.0 style batches: a JSON array of requests is answered with an array of
+      responses in one HTTP round trip. Each request goes through the generated Application
+      on its own, so one failing does not affect the others; the requests without an id are
+      notifications and get no response.
+    - jobs: the JOB_METHODS can be submitted with _<method>_submit, followed with _check_job
+      and stopped with _cancel_job, as BaseClient.run_job does. The WSGI worker is then free
+      as soon as the job is queued. The jobs run in the worker that queued them and end with
+      it, see JobQueue and the README; the queue is only set up by the first job call.
+    The other attributes of the Application are passed through.
+    """
+
+    def __init__(self, application, impl, config):
+        self.application = application
+        self.config = config or {}
+        self._job_queue = None
+        self._job_queue_lock = threading.Lock()
+        for method_name in JOB_METHODS:
+            submit_name = SERVICE_NAME + '._' + method_name + '_submit'
+            application.rpc_service.add(
+                self._job_submitter(SERVICE_NAME + '.' + method_name,
+                                    getattr(impl, method_name)),
+                name=submit_name,
+                types=[dict])
+            application.method_authentication[submit_name] = 'required'
+        for method_name, method in (('_check_job', self.check_job),
+                                    ('_cancel_job', self.cancel_job)):
+            application.rpc_service.add(method,
+                                        name=SERVICE_NAME + '.' + method_name,
+                                        types=[str])
+            application.method_authentication[SERVICE_NAME + '.' + method_name] = 'required'
+
+    def __getattr__(self, name):
+        return getattr(self.application, name)
+
+    @property
+    def job_queue(self):
+        with self._job_queue_lock:
+            if self._job_queue is None:
+                config = self.config
+                scratch = config.get('scratch', os.path.join(os.getcwd(), 'work', 'tmp'))
+                self._job_queue = JobQueue(
+                    os.path.join(scratch, JOB_QUEUE_DIR),
+                    int(config.get('job-queue-threads', JOB_THREADS)),
+                    int(config.get('job-queue-memory-gb', JOB_MEMORY_GB)),
+                    int(config.get('job-queue-max-queued', MAX_QUEUED_JOBS)))
+            return self._job_queue
+
+    def _job_submitter(self, method_name, method):
+        def submit(ctx, params):
+            return [self.job_queue.submit(ctx, method_name, method, [params])]
+        return submit
+
+    def check_job(self, ctx, job_id):
+        return [self.job_queue.check(job_id, ctx['user_id'])]
+
+    def cancel_job(self, ctx, job_id):
+        return [self.job_queue.cancel(job_id, ctx['user_id'])]
+
+    def __call__(self, environ, start_response):
+        if environ['REQUEST_METHOD'] == 'OPTIONS':
+            return self.application(environ, start_response)
+        try:
+            body_size = int(environ.get('CONTENT_LENGTH', 0))
+        except ValueError:
+            body_size = 0
+        body = environ['wsgi.input'].read(body_size)
+        try:
+            req = json.loads(body)
+        except ValueError:
+            req = None  # the generated Application answers the parse error
+        if isinstance(req, list):
+            return self._respond(environ, start_response, '200 OK',
+                                 self.call_batch(req, environ))
+        if req is not None and (_invalid_request(req) or 'id' not in req or
+                                'params' not in req):
+            status, response_body = self.call_request(req, environ, body)
+            return self._respond(environ, start_response, status, response_body)
+        return self.application(self._request_environ(environ, body), start_response)
+
+    def call_request(self, req, environ, body=None):
+        """
+        Runs one JSON-RPC request through the generated Application, answering the ones it
+        cannot dispatch with an Invalid Request error.
+        returns a tuple of the HTTP status and the response body bytes
+        """
+        invalid = _invalid_request(req)
+        if invalid:
+            return '500 Internal Server Error', self._error(
+                -32600, 'Invalid Request', invalid,
+                req if isinstance(req, dict) else {'version': '1.1'})
+        if body is None or 'id' not in req or 'params' not in req:
+            # the generated Application needs both, a notification is run with id null
+            body = json.dumps(dict(req, id=req.get('id'), params=req.get('params', [])))
+        started = {}
+
+        def start_response(status, headers):
+            started['status'] = status
+        response_body = b''.join(self.application(
+            self._request_environ(environ, body), start_response))
+        return started['status'], response_body
+
+    def call_batch(self, reqs, environ):
+        """
+        Runs the requests of a batch one after the other.
+        returns the JSON array of the responses, in the order of the requests and without
+        the notifications, or empty bytes if there are none
+        """
+        if not reqs:
+            return self._error(-32600, 'Invalid Request', 'Empty batch', {'version': '1.1'})
+        responses = []
+        for req in reqs:
+            status, response_body = self.call_request(req, environ)
+            # JSON-RPC 2.0 notifications, requests without an id, get no response
+            if response_body and (not isinstance(req, dict) or 'id' in req):
+                responses.append(response_body)
+        if not responses:
+            return b''
+        return b'[' + b','.join(responses) + b']'
+
+    def _error(self, code, name, message, request):
+        error = {'error': {'code': code, 'name': name, 'message': message}}
+        return self.application.process_error(error, None, request).encode('utf8')
+
+    @staticmethod
+    def _request_environ(environ, body):
+        if not isinstance(body, bytes):
+            body = body.encode('utf8')
+        request_environ = dict(environ)
+        request_environ['wsgi.input'] = io.BytesIO(body)
+        request_environ['CONTENT_LENGTH'] = str(len(body))
+        return request_environ
+
+    @staticmethod
+    def _respond(environ, start_response, status, response_body):
+        response_headers = [
+            ('Access-Control-Allow-Origin', '*'),
+            ('Access-Control-Allow-Headers', environ.get(
+                'HTTP_ACCESS_CONTROL_REQUEST_HEADERS', 'authorization')),
+            ('content-type', 'application/json'),
+            ('content-length', str(len(response_body)))]
+        start_response(status, response_headers)
+        return [response_body]
+
+
+def extend_application(application, impl, config):
+    """
+    extend_application: the generated WSGI Application with the ServiceExtensions, to be
+    applied in kb_SPAdesServer.py right after the Application is created
+    """
+    return ServiceExtensions(application, impl, config)
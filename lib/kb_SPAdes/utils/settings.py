@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import os
+
+from kb_SPAdes.utils.reads_cache import ReadsCache, CorrectedReadsCache
+from kb_SPAdes.utils.node_scheduler import node_scheduler
+from kb_SPAdes.utils.spades_supervisor import scratch_policy
+from kb_SPAdes.utils.spades_profiler import PROFILE_INTERVAL
+from kb_SPAdes.utils.shock_utils import SHOCK_CHUNK_SIZE, SHOCK_UPLOAD_WORKERS
+
+
+GB = 1000000000
+READS_CACHE_DIR = 'reads_cache'
+CORRECTED_READS_CACHE_DIR = 'corrected_reads_cache'
+READS_CACHE_MAX_GB = 200
+
+
+def _flag(config, name, default):
+    return str(config.get(name, default)).strip().lower() == 'true'
+
+
+def load_settings(config):
+    """
+    load_settings: the deploy.cfg settings of the spades.py runs, read the same way for the
+    SPAdes apps (kb_SPAdesImpl) and the hybrid app (SPAdesUtils)
+    returns a dict with
+    - 'reads_cache' and 'corrected_reads_cache': the ReadsCache and CorrectedReadsCache in
+      scratch, of reads-cache-max-gb and corrected-reads-cache-max-gb
+    - 'profile_interval': seconds between resource samples of the spades.py process tree, 0
+      to disable
+    - 'shock_chunk_size' and 'shock_upload_workers': the parts a file is uploaded to Shock in
+    - 'node_scheduler': the NodeScheduler the threads and memory of the runs are reserved with
+    - 'cancel_scratch_policy': whether the output of a canceled run is kept or removed
+    - 'auto_kmer_sizes' and 'hybrid_auto_kmer_sizes': whether the SPAdes apps and the hybrid
+      app pick the k-mer sizes from the read lengths when none are given
+    - 'memory_preflight': whether a run is checked to fit in memory before it starts
+    """
+    scratch = os.path.abspath(config['scratch'])
+    return {
+        'reads_cache': ReadsCache(
+            os.path.join(scratch, READS_CACHE_DIR),
+            float(config.get('reads-cache-max-gb', READS_CACHE_MAX_GB)) * GB),
+        'corrected_reads_cache': CorrectedReadsCache(
+            os.path.join(scratch, CORRECTED_READS_CACHE_DIR),
+            float(config.get('corrected-reads-cache-max-gb', READS_CACHE_MAX_GB)) * GB),
+        'profile_interval': float(config.get('profile-interval-seconds', PROFILE_INTERVAL)),
+        'shock_chunk_size': int(float(config.get('shock-chunk-size-mb',
+                                                 SHOCK_CHUNK_SIZE / 1000000)) * 1000000),
+        'shock_upload_workers': int(config.get('shock-upload-workers', SHOCK_UPLOAD_WORKERS)),
+        'node_scheduler': node_scheduler(config),
+        'cancel_scratch_policy': scratch_policy(config),
+        'auto_kmer_sizes': _flag(config, 'auto-kmer-sizes', 'true'),
+        'hybrid_auto_kmer_sizes': _flag(config, 'hybrid-auto-kmer-sizes', 'false'),
+        'memory_preflight': _flag(config, 'preflight-memory-check', 'true'),
+    }
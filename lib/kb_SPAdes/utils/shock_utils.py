@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+MB = 1000000
+SHOCK_CHUNK_SIZE = 64 * MB  # files larger than this are uploaded in parts of this size
+SHOCK_UPLOAD_WORKERS = 4  # parts sent at the same time
+SHOCK_MAX_ATTEMPTS = 5  # tries of each request before giving up
+SHOCK_RETRY_WAIT = 2  # seconds before the first retry, doubled for each further one
+UPLOAD_STATE_SUFFIX = '.shock_upload.json'
+
+
+def log(message, prefix_newline=False):
+    """Logging function, provides a hook to suppress or redirect log messages."""
+    print(('\n' if prefix_newline else '') + '{0:.2f}'.format(time.time()) + ': ' + str(message))
+
+
+class ShockException(Exception):
+    pass
+
+
+def check_shock_response(response, errtxt):
+    """
+    check_shock_response: raise a ShockException with the Shock error of a failed response
+    """
+    if not response.ok:
+        try:
+            err = json.loads(response.content)['error'][0]
+        except Exception:
+            # this means shock is down or not responding.
+            log("Couldn't parse response error content from Shock: " + str(response.content))
+            response.raise_for_status()
+        raise ShockException(errtxt + str(err))
+
+
+def _multipart_body(chunks, file_name, boundary):
+    yield ('--{}\r\nContent-Disposition: form-data; name="upload"; filename="{}"\r\n'
+           'Content-Type: application/octet-stream\r\n\r\n').format(
+               boundary, file_name).encode('utf-8')
+    for chunk in chunks:
+        yield chunk
+    yield '\r\n--{}--\r\n'.format(boundary).encode('utf-8')
+
+
+def stream_to_shock(shock_url, token, file_name, chunks):
+    """
+    stream_to_shock: save the bytes of an iterator of chunks to a new Shock node as file_name,
+    sending them with chunked transfer encoding as they come, so the file is never written
+    to disk
+    returns the Shock node data, whose 'id' is the node id
+    """
+    if token is None:
+        raise Exception("Authentication token required!")
+
+    boundary = uuid.uuid4().hex
+    header = {'Authorization': 'Oauth {0}'.format(token),
+              'Content-Type': 'multipart/form-data; boundary=' + boundary}
+    response = requests.post(shock_url + '/node', headers=header,
+                             data=_multipart_body(chunks, file_name, boundary),
+                             allow_redirects=True)
+    check_shock_response(response, 'Error trying to upload {} to Shock: '.format(file_name))
+    node = response.json()['data']
+    log('Streamed {} to Shock node {}'.format(file_name, node['id']))
+    return node
+
+
+def _check_upload_response(response, errtxt):
+    # server errors are raised as HTTPErrors for _with_retries to retry them
+    if response.status_code >= 500:
+        response.raise_for_status()
+    check_shock_response(response, errtxt)
+
+
+def _with_retries(request, what):
+    """
+    _with_retries: call request until it returns, at most SHOCK_MAX_ATTEMPTS times, waiting
+    SHOCK_RETRY_WAIT seconds after the first failure and twice as long after each further one;
+    Shock errors other than server errors are not retried
+    """
+    attempts = SHOCK_MAX_ATTEMPTS
+    wait = SHOCK_RETRY_WAIT
+    for attempt in range(1, attempts + 1):
+        try:
+            return request()
+        except ShockException:
+            raise
+        except (requests.exceptions.RequestException, IOError) as e:
+            response = getattr(e, 'response', None)
+            if response is not None and response.status_code < 500:
+                raise
+            if attempt == attempts:
+                raise
+            log('{} failed (attempt {} of {}), retrying in {} s: {}'.format(
+                what, attempt, attempts, wait, e))
+            time.sleep(wait)
+            wait *= 2
+
+
+def _load_upload_state(state_path, upload):
+    """
+    _load_upload_state: the saved state of an interrupted upload of the same file to the same
+    Shock in the same parts, or None
+    """
+    try:
+        with open(state_path) as state_file:
+            state = json.load(state_file)
+    except (IOError, OSError, ValueError):
+        return None
+    if any(state.get(key) != value for key, value in upload.items()):
+        return None
+    return state
+
+
+def _save_upload_state(state_path, state):
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'w') as state_file:
+        json.dump(state, state_file)
+    os.rename(tmp_path, state_path)
+
+
+def upload_file_to_shock(shock_url, token, file_path, chunk_size=SHOCK_CHUNK_SIZE,
+                         workers=SHOCK_UPLOAD_WORKERS, state_path=None):
+    """
+    upload_file_to_shock: save a file to a new Shock node. Files up to chunk_size go in one
+    multipart POST. Larger files go in parts of chunk_size sent by workers threads to a node
+    created for that many parts, and each request is retried on connection and server
+    errors. The node and the parts already sent are saved to state_path (by default next to
+    the file), so an upload that failed resumes with the missing parts when it is called
+    again.
+    returns the Shock node data, with the upload 'stats': 'bytes', 'parts', 'parts_resumed',
+    'seconds' and 'mb_per_s'
+    """
+    if token is None:
+        raise Exception("Authentication token required!")
+    if file_path is None:
+        raise Exception("No file given for upload to SHOCK!")
+
+    file_path = os.path.abspath(file_path)
+    file_name = os.path.basename(file_path)
+    header = {'Authorization': 'Oauth {0}'.format(token)}
+    size = os.path.getsize(file_path)
+    start = time.time()
+
+    if size <= chunk_size:
+        def post_file():
+            with open(file_path, 'rb') as data_file:
+                response = requests.post(shock_url + '/node', headers=header,
+                                         files={'upload': (file_name, data_file)},
+                                         allow_redirects=True)
+            _check_upload_response(response, 'Error trying to upload {} to Shock: '.format(
+                file_path))
+            return response.json()['data']
+        node = _with_retries(post_file, 'Upload of {}'.format(file_name))
+        parts = 1
+        resumed = 0
+    else:
+        parts = (size + chunk_size - 1) // chunk_size
+        state_path = state_path or file_path + UPLOAD_STATE_SUFFIX
+        upload = {'shock_url': shock_url, 'size': size, 'mtime': os.path.getmtime(file_path),
+                  'chunk_size': chunk_size}
+        state = _load_upload_state(state_path, upload)
+        if state is None:
+            def create_node():
+                response = requests.post(shock_url + '/node', headers=header,
+                                         files={'parts': (None, str(parts))},
+                                         allow_redirects=True)
+                _check_upload_response(
+                    response, 'Error trying to create a Shock node for {}: '.format(file_path))
+                return response.json()['data']['id']
+            state = dict(upload, node_id=_with_retries(create_node, 'Shock node creation'),
+                         done=[])
+            _save_upload_state(state_path, state)
+        else:
+            log('Resuming the upload of {} to Shock node {}, {} of {} parts already '
+                'sent'.format(file_name, state['node_id'], len(state['done']), parts))
+        node_url = shock_url + '/node/' + state['node_id']
+        resumed = len(state['done'])
+        lock = threading.Lock()
+
+        def put_part(part):
+            with open(file_path, 'rb') as data_file:
+                data_file.seek((part - 1) * chunk_size)
+                data = data_file.read(chunk_size)
+
+            def put():
+                response = requests.put(node_url, headers=header,
+                                        files={str(part): (file_name, data)},
+                                        allow_redirects=True)
+                _check_upload_response(
+                    response, 'Error trying to upload part {} of {} to Shock: '.format(
+                        part, file_path))
+            _with_retries(put, 'Upload of part {} of {}'.format(part, file_name))
+            with lock:
+                state['done'].append(part)
+                _save_upload_state(state_path, state)
+                sent = len(state['done']) - resumed
+                elapsed = max(time.time() - start, 0.001)
+                log('Uploaded part {} of {} ({} of {} parts, {:.1f} MB/s)'.format(
+                    part, file_name, len(state['done']), parts,
+                    sent * chunk_size / float(MB) / elapsed))
+
+        missing = [part for part in range(1, parts + 1) if part not in state['done']]
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            # list() raises the error of the first part that failed for good
+            list(executor.map(put_part, missing))
+
+        def get_node():
+            response = requests.get(node_url, headers=header, allow_redirects=True)
+            _check_upload_response(response, 'Error trying to get Shock node {}: '.format(
+                state['node_id']))
+            return response.json()['data']
+        node = _with_retries(get_node, 'Shock node lookup')
+        os.remove(state_path)
+
+    seconds = time.time() - start
+    sent_bytes = size - min(size, resumed * chunk_size)
+    node['stats'] = {'bytes': size, 'parts': parts, 'parts_resumed': resumed,
+                     'seconds': seconds,
+                     'mb_per_s': sent_bytes / float(MB) / max(seconds, 0.001)}
+    log('Uploaded {} ({:.1f} MB in {} parts, {} resumed) to Shock node {} in {:.1f} s, '
+        '{:.1f} MB/s'.format(file_name, size / float(MB), parts, resumed, node['id'],
+                             seconds, node['stats']['mb_per_s']))
+    return node
@@ -1,10 +1,16 @@
+import fcntl
 import os
 import re
+import shutil
 import time
 import uuid
 
 from installed_clients.AssemblyUtilClient import AssemblyUtil
+from kb_SPAdes.utils.client_pool import pooled
 from kb_SPAdes.utils.spades_utils import SPAdesUtils
+from kb_SPAdes.utils.fasta_utils import build_fasta_index
+from kb_SPAdes.utils.spades_supervisor import STAGES_FILE, load_stages, stages_report
+from kb_SPAdes.utils.spades_profiler import timed_step
 
 
 def log(message, prefix_newline=False):
@@ -33,6 +39,9 @@ class SPAdesAssembler(object):
 
     PARAM_IN_CS_NAME = 'output_contigset_name'
     SPAdes_PROJECT_DIR = 'spades_project_dir'
+    SPAdes_RESUMABLE_DIR = 'spades_resumable_jobs'
+    RESUME_LOCK_FILE = '.job.lock'
+    RESUMABLE_JOBS_MAX_AGE_DAYS = 7
     SPAdes_final_scaffolds = 'scaffolds.fasta'  # resulting scaffolds sequences
 
     def __init__(self, config, provenance):
@@ -45,7 +54,7 @@ class SPAdesAssembler(object):
         self.token = config["KB_AUTH_TOKEN"]
         self.provenance = provenance
 
-        self.au = AssemblyUtil(self.callback_url)
+        self.au = pooled(AssemblyUtil(self.callback_url))
 
         self.scratch = os.path.join(config['scratch'], str(uuid.uuid4()))
         mkdir_p(self.scratch)
@@ -53,10 +62,16 @@ class SPAdesAssembler(object):
         self.spades_version = 'SPADES-' + os.environ['SPADES_VERSION']
         self.proj_dir = self._create_proj_dir(self.scratch)
         self.s_utils = SPAdesUtils(self.proj_dir, config)
+        # resumable jobs keep their project dir here, keyed by SPAdesUtils.resume_key
+        self.resume_dir = config.get('resumable-jobs-dir',
+                                     os.path.join(config['scratch'], self.SPAdes_RESUMABLE_DIR))
+        self.resume_max_age_days = float(config.get('resumable-jobs-max-age-days',
+                                                    self.RESUMABLE_JOBS_MAX_AGE_DAYS))
+        self._resume_lock = None
         # END_CONSTRUCTOR
         pass
 
-    def _save_assembly(self, params):
+    def _save_assembly(self, params, steps=None):
         """
         _save_assembly: save the assembly to KBase and, if everything has gone well, create a report
         """
@@ -72,21 +87,30 @@ class SPAdesAssembler(object):
             log('Found the directory {} that hosts the contig fasta file: {}'.format(
                     fa_file_dir, self.SPAdes_final_scaffolds))
             fa_file_path = os.path.join(fa_file_dir, self.SPAdes_final_scaffolds)
+            # index the contigs once so the filter and the report skip rescanning the file
+            build_fasta_index(fa_file_path)
 
             log("Load assembly from fasta file {}...".format(fa_file_path))
             report_file = self.SPAdes_final_scaffolds
+            filter_stats = None
             min_ctg_length = params.get('min_contig_length', 0)
-            if min_ctg_length > 0:
-                report_file = self.s_utils.save_assembly(
-                    fa_file_path, wsname, params[self.PARAM_IN_CS_NAME], min_ctg_length
-                )['filtered_input']
-            else:
-                self.s_utils.save_assembly(fa_file_path, wsname,
-                                           params[self.PARAM_IN_CS_NAME])
+            if steps is None:
+                steps = []
+            with timed_step(steps, 'Filter and upload assembly'):
+                if min_ctg_length > 0:
+                    save_ret = self.s_utils.save_assembly(
+                        fa_file_path, wsname, params[self.PARAM_IN_CS_NAME], min_ctg_length)
+                    report_file = save_ret['filtered_input']
+                    filter_stats = save_ret['filter_stats']
+                else:
+                    self.s_utils.save_assembly(fa_file_path, wsname,
+                                               params[self.PARAM_IN_CS_NAME])
 
             if params['create_report'] == 1:
+                stages = load_stages(os.path.join(self.proj_dir, STAGES_FILE))
                 report_name, report_ref = self.s_utils.generate_report(
-                                        report_file, params, fa_file_dir, wsname)
+                                        report_file, params, fa_file_dir, wsname, filter_stats,
+                                        stages_report(stages), steps)
                 returnVal = {'report_name': report_name,
                              'report_ref': report_ref}
         return returnVal
@@ -111,6 +135,67 @@ class SPAdesAssembler(object):
         mkdir_p(prjdir)
         return prjdir
 
+    def _use_resumable_proj_dir(self, resume_key):
+        """
+        _use_resumable_proj_dir: switch to the project dir of the job with the given key, so
+        an earlier, interrupted attempt of the same job leaves its SPAdes checkpoints for this
+        one; the dir is locked so two attempts never run in it at the same time
+        """
+        self._sweep_resumable_proj_dirs(keep=resume_key)
+        prjdir = os.path.join(self.resume_dir, resume_key)
+        mkdir_p(prjdir)
+        lock_file = open(os.path.join(prjdir, self.RESUME_LOCK_FILE), 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            lock_file.close()
+            raise ValueError('Another attempt of this HybridSPAdes job is running in ' + prjdir)
+        # held until this job's process exits
+        self._resume_lock = lock_file
+        log('Resumable job, using the project dir {}'.format(prjdir))
+        self.proj_dir = prjdir
+        self.s_utils.proj_dir = prjdir
+
+    def _sweep_resumable_proj_dirs(self, keep=None):
+        """
+        _sweep_resumable_proj_dirs: remove the project dirs of resumable jobs whose last attempt
+        started more than resumable-jobs-max-age-days ago, skipping the dir with the key in keep
+        and the dirs an attempt is running in
+        """
+        if not os.path.isdir(self.resume_dir):
+            return
+        oldest = time.time() - self.resume_max_age_days * 24 * 3600
+        for key in os.listdir(self.resume_dir):
+            prjdir = os.path.join(self.resume_dir, key)
+            if key == keep or not os.path.isdir(prjdir):
+                continue
+            lock_path = os.path.join(prjdir, self.RESUME_LOCK_FILE)
+            last_attempt = os.path.getmtime(
+                lock_path if os.path.exists(lock_path) else prjdir)
+            if last_attempt >= oldest:
+                continue
+            with open(lock_path, 'a') as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except (IOError, OSError):
+                    continue
+                log('Removing the project dir {} of a resumable job last run {:.1f} days '
+                    'ago'.format(prjdir, (time.time() - last_attempt) / (24 * 3600)))
+                shutil.rmtree(prjdir, ignore_errors=True)
+
+    def _remove_resumable_proj_dir(self):
+        """
+        _remove_resumable_proj_dir: remove the project dir of a resumable job once its
+        assembly is saved, as no retry needs its checkpoints any more, and release its lock
+        """
+        if self._resume_lock is None:
+            return
+        log('Removing the project dir {} of the finished resumable job'.format(self.proj_dir))
+        shutil.rmtree(self.proj_dir, ignore_errors=True)
+        self._resume_lock.close()
+        self._resume_lock = None
+
+    # end of private methods
     def run_hybrid_spades(self, params):
         """
         run_hybrid_spades: breakdown steps of SPAdes assembling process
@@ -119,28 +204,41 @@ class SPAdesAssembler(object):
         validated_params = self.s_utils.check_spades_params(params)
         assemble_ok = -1
 
-        # 2: retrieve the reads data from input paramete
-        hybrid_reads_info = self.s_utils.get_hybrid_reads_info(validated_params)
-        if hybrid_reads_info:  # UNPACKS the reads_info
-            (sgl_rds, pe_rds, mp_rds, pb_ccs, pb_clr, np_rds, sgr_rds, tr_ctgs, ut_ctgs) = \
-                hybrid_reads_info
-
-            # 3. create the yaml input data set file
-            yaml_file = self.s_utils.construct_yaml_dataset_file(
-                sgl_rds, pe_rds, mp_rds, pb_ccs, pb_clr, np_rds, sgr_rds, tr_ctgs, ut_ctgs)
-
-            # 4. run the spades.py against the yaml file
-            if os.path.isfile(yaml_file):
-                basic_opts = validated_params.get('basic_options', None)
-                pipleline_opts = validated_params.get('pipeline_options', None)
-                km_sizes = validated_params.get('kmer_sizes', None)
-                dna_src = validated_params.get('dna_source', None)
-                assemble_ok = self.s_utils.run_assemble(yaml_file, km_sizes, dna_src,
-                                                        basic_opts, pipleline_opts)
+        # the cached reads of this job are pinned so that other jobs cannot evict them
+        # until SPAdes is done
+        steps = []
+        with self.s_utils.reads_cache.pinned(), self.s_utils.corrected_reads_cache.pinned():
+            # 2: retrieve the reads data from input paramete
+            with timed_step(steps, 'Download reads'):
+                hybrid_reads_info = self.s_utils.get_hybrid_reads_info(validated_params)
+            if hybrid_reads_info:  # UNPACKS the reads_info
+                (sgl_rds, pe_rds, mp_rds, pb_ccs, pb_clr, np_rds, sgr_rds, tr_ctgs, ut_ctgs) = \
+                    hybrid_reads_info
+
+                if self.s_utils.PARAM_IN_CONTINUE in validated_params.get('pipeline_options', []):
+                    self._use_resumable_proj_dir(
+                        self.s_utils.resume_key(validated_params, hybrid_reads_info))
+
+                # 3. create the yaml input data set file
+                yaml_file = self.s_utils.construct_yaml_dataset_file(
+                    sgl_rds, pe_rds, mp_rds, pb_ccs, pb_clr, np_rds, sgr_rds, tr_ctgs, ut_ctgs)
+
+                # 4. run the spades.py against the yaml file
+                if os.path.isfile(yaml_file):
+                    basic_opts = validated_params.get('basic_options', None)
+                    pipleline_opts = validated_params.get('pipeline_options', None)
+                    km_sizes = validated_params.get('kmer_sizes', None)
+                    dna_src = validated_params.get('dna_source', None)
+                    with timed_step(steps, 'SPAdes'):
+                        assemble_ok = self.s_utils.run_assemble(
+                            yaml_file, km_sizes, dna_src, basic_opts, pipleline_opts,
+                            self.s_utils.corrected_reads_libs(hybrid_reads_info))
 
         # 5. save the assembly to KBase and, if everything has gone well, create a report
         if assemble_ok == 0:
-            return self._save_assembly(validated_params)
+            returnVal = self._save_assembly(validated_params, steps)
+            self._remove_resumable_proj_dir()
+            return returnVal
         else:
             log("run_hybrid_spades failed.")
             return {"report_ref": None, "report_name": None}
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from contextlib import contextmanager
+
+import psutil
+
+
+PROFILE_INTERVAL = 5  # seconds between samples of the spades.py process tree
+MB = 1000000
+
+
+def log(message, prefix_newline=False):
+    """Logging function, provides a hook to suppress or redirect log messages."""
+    print(('\n' if prefix_newline else '') + '{0:.2f}'.format(time.time()) + ': ' + str(message))
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{}:{:02d}:{:02d}'.format(hours, minutes, seconds)
+
+
+class ProcessTreeSampler(object):
+    """
+    Samples the CPU use, resident memory, I/O bytes and thread count of a process and all of
+    its descendants (spades.py runs spades-hammer, spades-core, ... as child processes) every
+    interval seconds on a background thread. Each sample is tagged with the pipeline stage
+    returned by stage_of at the time it was taken.
+    """
+
+    def __init__(self, pid, interval=PROFILE_INTERVAL, stage_of=None):
+        self.pid = pid
+        self.interval = interval
+        self.stage_of = stage_of
+        self.samples = []
+        self._procs = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _tree(self):
+        # keep the Process objects between samples, cpu_percent is measured since the last call
+        try:
+            root = self._procs.get(self.pid) or psutil.Process(self.pid)
+            tree = [root] + root.children(recursive=True)
+        except psutil.Error:
+            return []
+        procs = {}
+        for proc in tree:
+            procs[proc.pid] = self._procs.get(proc.pid, proc)
+        self._procs = procs
+        return list(procs.values())
+
+    def sample(self):
+        """
+        sample: take one sample of the process tree and return it, or None if it has exited
+        """
+        sample = {'time': time.time(), 'stage': self.stage_of() if self.stage_of else None,
+                  'processes': 0, 'cpu_percent': 0.0, 'rss': 0, 'threads': 0,
+                  'read_bytes': 0, 'write_bytes': 0}
+        for proc in self._tree():
+            try:
+                with proc.oneshot():
+                    sample['cpu_percent'] += proc.cpu_percent(interval=None)
+                    sample['rss'] += proc.memory_info().rss
+                    sample['threads'] += proc.num_threads()
+                    try:
+                        io = proc.io_counters()
+                        sample['read_bytes'] += io.read_bytes
+                        sample['write_bytes'] += io.write_bytes
+                    except (psutil.AccessDenied, AttributeError, NotImplementedError):
+                        pass
+                sample['processes'] += 1
+            except psutil.Error:
+                continue  # exited between listing and sampling
+        if not sample['processes']:
+            return None
+        self.samples.append(sample)
+        return sample
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self.sample()  # primes cpu_percent
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+
+def summarize_profile(samples):
+    """
+    summarize_profile: per-stage peak RSS, mean and peak CPU, peak thread count and the bytes
+    read and written while in the stage, in order of the stages' first sample.
+    I/O counters are cumulative per process, so the bytes of a stage are the increase of the
+    tree total over its samples (processes exiting within a stage make this a lower bound).
+    """
+    summary = []
+    by_stage = {}
+    prev = None
+    for sample in samples:
+        stage = sample['stage'] or 'Startup'
+        if stage not in by_stage:
+            by_stage[stage] = {'stage': stage, 'samples': 0, 'peak_rss': 0, 'cpu_total': 0.0,
+                               'peak_cpu_percent': 0.0, 'peak_threads': 0,
+                               'read_bytes': 0, 'write_bytes': 0}
+            summary.append(by_stage[stage])
+        stats = by_stage[stage]
+        stats['samples'] += 1
+        stats['peak_rss'] = max(stats['peak_rss'], sample['rss'])
+        stats['cpu_total'] += sample['cpu_percent']
+        stats['peak_cpu_percent'] = max(stats['peak_cpu_percent'], sample['cpu_percent'])
+        stats['peak_threads'] = max(stats['peak_threads'], sample['threads'])
+        if prev is not None:
+            stats['read_bytes'] += max(0, sample['read_bytes'] - prev['read_bytes'])
+            stats['write_bytes'] += max(0, sample['write_bytes'] - prev['write_bytes'])
+        prev = sample
+    for stats in summary:
+        stats['mean_cpu_percent'] = stats.pop('cpu_total') / stats['samples']
+    return summary
+
+
+def profile_report(summary):
+    """
+    profile_report: report text table of a summarize_profile summary
+    """
+    if not summary:
+        return ''
+    report = 'SPAdes resource profile (stage: peak RSS, mean/peak CPU, peak threads, I/O):\n'
+    for stats in summary:
+        report += '   {}: {:.0f} MB, {:.0f}%/{:.0f}%, {} threads, {:.0f} MB read, ' \
+                  '{:.0f} MB written\n'.format(
+                      stats['stage'], stats['peak_rss'] / float(MB),
+                      stats['mean_cpu_percent'], stats['peak_cpu_percent'],
+                      stats['peak_threads'], stats['read_bytes'] / float(MB),
+                      stats['write_bytes'] / float(MB))
+    return report
+
+
+@contextmanager
+def timed_step(steps, name):
+    """
+    timed_step: record the wall-clock time of a step of the wrapper (downloads, phred checks,
+    QUAST, upload, ...) in the steps list
+    """
+    start = time.time()
+    try:
+        yield
+    finally:
+        steps.append({'step': name, 'start': start, 'duration': time.time() - start})
+        log('{} took {:.1f} s'.format(name, steps[-1]['duration']))
+
+
+def steps_report(steps):
+    """
+    steps_report: report text listing the wall-clock time of the wrapper steps
+    """
+    if not steps:
+        return ''
+    report = 'Job step durations:\n'
+    for step in steps:
+        report += '   {}: {}\n'.format(step['step'], format_duration(step['duration']))
+    return report
+
+
+def connection_report(stats):
+    """
+    connection_report: report text of the HTTP connections opened and reused by the KBase
+    clients, see kb_SPAdes.utils.client_pool.session_pool_stats
+    """
+    if not stats or not stats['requests']:
+        return ''
+    return 'Service calls: {} requests, {} connections opened, {} reused\n'.format(
+        stats['requests'], stats['connections_opened'], stats['connections_reused'])
+
+
+def job_wait_report(stats):
+    """
+    job_wait_report: report text of the waits for the jobs run by the KBase clients, see
+    kb_SPAdes.utils.client_pool.job_wait_stats
+    """
+    if not stats or not stats['jobs']:
+        return ''
+    return ('Service jobs: {} jobs, {} status checks, {:.1f} s waited, at most {:.1f} s lost '
+            'between jobs finishing and being seen\n').format(
+                stats['jobs'], stats['checks'], stats['wait_seconds'],
+                stats['lost_seconds_bound'])
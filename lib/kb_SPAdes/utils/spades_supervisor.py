@@ -0,0 +1,432 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import psutil
+
+from kb_SPAdes.utils.spades_profiler import (ProcessTreeSampler, format_duration,
+                                             summarize_profile, profile_report)
+
+# spades.py marks each pipeline stage with lines like "===== K33 started." / "===== K33 finished."
+STAGE_RE = re.compile(r'^===== (.+?) (started|finished)\.')
+ERROR_RE = re.compile(r'^== Error ==\s*(.*)')
+STAGES_FILE = 'spades_stages.json'
+TERMINATE_GRACE = 30  # seconds between SIGTERM and SIGKILL of a canceled spades.py
+GB = 1000000000
+
+# what becomes of the output and tmp dirs of a canceled spades.py run
+SCRATCH_KEEP = 'keep'  # left for a later run to continue from its checkpoints
+SCRATCH_REMOVE = 'remove'
+SCRATCH_POLICIES = (SCRATCH_KEEP, SCRATCH_REMOVE)
+
+# the running supervisors by cancel group, and the groups canceled so far
+_running = {}
+_canceled_groups = set()
+_running_lock = threading.Lock()
+_scope = threading.local()
+
+
+def log(message, prefix_newline=False):
+    """Logging function, provides a hook to suppress or redirect log messages."""
+    print(('\n' if prefix_newline else '') + '{0:.2f}'.format(time.time()) + ': ' + str(message))
+
+
+def _wait_gone(procs, timeout):
+    # exited processes are not reaped here: spades.py is reaped by the wait in run, for its
+    # exit code, and may be in that wait when a signal handler cancels it
+    deadline = time.time() + timeout
+    while True:
+        alive = []
+        for proc in procs:
+            try:
+                if proc.status() != psutil.STATUS_ZOMBIE:
+                    alive.append(proc)
+            except psutil.NoSuchProcess:
+                pass
+        if not alive or time.time() >= deadline:
+            return alive
+        time.sleep(0.1)
+
+
+class SPAdesSupervisor(object):
+    """
+    Runs spades.py, reading its combined stdout/stderr on a separate thread as it is written.
+    Stage transitions (read error correction, each K iteration, mismatch correction,
+    scaffolding, ...) become timestamped progress events, and the duration of every stage is
+    recorded. Stages nest: the K iterations run inside "Assembling".
+    With a profile_interval the process tree is also sampled, see ProcessTreeSampler.
+    """
+
+    def __init__(self, cmd, cwd=None, echo=True, progress=log, profile_interval=0):
+        self.cmd = cmd
+        self.cwd = cwd
+        self.echo = echo
+        self.progress = progress
+        self.profile_interval = profile_interval
+        self.process = None
+        self.sampler = None
+        self.events = []
+        self.stages = []
+        self.errors = []
+        self.canceled = None
+        self._open_stages = {}
+        self._start = None
+        self._terminate_lock = threading.Lock()
+
+    def _handle_line(self, line):
+        if self.echo:
+            sys.stdout.write(line)
+            sys.stdout.flush()
+        line = line.strip()
+        error = ERROR_RE.match(line)
+        if error:
+            self.errors.append(error.group(1))
+            return
+        stage = STAGE_RE.match(line)
+        if not stage:
+            return
+        name, event = stage.groups()
+        now = time.time()
+        self.events.append({'time': now, 'stage': name, 'event': event})
+        if event == 'started':
+            self._open_stages[name] = now
+            self.progress('SPAdes stage started: {} ({} elapsed)'.format(
+                name, format_duration(now - self._start)))
+        elif name in self._open_stages:
+            self._close_stage(name, now, True)
+            self.progress('SPAdes stage finished: {} in {}'.format(
+                name, format_duration(self.stages[-1]['duration'])))
+
+    def current_stage(self):
+        """
+        current_stage: the innermost stage still running, or None
+        """
+        if not self._open_stages:
+            return None
+        return max(self._open_stages, key=self._open_stages.get)
+
+    def _close_stage(self, name, end, finished):
+        start = self._open_stages.pop(name)
+        self.stages.append({'stage': name,
+                            'start': start,
+                            'end': end,
+                            'duration': end - start,
+                            'finished': finished})
+
+    def _read_output(self):
+        # the pipe is drained to the end whatever a line does to _handle_line: spades.py would
+        # block on a full pipe otherwise, and run would wait for it for good
+        failed = False
+        for line in iter(self.process.stdout.readline, ''):
+            try:
+                self._handle_line(line)
+            except Exception as e:
+                if not failed:
+                    log('Could not handle spades.py output line {!r}: {}'.format(line, e))
+                    failed = True
+        self.process.stdout.close()
+
+    def run(self):
+        """
+        run: run spades.py to completion and return its exit code, or None if it was canceled
+        before it started
+        """
+        self._start = time.time()
+        # spades.py and the spades-core, spades-hammer, ... it starts get a process group of
+        # their own, so terminate reaches all of them
+        with self._terminate_lock:
+            if self.canceled:
+                return None
+            self.process = subprocess.Popen(self.cmd, cwd=self.cwd, shell=False,
+                                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                            universal_newlines=True, bufsize=1,
+                                            encoding='utf-8', errors='replace',
+                                            start_new_session=True)
+        reader = threading.Thread(target=self._read_output)
+        reader.daemon = True
+        reader.start()
+        if self.profile_interval > 0:
+            self.sampler = ProcessTreeSampler(self.process.pid, self.profile_interval,
+                                              self.current_stage)
+            self.sampler.start()
+        returncode = self.process.wait()
+        if self.sampler:
+            self.sampler.stop()
+        reader.join()
+
+        end = time.time()
+        # stages still open when spades.py exited were cut short by a failure
+        for name in sorted(self._open_stages, key=self._open_stages.get):
+            self._close_stage(name, end, False)
+        self.progress('spades.py exited with code {} after {}'.format(
+            returncode, format_duration(end - self._start)))
+        return returncode
+
+    def terminate(self, reason, grace=TERMINATE_GRACE):
+        """
+        terminate: stop spades.py and every process it started, with SIGTERM to its process
+        group and SIGKILL to what is still running grace seconds later
+        returns the cancel info ('reason', 'seconds' run, 'stage', and the 'processes',
+        'threads' and 'rss_bytes' released), also kept as canceled, or None if spades.py was
+        not running
+        """
+        with self._terminate_lock:
+            if self.canceled or (self.process and self.process.poll() is not None):
+                return None
+            if self.process is None:
+                # canceled before it started, run will not start it
+                self.canceled = {'reason': reason, 'seconds': 0, 'stage': None,
+                                 'processes': 0, 'threads': 0, 'rss_bytes': 0, 'killed': 0}
+                return self.canceled
+            try:
+                root = psutil.Process(self.process.pid)
+                procs = [root] + root.children(recursive=True)
+            except psutil.NoSuchProcess:
+                return None
+            threads = rss = 0
+            for proc in procs:
+                try:
+                    threads += proc.num_threads()
+                    rss += proc.memory_info().rss
+                except psutil.NoSuchProcess:
+                    pass
+            self.canceled = {'reason': reason,
+                             'seconds': time.time() - self._start,
+                             'stage': self.current_stage(),
+                             'processes': len(procs),
+                             'threads': threads,
+                             'rss_bytes': rss}
+            self.progress('Canceling spades.py ({}) in stage {}: terminating {} processes'.format(
+                reason, self.canceled['stage'], len(procs)))
+            self._signal_tree(procs, signal.SIGTERM)
+            alive = _wait_gone(procs, grace)
+            if alive:
+                self.progress('Killing {} processes still running {} s after SIGTERM'.format(
+                    len(alive), grace))
+                self._signal_tree(alive, signal.SIGKILL)
+                _wait_gone(alive, grace)
+            self.canceled['killed'] = len(alive)
+            return self.canceled
+
+    def _signal_tree(self, procs, signum):
+        try:
+            os.killpg(self.process.pid, signum)
+        except OSError:
+            pass
+        # children that left the process group
+        for proc in procs:
+            try:
+                proc.send_signal(signum)
+            except psutil.NoSuchProcess:
+                pass
+
+    def write_stages(self, stages_path):
+        """
+        write_stages: save the progress events, stage durations and, when profiled, the
+        timeline of process tree samples with its per-stage summary as JSON
+        """
+        stages = {'start': self._start, 'events': self.events, 'stages': self.stages,
+                  'errors': self.errors, 'canceled': self.canceled}
+        if self.sampler:
+            stages['samples'] = self.sampler.samples
+            stages['profile'] = summarize_profile(self.sampler.samples)
+        with open(stages_path, 'w') as stages_file:
+            json.dump(stages, stages_file, indent=1)
+
+
+def load_stages(stages_path):
+    """
+    load_stages: the stages written by SPAdesSupervisor.write_stages, or None if there are none
+    """
+    try:
+        with open(stages_path) as stages_file:
+            return json.load(stages_file)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def stages_report(stages):
+    """
+    stages_report: report text listing the duration of every SPAdes stage, and the resource
+    profile of the stages when there is one
+    """
+    if not stages or not stages['stages']:
+        return profile_report(stages.get('profile')) if stages else ''
+    report = 'SPAdes stage durations:\n'
+    for stage in sorted(stages['stages'], key=lambda s: s['start']):
+        report += '   {}: {}{}\n'.format(stage['stage'], format_duration(stage['duration']),
+                                          '' if stage['finished'] else ' (unfinished)')
+    return report + profile_report(stages.get('profile'))
+
+
+class SPAdesCanceled(Exception):
+    """
+    Raised by run_spades when its spades.py run was canceled, with the cancel report as message
+    and the cancel info as info
+    """
+
+    def __init__(self, message, info=None):
+        super(SPAdesCanceled, self).__init__(message)
+        self.info = info
+
+
+@contextmanager
+def cancel_group(name, clear=True):
+    """
+    cancel_group: the spades.py runs started by this thread in the with block can be canceled
+    together with cancel_runs(name); with clear, a cancel of the group is forgotten when the
+    block ends (threads joining the group of another thread leave that to it)
+    """
+    previous = getattr(_scope, 'group', None)
+    _scope.group = name
+    try:
+        yield
+    finally:
+        _scope.group = previous
+        if clear and name is not None:
+            with _running_lock:
+                _canceled_groups.discard(name)
+
+
+def current_cancel_group():
+    """
+    current_cancel_group: the cancel group of this thread, to be passed on to the threads it
+    starts, or None
+    """
+    return getattr(_scope, 'group', None)
+
+
+def cancel_runs(group=None, reason='canceled', grace=TERMINATE_GRACE):
+    """
+    cancel_runs: terminate the running spades.py runs of a cancel group, and refuse its later
+    runs until the cancel_group block of the group ends; with no group, terminate the runs
+    running now and nothing else
+    returns the cancel info of each run terminated
+    """
+    with _running_lock:
+        if group is not None:
+            _canceled_groups.add(group)
+        supervisors = [sup for sup, sup_group in _running.items()
+                       if group is None or sup_group == group]
+    canceled = []
+    for supervisor in supervisors:
+        info = supervisor.terminate(reason, grace)
+        if info:
+            canceled.append(info)
+    return canceled
+
+
+def _has_runs(group):
+    # called from a signal handler, which must not wait for _running_lock: the thread it
+    # interrupted may hold it
+    try:
+        return any(group is None or sup_group == group for sup_group in list(_running.values()))
+    except RuntimeError:  # changed while being read, so there are runs
+        return True
+
+
+def install_cancel_handlers(group=None, signums=(signal.SIGTERM, signal.SIGINT)):
+    """
+    install_cancel_handlers: have SIGTERM and SIGINT cancel the spades.py runs of a cancel
+    group (all the running ones with no group), so the job fails with a cancel report instead
+    of leaving their processes behind. Without a run to cancel the signal gets its previous
+    handling.
+    The handler only starts a thread doing the cancel, since the thread it interrupts may hold
+    the locks cancel_runs takes, and terminating spades.py can take its whole grace period.
+    """
+    def handler(signum, frame):
+        name = signal.Signals(signum).name
+        if not _has_runs(group):
+            signal.signal(signum, previous[signum])
+            os.kill(os.getpid(), signum)
+            return
+        log('Received {}, canceling the running SPAdes runs'.format(name))
+        canceler = threading.Thread(target=cancel_runs, args=(group, 'received ' + name))
+        canceler.daemon = True
+        canceler.start()
+
+    previous = {}
+    for signum in signums:
+        previous[signum] = signal.signal(signum, handler)
+
+
+def scratch_policy(config):
+    """
+    scratch_policy: the cancel-scratch-policy setting of config, keep by default
+    """
+    policy = (config.get('cancel-scratch-policy') or SCRATCH_KEEP).strip().lower()
+    if policy not in SCRATCH_POLICIES:
+        raise ValueError('cancel-scratch-policy must be one of {}, not {}'.format(
+            ', '.join(SCRATCH_POLICIES), policy))
+    return policy
+
+
+def _dir_size(path):
+    size = 0
+    for root, folders, files in os.walk(path):
+        for f in files:
+            try:
+                size += os.lstat(os.path.join(root, f)).st_size
+            except OSError:
+                pass
+    return size
+
+
+def cancel_report(info):
+    """
+    cancel_report: report text of the cancel info of a spades.py run
+    """
+    report = 'SPAdes run canceled ({}) after {} in stage {}: released {} processes, {} ' \
+             'threads, {:.1f} GB of memory'.format(
+                 info['reason'], format_duration(info['seconds']), info['stage'],
+                 info['processes'], info['threads'], info['rss_bytes'] / float(GB))
+    if info.get('killed'):
+        report += ' ({} killed)'.format(info['killed'])
+    if 'scratch_bytes' in info:
+        report += ', {} {:.1f} GB of scratch'.format(
+            'removed' if info['scratch_policy'] == SCRATCH_REMOVE else 'kept',
+            info['scratch_bytes'] / float(GB))
+    return report
+
+
+def run_spades(cmd, cwd=None, echo=True, stages_path=None, profile_interval=0,
+               scratch_dirs=(), scratch_policy=SCRATCH_KEEP):
+    """
+    run_spades: run spades.py under a SPAdesSupervisor, saving its stages to stages_path,
+    sampling the process tree every profile_interval seconds if it is > 0.
+    The run belongs to the cancel group of this thread. If it is canceled the scratch_dirs are
+    removed or kept by scratch_policy and SPAdesCanceled is raised.
+    returns the supervisor, whose process.returncode is the spades.py exit code
+    """
+    group = current_cancel_group()
+    supervisor = SPAdesSupervisor(cmd, cwd, echo, profile_interval=profile_interval)
+    with _running_lock:
+        if group is not None and group in _canceled_groups:
+            raise SPAdesCanceled('SPAdes run canceled before it started')
+        _running[supervisor] = group
+    try:
+        supervisor.run()
+    finally:
+        with _running_lock:
+            _running.pop(supervisor, None)
+    if stages_path:
+        supervisor.write_stages(stages_path)
+    info = supervisor.canceled
+    if info:
+        info['scratch_policy'] = scratch_policy
+        info['scratch_bytes'] = sum(_dir_size(d) for d in scratch_dirs if os.path.isdir(d))
+        if scratch_policy == SCRATCH_REMOVE:
+            for scratch_dir in scratch_dirs:
+                shutil.rmtree(scratch_dir, ignore_errors=True)
+        report = cancel_report(info)
+        log(report)
+        raise SPAdesCanceled(report, info)
+    return supervisor
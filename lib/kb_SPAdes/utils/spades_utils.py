@@ -3,14 +3,12 @@ import re
 import time
 import os
 import errno
-import numpy as np
-import zipfile
-import subprocess
 from pprint import pprint
 import uuid
 import copy
 import json
-import psutil
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
 from installed_clients.WorkspaceClient import Workspace
 from installed_clients.KBaseReportClient import KBaseReport
@@ -19,6 +17,26 @@ from installed_clients.kb_quastClient import kb_quast
 from installed_clients.ReadsUtilsClient import ReadsUtils
 from installed_clients.baseclient import ServerError
 
+from kb_SPAdes.utils.client_pool import pooled, session_pool_stats, job_wait_stats
+from kb_SPAdes.utils.reads_cache import (CorrectedReadsCache, READS_DOWNLOAD_OPTIONS,
+                                         merge_corrected_dataset)
+from kb_SPAdes.utils.settings import load_settings
+from kb_SPAdes.utils.resource_planner import plan_resources, input_size
+from kb_SPAdes.utils.memory_estimator import DEFAULT_KMER_SIZES, CONTIG_TYPES, is_long_read
+from kb_SPAdes.utils.kmer_selector import plan_kmer_sizes
+from kb_SPAdes.utils.spades_supervisor import STAGES_FILE, run_spades
+from kb_SPAdes.utils.spades_profiler import (timed_step, steps_report, connection_report,
+                                             job_wait_report)
+from kb_SPAdes.utils.zip_utils import (ZIP_COMPRESSION_LEVEL, zip_files, stream_zip_files,
+                                       zip_report)
+from kb_SPAdes.utils.shock_utils import stream_to_shock
+from kb_SPAdes.utils.output_manifest import (DEFAULT_OUTPUT_CATEGORIES, build_manifest,
+                                             manifest_report, split_setting)
+from kb_SPAdes.utils.fasta_utils import (FASTA_INDEX_SUFFIX, filter_fasta_by_length,
+                                         load_fasta_stats, fasta_filter_report,
+                                         fasta_stats_report)
+from kb_SPAdes.utils.fastq_utils import sniff_phred_type
+
 
 def log(message, prefix_newline=False):
     """Logging function, provides a hook to suppress or redirect log messages."""
@@ -60,7 +78,7 @@ class SPAdesUtils:
     PARAM_IN_ONLY_ERROR_CORR = 'only-error-correction'  # --only-error-correction
     PARAM_IN_ONLY_ASSEMBLER = 'only-assembler'  # --only-assembler
     PARAM_IN_CAREFUL = 'careful'  # --careful
-    PARAM_IN_CONTINUE = 'continue'  # --continue
+    PARAM_IN_CONTINUE = 'continue'  # resume with --restart-from last
     PARAM_IN_DISABLE_GZIP = 'disable-gzip-output'  # --disable-gzip-output
 
     # Input parameters
@@ -74,18 +92,14 @@ class SPAdesUtils:
     PARAM_IN_DNA_SOURCE = 'dna_source'
     PARAM_IN_PIPELINE_OPTION = 'pipeline_options'
     ASSEMBLE_RESULTS_DIR = 'assemble_results'
+    SPADES_PIPELINE_STATE_DIR = 'pipeline_state'  # spades.py checkpoints of the output dir
 
     INVALID_WS_OBJ_NAME_RE = re.compile('[^\\w\\|._-]')
     INVALID_WS_NAME_RE = re.compile('[^\\w:._-]')
 
-    THREADS_PER_CORE = 3
-    MAX_THREADS = 64  # per email thread with Anton Korobeynikov
-    MAX_THREADS_META = 128  # Increase threads for metagenomic assemblies
-    MEMORY_OFFSET_GB = 1  # 1GB
-    MIN_MEMORY_GB = 4
-    MAX_MEMORY_GB_SPADES = 500
-    MAX_MEMORY_GB_META_SPADES = 1000
     GB = 1000000000
+    MAX_DOWNLOAD_WORKERS = 4  # concurrent ReadsUtils.download_reads calls per reads list
+    ZIP_WORKERS = 4
 
     # private method definition
     def __init__(self, prj_dir, config):
@@ -97,12 +111,40 @@ class SPAdesUtils:
         if 'handle-service-url' in config:
             self.handle_url = config['handle-service-url']
 
-        self.ws_client = Workspace(self.workspace_url, token=self.token)
-        self.ru = ReadsUtils(self.callback_url, token=self.token, service_ver='release')
-        self.au = AssemblyUtil(self.callback_url, token=self.token, service_ver='release')
-        self.kbr = KBaseReport(self.callback_url)
-        self.kbq = kb_quast(self.callback_url)
+        self.ws_client = pooled(Workspace(self.workspace_url, token=self.token))
+        self.ru = pooled(ReadsUtils(self.callback_url, token=self.token, service_ver='release'))
+        self.au = pooled(AssemblyUtil(self.callback_url, token=self.token,
+                                      service_ver='release'))
+        self.kbr = pooled(KBaseReport(self.callback_url))
+        self.kbq = pooled(kb_quast(self.callback_url))
         self.proj_dir = prj_dir
+        self.max_download_workers = int(config.get('max-download-workers',
+                                                   self.MAX_DOWNLOAD_WORKERS))
+        settings = load_settings(config)
+        self.reads_cache = settings['reads_cache']
+        self.corrected_reads_cache = settings['corrected_reads_cache']
+        self.profile_interval = settings['profile_interval']
+        self.zip_compression_level = int(config.get('zip-compression-level',
+                                                    ZIP_COMPRESSION_LEVEL))
+        self.zip_workers = int(config.get('zip-workers', self.ZIP_WORKERS))
+        # which files of the spades.py output dir go into the output zip, see build_manifest
+        self.output_categories = split_setting(
+            config.get('output-categories', ','.join(DEFAULT_OUTPUT_CATEGORIES)))
+        self.output_include = split_setting(config.get('output-include-patterns'))
+        self.output_exclude = split_setting(config.get('output-exclude-patterns'))
+        self.output_max_file_bytes = float(config.get('output-max-file-gb', 0)) * self.GB
+        self.output_max_total_bytes = float(config.get('output-max-total-gb', 0)) * self.GB
+        # stream the output zip to Shock as it is packed instead of writing it to scratch first
+        self.stream_output_zip = (config.get('stream-output-zip', 'true').lower() == 'true' and
+                                  hasattr(self, 'shock_url'))
+
+        # threads and memory of the spades.py runs are reserved with the other runs on the node
+        self.node_scheduler = settings['node_scheduler']
+        self.cancel_scratch_policy = settings['cancel_scratch_policy']
+        # pick the k-mer sizes from the read lengths when none are given, instead of the
+        # documented default of DEFAULT_KMER_SIZES; off unless asked for in the config
+        self.auto_kmer_sizes = settings['hybrid_auto_kmer_sizes']
+        self.memory_preflight = settings['memory_preflight']
 
         self.spades_version = 'SPAdes-' + os.environ['SPADES_VERSION']
 
@@ -116,6 +158,7 @@ class SPAdesUtils:
                 'type': reads_type,  # ('interleaved', 'paired', or 'single')
                 'seq_tech': sequencing_tech,
                 'reads_ref': KBase object ref for downstream convenience,
+                'reads_upa': the ws/obj/ver reference the reads_ref resolved to,
                 'reads_name': KBase object name for downstream convenience,
                 'rev_file': path_to_fastq_file,  # only if paired end
         }
@@ -132,34 +175,32 @@ class SPAdesUtils:
         reads_params = []
 
         reftoname = {}
+        reftoupa = {}
         for wsi, oid in zip(ws_info, obj_ids):
             ref = oid['ref']
             reads_params.append(ref)
             obj_name = wsi[1]
             reftoname[ref] = wsi[7] + '/' + obj_name
-
-        typeerr = ('Supported types: KBaseFile.SingleEndLibrary ' +
-                   'KBaseFile.PairedEndLibrary ' +
-                   'KBaseAssembly.SingleEndLibrary ' +
-                   'KBaseAssembly.PairedEndLibrary')
-        try:
-            reads = self.ru.download_reads({
-                        'read_libraries': reads_params,
-                        'interleaved': 'false'
-                        })['files']
-        except ServerError as se:
-            log('logging stacktrace from dynamic client error')
-            log(se.data)
-            if typeerr in se.message:
-                prefix = se.message.split('.')[0]
-                raise ValueError(
-                    prefix + '. Only the types ' +
-                    'KBaseAssembly.SingleEndLibrary ' +
-                    'KBaseAssembly.PairedEndLibrary ' +
-                    'KBaseFile.SingleEndLibrary ' +
-                    'and KBaseFile.PairedEndLibrary are supported')
+            reftoupa[ref] = '{}/{}/{}'.format(wsi[6], wsi[0], wsi[4])
+
+        # reuse libraries already downloaded by an earlier job on this node
+        reads = {}
+        to_download = []
+        for ref in reads_params:
+            cached = self.reads_cache.get(reftoupa[ref], READS_DOWNLOAD_OPTIONS)
+            if cached:
+                reads[ref] = cached
             else:
-                raise
+                to_download.append(ref)
+
+        # download the libraries one per call so they transfer in parallel
+        if to_download:
+            workers = max(1, min(self.max_download_workers, len(to_download)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for ref, files in zip(to_download,
+                                      executor.map(self._download_reads, to_download)):
+                    reads[ref] = self.reads_cache.put(reftoupa[ref],
+                                                      READS_DOWNLOAD_OPTIONS, files[ref])
 
         # log('Downloaded reads data from KBase:\n' + pformat(reads))
         reads_data = []
@@ -170,6 +211,7 @@ class SPAdesUtils:
             rds_info = {
                 'fwd_file': f['fwd'],
                 'reads_ref': ref,
+                'reads_upa': reftoupa[ref],
                 'type': f['type'],
                 'seq_tech': seq_tech,
                 'reads_name': reads_name
@@ -180,83 +222,106 @@ class SPAdesUtils:
 
         return reads_data
 
+    def _download_reads(self, reads_ref):
+        """
+        _download_reads: download a single KBase reads library with ReadsUtils
+        """
+        typeerr = ('Supported types: KBaseFile.SingleEndLibrary ' +
+                   'KBaseFile.PairedEndLibrary ' +
+                   'KBaseAssembly.SingleEndLibrary ' +
+                   'KBaseAssembly.PairedEndLibrary')
+        try:
+            download_params = {'read_libraries': [reads_ref]}
+            download_params.update(READS_DOWNLOAD_OPTIONS)
+            return self.ru.download_reads(download_params)['files']
+        except ServerError as se:
+            log('logging stacktrace from dynamic client error')
+            log(se.data)
+            if typeerr in se.message:
+                prefix = se.message.split('.')[0]
+                raise ValueError(
+                    prefix + '. Only the types ' +
+                    'KBaseAssembly.SingleEndLibrary ' +
+                    'KBaseAssembly.PairedEndLibrary ' +
+                    'KBaseFile.SingleEndLibrary ' +
+                    'and KBaseFile.PairedEndLibrary are supported')
+            else:
+                raise
+
     def _generate_output_file_list(self, out_dir):
         """
-        _generate_output_file_list: zip result files and generate file_links for report
+        _generate_output_file_list: zip result files and generate file_links for report.
+        With stream-output-zip the zip is uploaded to Shock while it is packed and never
+        written to scratch; if that fails it is written to scratch for KBaseReport to upload.
+        returns a tuple of the file_links, the packing statistics of zip_files and the
+        manifest of the files archived and left out
         """
         log('start packing result files')
 
         output_files = list()
 
-        output_directory = os.path.join(self.proj_dir, str(uuid.uuid4()))
-        _mkdir_p(output_directory)
-        spades_output = os.path.join(output_directory, 'spades_output.zip')
-        self._zip_folder(out_dir, spades_output)
-
-        output_files.append({'path': spades_output,
-                             'name': os.path.basename(spades_output),
-                             'label': os.path.basename(spades_output),
-                             'description': 'Output file(s) generated by {}'.format(
-                                 self.spades_version)})
-
-        return output_files
+        manifest = build_manifest(out_dir, self.output_categories, self.output_include,
+                                  self.output_exclude, self.output_max_file_bytes,
+                                  self.output_max_total_bytes, (FASTA_INDEX_SUFFIX,))
+        output_file = {'name': 'spades_output.zip',
+                       'label': 'spades_output.zip',
+                       'description': 'Output file(s) generated by {}'.format(
+                           self.spades_version)}
+        zip_stats = None
+        if self.stream_output_zip:
+            try:
+                zip_stats = self._stream_zip_to_shock(manifest, output_file)
+            except Exception as e:
+                log('Streaming the output zip to Shock failed, writing it to scratch '
+                    'instead: {}'.format(e))
+        if zip_stats is None:
+            output_directory = os.path.join(self.proj_dir, str(uuid.uuid4()))
+            _mkdir_p(output_directory)
+            spades_output = os.path.join(output_directory, output_file['name'])
+            zip_stats = self._zip_folder(manifest, spades_output)
+            output_file['path'] = spades_output
+
+        output_files.append(output_file)
+
+        return output_files, zip_stats, manifest
+
+    def _zip_entries(self, manifest):
+        """
+        _zip_entries: the (file path, archive name) entries of the files in a manifest, with
+        the folder that holds each file included in its archive name
+        """
+        entries = []
+        for absolute_path, _ in manifest['files']:
+            root = os.path.dirname(absolute_path)
+            relative_path = os.path.join(os.path.basename(root),
+                                         os.path.basename(absolute_path))
+            entries.append((absolute_path, relative_path))
+        return entries
+
+    def _zip_folder(self, manifest, output_path):
+        """
+        _zip_folder: Zip the files of a manifest at zip-compression-level, reading zip-workers
+        files ahead. Already compressed files are stored without recompressing them.
+        returns the packing statistics of zip_files
+        """
+        zip_stats = zip_files(self._zip_entries(manifest), output_path,
+                              self.zip_compression_level, self.zip_workers)
+        print("{} created successfully.".format(output_path))
+        return zip_stats
 
-    def _zip_folder(self, folder_path, output_path):
+    def _stream_zip_to_shock(self, manifest, output_file):
         """
-        _zip_folder: Zip the contents of an entire folder (with that folder included
-        in the archive). Empty subfolders could be included in the archive as well
-        if the commented portion is used.
+        _stream_zip_to_shock: upload the zip of the files of a manifest to Shock as it is
+        packed, setting the 'shock_id' of the output_file link
+        returns the packing statistics of zip_files
         """
-        with zipfile.ZipFile(output_path, 'w',
-                             zipfile.ZIP_DEFLATED,
-                             allowZip64=True) as ziph:
-            for root, folders, files in os.walk(folder_path):
-                for f in files:
-                    absolute_path = os.path.join(root, f)
-                    relative_path = os.path.join(os.path.basename(root), f)
-                    # print "Adding {} to archive.".format(absolute_path)
-                    ziph.write(absolute_path, relative_path)
+        def upload(chunks):
+            return stream_to_shock(self.shock_url, self.token, output_file['name'], chunks)
 
-        print("{} created successfully.".format(output_path))
-        # with zipfile.ZipFile(output_path, "r") as f:
-        #    print 'Checking the zipped file......\n'
-        #    for info in f.infolist():
-        #        print info.filename, info.date_time, info.file_size, info.compress_size
-
-    def _load_stats(self, input_file_name):
-        log('Starting conversion of FASTA to KBaseGenomeAnnotations.Assembly')
-        log('Building Object.')
-        if not os.path.isfile(input_file_name):
-            raise Exception('The input file name {0} is not a file!'.format(input_file_name))
-        with open(input_file_name, 'r') as input_file_handle:
-            contig_id = None
-            sequence_len = 0
-            fasta_dict = dict()
-            first_header_found = False
-            # Pattern for replacing white space
-            pattern = re.compile(r'\s+')
-            for current_line in input_file_handle:
-                if (current_line[0] == '>'):
-                    # found a header line
-                    # Wrap up previous fasta sequence
-                    if not first_header_found:
-                        first_header_found = True
-                    else:
-                        fasta_dict[contig_id] = sequence_len
-                        sequence_len = 0
-                    fasta_header = current_line.replace('>', '').strip()
-                    try:
-                        contig_id = fasta_header.strip().split(' ', 1)[0]
-                    except (IndexError, ValueError, KeyError):
-                        contig_id = fasta_header.strip()
-                else:
-                    sequence_len += len(re.sub(pattern, '', current_line))
-        # wrap up last fasta sequence
-        if not first_header_found:
-            raise Exception("There are no contigs in this file")
-        else:
-            fasta_dict[contig_id] = sequence_len
-        return fasta_dict
+        node, zip_stats = stream_zip_files(self._zip_entries(manifest), upload,
+                                           self.zip_compression_level, self.zip_workers)
+        output_file['shock_id'] = node['id']
+        return zip_stats
 
     def _parse_single_reads(self, reads_type, reads_list):
         """
@@ -335,10 +400,15 @@ class SPAdesUtils:
                 raise ValueError('{} must be of type int.'.format(self.PARAM_IN_MIN_CONTIG_LENGTH))
 
         if not params.get(self.PARAM_IN_KMER_SIZES, None):
-            params[self.PARAM_IN_KMER_SIZES] = [21, 33, 55]
-        kmer_sstr = ",".join(str(num) for num in params[self.PARAM_IN_KMER_SIZES])
-        params[self.PARAM_IN_KMER_SIZES] = kmer_sstr
-        print("KMER_SIZES: " + kmer_sstr)
+            if self.auto_kmer_sizes:
+                # picked by run_assemble from the read lengths once the reads are downloaded
+                params[self.PARAM_IN_KMER_SIZES] = None
+            else:
+                params[self.PARAM_IN_KMER_SIZES] = DEFAULT_KMER_SIZES
+        if params[self.PARAM_IN_KMER_SIZES]:
+            kmer_sstr = ",".join(str(num) for num in params[self.PARAM_IN_KMER_SIZES])
+            params[self.PARAM_IN_KMER_SIZES] = kmer_sstr
+        print("KMER_SIZES: " + (params[self.PARAM_IN_KMER_SIZES] or 'auto'))
 
         if params.get(self.PARAM_IN_SKIP_ERR_CORRECT, None):
             print("SKIP ERR CORRECTION: " + str(params[self.PARAM_IN_SKIP_ERR_CORRECT]))
@@ -399,36 +469,40 @@ class SPAdesUtils:
 
         return params
 
-    def generate_report(self, fa_file_name, params, out_dir, wsname):
+    def generate_report(self, fa_file_name, params, out_dir, wsname, filter_stats=None,
+                        extra_report='', steps=None):
         """
         Generating and saving report
         """
         log('Generating and saving report')
 
         fa_file_with_path = os.path.join(out_dir, fa_file_name)
-        fasta_stats = self._load_stats(fa_file_with_path)
-        lengths = [fasta_stats[contig_id] for contig_id in fasta_stats]
+        fasta_stats = load_fasta_stats(fa_file_with_path)
 
         assembly_ref = wsname + '/' + params[self.PARAM_IN_CS_NAME]
 
         report_text = ''
         report_text += 'SPAdes results saved to: ' + wsname + '/' + out_dir + '\n'
         report_text += 'Assembly saved to: ' + assembly_ref + '\n'
-        report_text += 'Assembled into ' + str(len(lengths)) + ' contigs.\n'
-        report_text += 'Avg Length: ' + str(sum(lengths) / float(len(lengths))) + ' bp.\n'
-
-        # compute a simple contig length distribution
-        bins = 10
-        counts, edges = np.histogram(lengths, bins)
-        report_text += 'Contig Length Distribution (# of contigs -- min to max ' + 'basepairs):\n'
-        for c in range(bins):
-            report_text += ('   ' + str(counts[c]) + '\t--\t' + str(edges[c]) + ' to ' +
-                            str(edges[c + 1]) + ' bp\n')
-        print('Running QUAST')
-        quastret = self.kbq.run_QUAST(
-            {'files': [{'path': fa_file_with_path, 'label': params[self.PARAM_IN_CS_NAME]}]})
+        if filter_stats:
+            report_text += fasta_filter_report(filter_stats)
+        report_text += fasta_stats_report(fasta_stats)
+        report_text += extra_report
 
-        output_files = self._generate_output_file_list(out_dir)
+        print('Running QUAST')
+        if steps is None:
+            steps = []
+        with timed_step(steps, 'QUAST'):
+            quastret = self.kbq.run_QUAST(
+                {'files': [{'path': fa_file_with_path, 'label': params[self.PARAM_IN_CS_NAME]}]})
+
+        with timed_step(steps, 'Zip output files'):
+            output_files, zip_stats, manifest = self._generate_output_file_list(out_dir)
+        report_text += zip_report(zip_stats)
+        report_text += manifest_report(manifest)
+        report_text += steps_report(steps)
+        report_text += connection_report(session_pool_stats())
+        report_text += job_wait_report(job_wait_stats())
 
         print('Saving report')
         report_output = self.kbr.create_extended_report(
@@ -459,6 +533,7 @@ class SPAdesUtils:
                 'type': reads_type, # 'interleaved', 'paired', or 'single'
                 'seq_tech': sequencing_tech,
                 'reads_ref': KBase object ref for downstream convenience,
+                'reads_upa': the ws/obj/ver reference the reads_ref resolved to,
                 'reads_name': KBase object name for downstream convenience,
                 'rev_file': path_to_fastq_file  # only if paired end
         }
@@ -470,6 +545,7 @@ class SPAdesUtils:
                 'type': reads_type, # 'interleaved', 'paired', or 'single'
                 'seq_tech': sequencing_tech,
                 'reads_ref': KBase object ref for downstream convenience,
+                'reads_upa': the ws/obj/ver reference the reads_ref resolved to,
                 'reads_name': KBase object name for downstream convenience
         }
         """
@@ -496,7 +572,21 @@ class SPAdesUtils:
         for rds_lib in rds_libs:
             if rds_lib.get('lib_ref', None):
                 rds_refs.append(rds_lib['lib_ref'])
-        kb_rds_data = self._get_kbreads_info(wsname, rds_refs)
+
+        # a list of PacBio (CCS or CLR), Oxford Nanopore Sanger reads
+        # and/or additional contigs
+        long_rds_refs = []
+        long_rds_libs = rds_params.get(self.PARAM_IN_LONG_READS, None) or []
+        for lrds_lib in long_rds_libs:
+            if lrds_lib.get('long_reads_ref', None):
+                long_rds_refs.append(lrds_lib['long_reads_ref'])
+
+        # fetch the short and the long reads at the same time
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            kb_rds_future = executor.submit(self._get_kbreads_info, wsname, rds_refs)
+            kb_lrds_future = executor.submit(self._get_kbreads_info, wsname, long_rds_refs)
+            kb_rds_data = kb_rds_future.result()
+            kb_lrds_data = kb_lrds_future.result()
 
         for rds_lib in rds_libs:
             for kb_d in kb_rds_data:
@@ -517,38 +607,28 @@ class SPAdesUtils:
                         kb_d['lib_type'] = 'mate-pairs'
                         mp_rds_data.append(kb_d)
 
-        # a list of PacBio (CCS or CLR), Oxford Nanopore Sanger reads
-        # and/or additional contigs
-        long_rds_refs = []
-        if rds_params.get(self.PARAM_IN_LONG_READS, None):
-            long_rds_libs = rds_params[self.PARAM_IN_LONG_READS]
-            for lrds_lib in long_rds_libs:
-                if lrds_lib.get('long_reads_ref', None):
-                    long_rds_refs.append(lrds_lib['long_reads_ref'])
-            kb_lrds_data = self._get_kbreads_info(wsname, long_rds_refs)
-
-            for lrds_lib in long_rds_libs:
-                for kb_ld in kb_lrds_data:
-                    if ('long_reads_ref' in lrds_lib and
-                            lrds_lib['long_reads_ref'] == kb_ld['reads_ref']):
-                        if lrds_lib['long_reads_type'] == 'pacbio_ccs':
-                            kb_ld['long_reads_type'] = lrds_lib['long_reads_type']
-                            pb_ccs_data.append(kb_ld)
-                        elif lrds_lib['long_reads_type'] == 'pacbio_clr':
-                            kb_ld['long_reads_type'] = lrds_lib['long_reads_type']
-                            pb_clr_data.append(kb_ld)
-                        elif lrds_lib['long_reads_type'] == 'nanopore':
-                            kb_ld['long_reads_type'] = lrds_lib['long_reads_type']
-                            np_rds_data.append(kb_ld)
-                        elif lrds_lib['long_reads_type'] == 'sanger':
-                            kb_ld['long_reads_type'] = lrds_lib['long_reads_type']
-                            sgr_rds_data.append(kb_ld)
-                        elif lrds_lib['long_reads_type'] == 'trusted-contigs':
-                            kb_ld['long_reads_type'] = lrds_lib['long_reads_type']
-                            tr_ctg_data.append(kb_ld)
-                        elif lrds_lib['long_reads_type'] == 'untrusted-contigs':
-                            kb_ld['long_reads_type'] = lrds_lib['long_reads_type']
-                            ut_ctg_data.append(kb_ld)
+        for lrds_lib in long_rds_libs:
+            for kb_ld in kb_lrds_data:
+                if ('long_reads_ref' in lrds_lib and
+                        lrds_lib['long_reads_ref'] == kb_ld['reads_ref']):
+                    if lrds_lib['long_reads_type'] == 'pacbio_ccs':
+                        kb_ld['long_reads_type'] = lrds_lib['long_reads_type']
+                        pb_ccs_data.append(kb_ld)
+                    elif lrds_lib['long_reads_type'] == 'pacbio_clr':
+                        kb_ld['long_reads_type'] = lrds_lib['long_reads_type']
+                        pb_clr_data.append(kb_ld)
+                    elif lrds_lib['long_reads_type'] == 'nanopore':
+                        kb_ld['long_reads_type'] = lrds_lib['long_reads_type']
+                        np_rds_data.append(kb_ld)
+                    elif lrds_lib['long_reads_type'] == 'sanger':
+                        kb_ld['long_reads_type'] = lrds_lib['long_reads_type']
+                        sgr_rds_data.append(kb_ld)
+                    elif lrds_lib['long_reads_type'] == 'trusted-contigs':
+                        kb_ld['long_reads_type'] = lrds_lib['long_reads_type']
+                        tr_ctg_data.append(kb_ld)
+                    elif lrds_lib['long_reads_type'] == 'untrusted-contigs':
+                        kb_ld['long_reads_type'] = lrds_lib['long_reads_type']
+                        ut_ctg_data.append(kb_ld)
 
         return (sgl_rds_data, pe_rds_data, mp_rds_data, pb_ccs_data, pb_clr_data, np_rds_data,
                 sgr_rds_data, tr_ctg_data, ut_ctg_data)
@@ -723,10 +803,98 @@ class SPAdesUtils:
         else:
             return yaml_file_path
 
+    def _load_dataset(self, yaml_file):
+        with open(yaml_file) as yf:
+            return json.load(yf)
+
+    def _dataset_files(self, input_data_set):
+        """
+        _dataset_files: list the reads and contigs files of a SPAdes dataset
+        """
+        files = []
+        for lib in input_data_set:
+            for key, value in lib.items():
+                if isinstance(value, list):
+                    files += value
+        return files
+
+    def _fastq_files(self, input_data_set):
+        """
+        _fastq_files: list the reads files of a SPAdes dataset as (path, long_reads) tuples;
+        the de Bruijn graph k-mers are taken from the short reads, contigs are left out
+        """
+        files = []
+        for lib in input_data_set:
+            if lib.get('type') in CONTIG_TYPES:
+                continue
+            for key, value in lib.items():
+                if isinstance(value, list):
+                    files += [(path, is_long_read(lib)) for path in value]
+        return files
+
+    def _phred_offset(self, input_data_set):
+        """
+        _phred_offset: the phred offset spades.py will detect for the reads it error corrects,
+        '33' or '64', sniffed from a sample of their FASTQ files; None when the sample cannot
+        tell or the files disagree
+        """
+        offsets = set()
+        for lib in input_data_set:
+            if lib.get('type') not in CorrectedReadsCache.CORRECTED_TYPES:
+                continue
+            for key, value in lib.items():
+                if isinstance(value, list):
+                    offsets.update(sniff_phred_type(fastq_path)[0] for fastq_path in value)
+        return offsets.pop() if len(offsets) == 1 and None not in offsets else None
+
+    def _has_checkpoint(self, assemble_out_dir):
+        """
+        _has_checkpoint: whether spades.py saved pipeline checkpoints in assemble_out_dir
+        """
+        state_dir = os.path.join(assemble_out_dir, self.SPADES_PIPELINE_STATE_DIR)
+        return os.path.isdir(state_dir) and bool(os.listdir(state_dir))
+
+    def resume_key(self, params, hybrid_reads_info):
+        """
+        resume_key: a digest of everything that determines the result of a HybridSPAdes job,
+        the input library versions, their types and orientations and the assembly parameters,
+        so a retry of the same job finds the project dir of the earlier attempt
+        """
+        libs = []
+        for rds_data in hybrid_reads_info:
+            for rds in rds_data:
+                libs.append([rds['reads_upa'], rds.get('lib_type') or rds.get('long_reads_type'),
+                             rds.get('orientation')])
+        key_src = json.dumps({
+            'libs': sorted(libs),
+            'kmer_sizes': params.get(self.PARAM_IN_KMER_SIZES),
+            'dna_source': params.get(self.PARAM_IN_DNA_SOURCE),
+            'pipeline_options': sorted(
+                opt for opt in params.get(self.PARAM_IN_PIPELINE_OPTION) or []
+                if opt != self.PARAM_IN_CONTINUE),
+            'spades_version': self.spades_version}, sort_keys=True)
+        return hashlib.sha256(key_src.encode()).hexdigest()
+
+    def corrected_reads_libs(self, hybrid_reads_info):
+        """
+        corrected_reads_libs: the corrected reads cache key of the libraries SPAdes error
+        corrects (Illumina/IonTorrent single, paired-end and mate-pairs reads, PacBio CCS
+        reads), or None if there are none
+        """
+        (sgl_rds, pe_rds, mp_rds, pb_ccs, pb_clr, np_rds, sgr_rds, tr_ctgs, ut_ctgs) = \
+            hybrid_reads_info
+        libs = sorted([rds['reads_upa'], rds.get('lib_type') or rds.get('long_reads_type'),
+                       rds.get('orientation'), rds['seq_tech']]
+                      for rds in sgl_rds + pe_rds + mp_rds + pb_ccs)
+        return libs or None
+
     def run_assemble(self, yaml_file, kmer_sizes, dna_source=None,
-                     basic_opts=None, pipeline_opts=['careful']):
+                     basic_opts=None, pipeline_opts=['careful'], corrected_reads_libs=None):
         """
         run_assemble: run the SPAdes assemble with given input parameters/options
+        With corrected_reads_libs (see corrected_reads_libs) the error corrected reads of an
+        earlier run on the same libraries are reused when cached, and the corrected reads of
+        this run are cached otherwise.
         """
         exit_code = 1
         if not os.path.isfile(yaml_file):
@@ -736,33 +904,23 @@ class SPAdesUtils:
         log("The input data set yaml file exists at {}\n".format(yaml_file))
         yf_dir, yf_nm = os.path.split(yaml_file)
 
-        mem = (psutil.virtual_memory().available / self.GB - self.MEMORY_OFFSET_GB)
-        if mem < self.MIN_MEMORY_GB:
-            raise ValueError(
-                'Only ' + str(psutil.virtual_memory().available) +
-                ' bytes of memory are available. The SPAdes wrapper will' +
-                ' not run without at least ' +
-                str(self.MIN_MEMORY_GB + self.MEMORY_OFFSET_GB) +
-                ' gigabytes available')
-
-        if dna_source and dna_source == self.PARAM_IN_METAGENOME:
-            max_mem = self.MAX_MEMORY_GB_META_SPADES
-            max_threads = self.MAX_THREADS_META
-        else:
-            max_mem = self.MAX_MEMORY_GB_SPADES
-            max_threads = self.MAX_THREADS
+        input_data_set = self._load_dataset(yaml_file)
+        plan = plan_resources(dna_source, input_size(self._dataset_files(input_data_set)))
 
-        threads = min(max_threads, psutil.cpu_count() * self.THREADS_PER_CORE)
-
-        if mem > max_mem:
-            mem = max_mem
+        pipeline_opts = pipeline_opts or []
+        kmer_sizes = plan_kmer_sizes(
+            self._fastq_files(input_data_set), kmer_sizes, plan['memory_gb'], dna_source,
+            auto=self.auto_kmer_sizes, preflight=self.memory_preflight,
+            error_correction=self.PARAM_IN_ONLY_ASSEMBLER not in pipeline_opts,
+            assembly=self.PARAM_IN_ONLY_ERROR_CORR not in pipeline_opts,
+            reference=DEFAULT_KMER_SIZES)
 
         tmpdir = os.path.join(self.proj_dir, 'spades_tmp_dir')
         if not os.path.exists(tmpdir):
             os.makedirs(tmpdir)
 
         a_cmd = [os.path.join(self.SPADES_BIN, 'spades.py')]
-        a_cmd += ['--threads', str(threads), '--memory', str(int(mem))]
+        a_cmd += ['--threads', str(plan['threads']), '--memory', str(plan['memory_gb'])]
         a_cmd += ['--tmp-dir', tmpdir]
         a_cmd += ['--dataset', yaml_file]
 
@@ -782,8 +940,6 @@ class SPAdesUtils:
                     a_cmd += ['--only-error-correction']
                 if p_opt == self.PARAM_IN_ONLY_ASSEMBLER:
                     a_cmd += ['--only-assembler']
-                if p_opt == self.PARAM_IN_CONTINUE:
-                    a_cmd += ['--continue']
                 if p_opt == self.PARAM_IN_DISABLE_GZIP:
                     a_cmd += ['--disable-gzip-output']
 
@@ -798,34 +954,93 @@ class SPAdesUtils:
             except ValueError:
                 pass
 
-        log("**************The HybridSPAdes assembling command is:\n{}".format(' '.join(a_cmd)))
         assemble_out_dir = os.path.join(self.proj_dir, self.ASSEMBLE_RESULTS_DIR)
+
+        cache_corrected_reads = (corrected_reads_libs is not None and
+                                 self.PARAM_IN_ONLY_ASSEMBLER not in pipeline_opts and
+                                 self.PARAM_IN_ONLY_ERROR_CORR not in pipeline_opts)
+        if cache_corrected_reads:
+            # spades.py detects the phred offset itself, the reads corrected with one offset
+            # must not be reused for the same libraries read with the other
+            corrected_options = {'phred_offset': self._phred_offset(input_data_set),
+                                 'dna_source': dna_source,
+                                 'spades_version': self.spades_version}
+            if corrected_options['phred_offset'] is None:
+                log('Could not tell the phred offset of the reads, not caching their error '
+                    'corrected reads')
+                cache_corrected_reads = False
+        if cache_corrected_reads:
+            corrected_yaml = self.corrected_reads_cache.get_corrected(corrected_reads_libs,
+                                                                      corrected_options)
+            if corrected_yaml:
+                log('Reusing cached error corrected reads, running only the assembler')
+                corrected_data_set = merge_corrected_dataset(
+                    corrected_yaml, input_data_set,
+                    os.path.join(self.proj_dir, 'corrected_input_data_set.yaml'))
+                a_cmd[a_cmd.index('--dataset') + 1] = corrected_data_set
+                a_cmd += ['--only-assembler']
+                cache_corrected_reads = False
+
+        # 'continue' resumes from the SPAdes checkpoints of an earlier attempt of the same job
+        # (see SPAdesAssembler.run_hybrid_spades); spades.py --continue refuses any other
+        # option, while --restart-from only refuses changes to the input data and pipeline
+        if self.PARAM_IN_CONTINUE in pipeline_opts and self._has_checkpoint(assemble_out_dir):
+            log('Found SPAdes checkpoints in {}, restarting from the last one'.format(
+                assemble_out_dir))
+            a_cmd = [os.path.join(self.SPADES_BIN, 'spades.py'),
+                     '--restart-from', 'last',
+                     '-o', assemble_out_dir,
+                     '--threads', str(plan['threads']), '--memory', str(plan['memory_gb']),
+                     '--tmp-dir', tmpdir]
+
+        log("**************The HybridSPAdes assembling command is:\n{}".format(' '.join(a_cmd)))
         if not os.path.exists(assemble_out_dir):
             os.makedirs(assemble_out_dir)
 
-        p = subprocess.Popen(a_cmd, cwd=yf_dir, shell=False)
-        exit_code = p.wait()
+        with self.node_scheduler.reserve('spades.py -o ' + assemble_out_dir, plan['threads'],
+                                         plan['memory_gb']):
+            supervisor = run_spades(a_cmd, cwd=yf_dir,
+                                    stages_path=os.path.join(self.proj_dir, STAGES_FILE),
+                                    profile_interval=self.profile_interval,
+                                    scratch_dirs=[assemble_out_dir, tmpdir],
+                                    scratch_policy=self.cancel_scratch_policy)
+        exit_code = supervisor.process.returncode
         log('Return code: ' + str(exit_code))
 
-        if p.returncode != 0:
-            raise ValueError('Error running spades.py, return code: ' + str(p.returncode) + '\n')
-        else:
-            exit_code = p.returncode
+        if exit_code != 0:
+            raise ValueError('Error running spades.py, return code: ' + str(exit_code) + '\n' +
+                             '\n'.join(supervisor.errors))
+
+        corrected_dir = os.path.join(assemble_out_dir, 'corrected')
+        if (cache_corrected_reads and
+                os.path.isfile(os.path.join(corrected_dir, CorrectedReadsCache.DATASET))):
+            self.corrected_reads_cache.put_corrected(corrected_reads_libs, corrected_options,
+                                                     corrected_dir)
         return exit_code
 
     def save_assembly(self, fa_file_path, wsname, a_name, min_ctg_length=0):
         """
         save_assembly: save the assembly to KBase workspace
+        When min_ctg_length > 0 the contigs are filtered locally first and only the filtered
+        FASTA file is uploaded; the returned dict then also carries the 'filtered_input' path
+        and the 'filter_stats' of fasta_utils.filter_fasta_by_length.
         """
         if os.path.isfile(fa_file_path):
-            log('Uploading FASTA file to Assembly...')
             if min_ctg_length > 0:
-                return self.au.save_assembly_from_fasta2(
-                            {'file': {'path': fa_file_path},
+                filter_stats = filter_fasta_by_length(fa_file_path, min_ctg_length)
+                if filter_stats['kept_contigs'] == 0:
+                    raise ValueError('No contigs of length >= {} bp were assembled.'.format(
+                        min_ctg_length))
+                log('Uploading filtered FASTA file to Assembly...')
+                ret = self.au.save_assembly_from_fasta2(
+                            {'file': {'path': filter_stats['filtered_input']},
                              'workspace_name': wsname,
-                             'assembly_name': a_name,
-                             'min_contig_length': min_ctg_length})
+                             'assembly_name': a_name})
+                ret['filtered_input'] = filter_stats['filtered_input']
+                ret['filter_stats'] = filter_stats
+                return ret
             else:
+                log('Uploading FASTA file to Assembly...')
                 return self.au.save_assembly_from_fasta2(
                             {'file': {'path': fa_file_path},
                              'workspace_name': wsname,
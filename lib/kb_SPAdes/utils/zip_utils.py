@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+import os
+import queue
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+ZIP_COMPRESSION_LEVEL = 6  # zlib's default
+ZIP_CHUNK_SIZE = 4 * 1024 * 1024  # bytes handed at a time to the consumer of a stream
+# files that are already compressed gain nothing from deflate and are stored as they are
+STORED_EXTENSIONS = ('.gz', '.bz2', '.xz', '.zip', '.zst', '.bam', '.png', '.jpg')
+MB = 1000000
+STREAM_QUEUE_CHUNKS = 4  # chunks of a streamed archive waiting for the consumer
+
+
+def log(message, prefix_newline=False):
+    """Logging function, provides a hook to suppress or redirect log messages."""
+    print(('\n' if prefix_newline else '') + '{0:.2f}'.format(time.time()) + ': ' + str(message))
+
+
+def _read_ahead(file_path):
+    """
+    _read_ahead: have the kernel read a file into the page cache in the background, so it is
+    read from disk while the files before it are compressed
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        fd = os.open(file_path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def zip_files(entries, output, level=ZIP_COMPRESSION_LEVEL, workers=1):
+    """
+    zip_files: write a zip archive of entries, a list of (file_path, arcname) tuples, to
+    output, a file path or a writable file object that need not be seekable, deflating them
+    at the given zlib level (0-9); files that are already compressed are stored. The entries
+    are written in order with ZipFile.write, which picks zip64 from the file sizes; the next
+    workers files are read ahead from disk while one is compressed.
+    returns a dict of packing statistics: 'files', 'stored_files', 'bytes_in', 'bytes_out' and
+    'seconds'
+    """
+    start = time.time()
+    stats = {'files': 0, 'stored_files': 0, 'bytes_in': 0, 'bytes_out': 0}
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as ziph, \
+            ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        pending = deque()
+        entries = iter(entries)
+        while True:
+            for file_path, arcname in entries:
+                pending.append((file_path, arcname))
+                executor.submit(_read_ahead, file_path)
+                if len(pending) > max(1, workers):
+                    break
+            if not pending:
+                break
+            file_path, arcname = pending.popleft()
+            stored = file_path.lower().endswith(STORED_EXTENSIONS)
+            ziph.write(file_path, arcname,
+                       zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED, level)
+            zinfo = ziph.infolist()[-1]
+            stats['files'] += 1
+            stats['stored_files'] += stored
+            stats['bytes_in'] += zinfo.file_size
+            stats['bytes_out'] += zinfo.compress_size
+    stats['seconds'] = time.time() - start
+    log('Packed {files} files ({stored_files} stored), {mb_in:.1f} MB into {mb_out:.1f} MB '
+        'in {seconds:.1f} s, {rate:.1f} MB/s'.format(
+            mb_in=stats['bytes_in'] / float(MB), mb_out=stats['bytes_out'] / float(MB),
+            rate=stats['bytes_in'] / float(MB) / max(stats['seconds'], 0.001), **stats))
+    return stats
+
+
+class _ChunkQueueWriter(object):
+    """
+    A write-only file object handing what is written to it to another thread in chunks of
+    ZIP_CHUNK_SIZE through a bounded queue, so the writer waits while the reader falls behind.
+    It has no tell(), so ZipFile counts the offsets itself.
+    """
+
+    def __init__(self, chunks, aborted):
+        self.chunks = chunks
+        self.aborted = aborted
+        self.buffer = bytearray()
+
+    def _put(self, item):
+        while True:
+            if self.aborted.is_set():
+                raise IOError('The consumer of the zip stream stopped reading')
+            try:
+                self.chunks.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def write(self, data):
+        self.buffer.extend(data)
+        while len(self.buffer) >= ZIP_CHUNK_SIZE:
+            self._put(bytes(self.buffer[:ZIP_CHUNK_SIZE]))
+            del self.buffer[:ZIP_CHUNK_SIZE]
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            self._put(bytes(self.buffer))
+            self.buffer = bytearray()
+
+
+def stream_zip_files(entries, consume, level=ZIP_COMPRESSION_LEVEL, workers=1):
+    """
+    stream_zip_files: zip entries like zip_files without writing the archive to disk. The
+    archive is built on a separate thread and handed to consume, a function taking an
+    iterator of bytes chunks (an upload, say), as it is written; compression and consume run
+    side by side, and at most STREAM_QUEUE_CHUNKS chunks wait in memory.
+    returns a tuple of the return value of consume and the packing statistics of zip_files
+    """
+    chunks = queue.Queue(maxsize=STREAM_QUEUE_CHUNKS)
+    aborted = threading.Event()
+    result = {}
+
+    def produce():
+        writer = _ChunkQueueWriter(chunks, aborted)
+        try:
+            result['stats'] = zip_files(entries, writer, level, workers)
+            writer.flush()
+        except Exception as e:
+            result['error'] = e
+        finally:
+            try:
+                writer._put(None)
+            except IOError:
+                pass
+
+    def read_chunks():
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                break
+            yield chunk
+        if 'error' in result:
+            raise result['error']
+
+    producer = threading.Thread(target=produce)
+    producer.daemon = True
+    producer.start()
+    try:
+        consumed = consume(read_chunks())
+    finally:
+        aborted.set()
+        producer.join()
+    if 'error' in result:
+        raise result['error']
+    return consumed, result['stats']
+
+
+def zip_report(stats):
+    """
+    zip_report: report text of the packing statistics of zip_files
+    """
+    return ('Output files packed: {} files ({} stored as already compressed), '
+            '{:.1f} MB into {:.1f} MB in {:.1f} s ({:.1f} MB/s)\n').format(
+                stats['files'], stats['stored_files'], stats['bytes_in'] / float(MB),
+                stats['bytes_out'] / float(MB), stats['seconds'],
+                stats['bytes_in'] / float(MB) / max(stats['seconds'], 0.001))
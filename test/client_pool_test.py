@@ -0,0 +1,124 @@
+import unittest
+import os
+import time
+import json
+from os import environ
+from configparser import ConfigParser
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import requests
+from installed_clients.KBaseReportClient import KBaseReport
+from kb_SPAdes.utils import client_pool
+
+
+class MockShockServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MockJSONRPCHandler(BaseHTTPRequestHandler):
+    """
+    A keep-alive JSON-RPC 1.1 service whose methods return their first parameter. Jobs
+    submitted with run_job finish after the number of seconds of their first parameter.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        rpc = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        result = [rpc['params'][0]]
+        if rpc['method'].endswith('_submit'):
+            result = [json.dumps([time.time(), rpc['params'][0]])]
+        elif rpc['method'].endswith('._check_job'):
+            submitted, duration = json.loads(rpc['params'][0])
+            finished = time.time() - submitted >= duration
+            result = [{'finished': int(finished), 'result': [duration] if finished else None}]
+        out = json.dumps({'version': '1.1', 'id': rpc['id'], 'result': result}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+
+class client_poolTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.token = environ.get('KB_AUTH_TOKEN')
+        config_file = environ.get('KB_DEPLOYMENT_CONFIG', None)
+        cls.cfg = {}
+        config = ConfigParser()
+        config.read(config_file)
+        for nameval in config.items('kb_SPAdes'):
+            cls.cfg[nameval[0]] = nameval[1]
+        cls.scratch = cls.cfg['scratch']
+        if not os.path.exists(cls.scratch):
+            os.makedirs(cls.scratch)
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_baseclient_session_reuse")
+    def test_baseclient_session_reuse(self):
+        #
+        # test_baseclient_session_reuse: clients share kept-alive connections
+        #
+        server = MockShockServer(('127.0.0.1', 0), MockJSONRPCHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = 'http://127.0.0.1:{}'.format(server.server_port)
+        try:
+            before = client_pool.session_pool_stats()
+            for i in range(3):
+                client = client_pool.pooled(KBaseReport(url, token=self.token))
+                self.assertIsInstance(client._client, client_pool.PooledBaseClient)
+                self.assertEqual(client._client.call_method('Mock.echo', [i]), i)
+            after = client_pool.session_pool_stats()
+            self.assertEqual(after['requests'] - before['requests'], 3)
+            self.assertEqual(after['connections_opened'] - before['connections_opened'], 1)
+            self.assertEqual(after['connections_reused'] - before['connections_reused'], 2)
+            # the generated clients are left as they are
+            self.assertNotIsInstance(KBaseReport(url, token=self.token)._client,
+                                     client_pool.PooledBaseClient)
+            # a session given to the client is used instead of the shared one
+            session = requests.Session()
+            client = client_pool.PooledBaseClient(url, session=session, token=self.token)
+            self.assertEqual(client.call_method('Mock.echo', [3]), 3)
+            self.assertEqual(client_pool.session_pool_stats()['requests'], after['requests'])
+            session.close()
+        finally:
+            server.shutdown()
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_baseclient_job_checks")
+    def test_baseclient_job_checks(self):
+        #
+        # test_baseclient_job_checks: job checks keep the time lost to waiting small
+        #
+        server = MockShockServer(('127.0.0.1', 0), MockJSONRPCHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = 'http://127.0.0.1:{}'.format(server.server_port)
+        try:
+            client = client_pool.PooledBaseClient(url, token=self.token)
+            client.async_job_check_ratio = 0.1
+            wait = client_pool.job_check_wait
+            self.assertEqual(wait(client, 0, None, 5), 0.1)
+            self.assertEqual(wait(client, 100, None, 5), 10)
+            self.assertEqual(wait(client, 10, 60, 5), 6)
+            self.assertEqual(wait(client, 58, 60, 5), 2)
+            self.assertEqual(wait(client, 1e5, None, 5), 300)
+            legacy = client_pool.PooledBaseClient(url, token=self.token)
+            legacy.async_job_check_ratio = 0
+            self.assertEqual(wait(legacy, 100, 60, 5), 5)
+
+            before = client_pool.job_wait_stats()
+            for _ in range(2):
+                self.assertEqual(client.run_job('Mock.sleep', [1.5]), 1.5)
+            after = client_pool.job_wait_stats()
+            self.assertEqual(after['jobs'] - before['jobs'], 2)
+            lost = after['lost_seconds_bound'] - before['lost_seconds_bound']
+            # the second job is checked at the expected duration instead of after it
+            self.assertLess(lost, 2 * 0.1 * 2)
+            self.assertGreater(after['checks'] - before['checks'], 2)
+        finally:
+            server.shutdown()
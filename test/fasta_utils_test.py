@@ -0,0 +1,77 @@
+import unittest
+import os
+from os import environ
+from configparser import ConfigParser
+from kb_SPAdes.utils import fasta_utils
+
+
+class fasta_utilsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.token = environ.get('KB_AUTH_TOKEN')
+        config_file = environ.get('KB_DEPLOYMENT_CONFIG', None)
+        cls.cfg = {}
+        config = ConfigParser()
+        config.read(config_file)
+        for nameval in config.items('kb_SPAdes'):
+            cls.cfg[nameval[0]] = nameval[1]
+        cls.scratch = cls.cfg['scratch']
+        if not os.path.exists(cls.scratch):
+            os.makedirs(cls.scratch)
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_fasta_utils_load_fasta_stats")
+    def test_fasta_utils_load_fasta_stats(self):
+        #
+        # test_fasta_utils_load_fasta_stats: contig statistics from a small FASTA file,
+        # read with a block size small enough to split headers and sequences across blocks
+        #
+        fa_file = os.path.join(self.scratch, 'stats_test.fasta')
+        with open(fa_file, 'w') as fa:
+            fa.write('>NODE_1_length_10 cov_2.5\nACGTACGTNN\n')
+            fa.write('>NODE_2_length_25\nGGGGGCCCCC\nAAAAATTTTT\nACGTA\n')
+            fa.write('>NODE_3_length_5\nacgta\n')
+
+        records = list(fasta_utils._scan_fasta(fa_file, block_size=7))
+        self.assertEqual([r[0] for r in records], ['NODE_1_length_10', 'NODE_2_length_25',
+                                                   'NODE_3_length_5'])
+        self.assertEqual([r[3] for r in records], [10, 25, 5])
+        with open(fa_file, 'rb') as fa:
+            content = fa.read()
+        for r in records:
+            self.assertTrue(content[r[1]:r[2]].startswith(b'>' + r[0].encode()))
+        self.assertEqual(records[-1][2], len(content))
+
+        stats = fasta_utils.load_fasta_stats(fa_file)
+        self.assertEqual(stats['contig_count'], 3)
+        self.assertEqual(stats['total_length'], 40)
+        self.assertEqual(stats['n50'], 25)
+        self.assertEqual(stats['l50'], 1)
+        self.assertEqual(stats['n_count'], 2)
+        self.assertEqual(sum(stats['histogram'][0]), 3)
+        self.assertIn('Assembled into 3 contigs.', fasta_utils.fasta_stats_report(stats))
+
+        # the index sidecar is reused until the FASTA file changes
+        idx_file = fasta_utils.fasta_index_path(fa_file)
+        self.assertTrue(os.path.isfile(idx_file))
+        idx_mtime = os.stat(idx_file).st_mtime_ns
+        self.assertEqual(list(fasta_utils.load_fasta_index(fa_file)['length']), [10, 25, 5])
+        self.assertEqual(os.stat(idx_file).st_mtime_ns, idx_mtime)
+        with open(fa_file, 'a') as fa:
+            fa.write('>NODE_4_length_3\nACG\n')
+        self.assertEqual(len(fasta_utils.load_fasta_index(fa_file)), 4)
+
+        # contigs shorter than the cutoff are dropped and counted
+        filter_stats = fasta_utils.filter_fasta_by_length(fa_file, 10)
+        self.assertEqual(filter_stats['kept_contigs'], 2)
+        self.assertEqual(filter_stats['kept_bases'], 35)
+        self.assertEqual(filter_stats['dropped_contigs'], 2)
+        self.assertEqual(filter_stats['dropped_bases'], 8)
+        filtered_ids = [r[0] for r in fasta_utils._scan_fasta(filter_stats['filtered_input'])]
+        self.assertEqual(filtered_ids, ['NODE_1_length_10', 'NODE_2_length_25'])
+
+        empty_file = os.path.join(self.scratch, 'stats_empty.fasta')
+        open(empty_file, 'w').close()
+        with self.assertRaisesRegex(Exception, 'There are no contigs in this file'):
+            fasta_utils.load_fasta_stats(empty_file)
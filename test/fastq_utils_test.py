@@ -0,0 +1,48 @@
+import unittest
+import os
+from os import environ
+from configparser import ConfigParser
+from kb_SPAdes.utils import fastq_utils
+
+
+class fastq_utilsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.token = environ.get('KB_AUTH_TOKEN')
+        config_file = environ.get('KB_DEPLOYMENT_CONFIG', None)
+        cls.cfg = {}
+        config = ConfigParser()
+        config.read(config_file)
+        for nameval in config.items('kb_SPAdes'):
+            cls.cfg[nameval[0]] = nameval[1]
+        cls.scratch = cls.cfg['scratch']
+        if not os.path.exists(cls.scratch):
+            os.makedirs(cls.scratch)
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_fastq_utils_sniff_phred_type")
+    def test_fastq_utils_sniff_phred_type(self):
+        #
+        # test_fastq_utils_sniff_phred_type: phred offsets decided from sampled quality strings
+        #
+        self.assertEqual(fastq_utils.sniff_phred_type('data/small.forward.fq')[0], '33')
+        self.assertEqual(fastq_utils.sniff_phred_type('data/pl1.fq.gz')[0], '33')
+        self.assertEqual(fastq_utils.sniff_phred_type('data/interleaved64.fq')[0], '64')
+
+        ambiguous_fq = os.path.join(self.scratch, 'phred_ambiguous.fq')
+        with open(ambiguous_fq, 'w') as fq:
+            for i in range(10):
+                fq.write('@read{}\nACGT\n+\nIIII\n'.format(i))
+        self.assertEqual(fastq_utils.sniff_phred_type(ambiguous_fq), (None, 0.0))
+
+        # Q>41 with offset 33 ('K' is Q42) is not taken for offset 64 unless no quality is
+        # below '@', a minimum of '<' is left to the ea-utils check
+        high_q33_fq = os.path.join(self.scratch, 'phred_high_q33.fq')
+        with open(high_q33_fq, 'w') as fq:
+            for i in range(10):
+                fq.write('@read{}\nACGTA\n+\n<FKKK\n'.format(i))
+        self.assertEqual(fastq_utils.sniff_phred_type(high_q33_fq), (None, 0.0))
+        with open(high_q33_fq, 'a') as fq:
+            fq.write('@read10\nACGTA\n+\n#FKKK\n')
+        self.assertEqual(fastq_utils.sniff_phred_type(high_q33_fq)[0], '33')
@@ -2,6 +2,7 @@ from __future__ import print_function
 import unittest
 import os
 import time
+import fcntl
 import json
 
 from os import environ
@@ -11,6 +12,7 @@ from pprint import pprint
 import shutil
 import gzip
 import inspect
+import uuid
 import requests
 
 from installed_clients.AbstractHandleClient import AbstractHandle as HandleService
@@ -488,6 +490,8 @@ class hybrid_SPAdesTest(unittest.TestCase):
         self.assertEqual(params['pipeline_options'], ['careful'])
         self.assertEqual(params['dna_source'], 'single_cell')
         self.assertEqual(params['output_contigset_name'], 'single_end_out')
+        # the documented default, unless hybrid-auto-kmer-sizes is set
+        self.assertEqual(params['kmer_sizes'], '21,33,55')
 
     # Uncomment to skip this test
     # @unittest.skip("skipped test_spades_utils_get_hybrid_reads_info")
@@ -1017,3 +1021,81 @@ class hybrid_SPAdesTest(unittest.TestCase):
         ret = self.spades_assembler.run_hybrid_spades(params7)
         if params6.get('create_report', 0) == 1:
             self.assertReportAssembly(ret, output_name)
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_spades_utils_resume_key")
+    def test_spades_utils_resume_key(self):
+        #
+        # test_spades_utils_resume_key: retries of a job map to the same project dir
+        #
+        params = {'kmer_sizes': '21,33,55', 'dna_source': None,
+                  'pipeline_options': ['careful', 'continue']}
+        reads_info = ([], [{'reads_upa': '1/2/3', 'lib_type': 'paired-end',
+                            'orientation': 'fr', 'fwd_file': 'a.fq'}], [],
+                      [], [{'reads_upa': '1/5/1', 'long_reads_type': 'pacbio_clr',
+                            'fwd_file': 'b.fq'}], [], [], [], [])
+        key = self.spades_utils.resume_key(params, reads_info)
+        self.assertEqual(key, self.spades_utils.resume_key(
+            {'kmer_sizes': '21,33,55', 'dna_source': None, 'pipeline_options': ['careful']},
+            reads_info))
+        reads_info[1][0]['reads_upa'] = '1/2/4'
+        self.assertNotEqual(key, self.spades_utils.resume_key(params, reads_info))
+
+        out_dir = os.path.join(self.scratch, 'resume_test_out')
+        self.assertFalse(self.spades_utils._has_checkpoint(out_dir))
+        os.makedirs(os.path.join(out_dir, 'pipeline_state'), exist_ok=True)
+        open(os.path.join(out_dir, 'pipeline_state', 'stage_0_before_start'), 'w').close()
+        self.assertTrue(self.spades_utils._has_checkpoint(out_dir))
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_spades_assembler_resumable_proj_dirs")
+    def test_spades_assembler_resumable_proj_dirs(self):
+        #
+        # test_spades_assembler_resumable_proj_dirs: finished and stale resumable dirs go away
+        #
+        resume_dir = os.path.join(self.scratch, 'resumable_test_' + str(uuid.uuid4()))
+        cfg = dict(self.cfg, **{'resumable-jobs-dir': resume_dir,
+                                'resumable-jobs-max-age-days': '1'})
+        assembler = SPAdesAssembler(cfg, self.ctx.provenance)
+        stale = os.path.join(resume_dir, 'stale')
+        running = os.path.join(resume_dir, 'running')
+        recent = os.path.join(resume_dir, 'recent')
+        for prjdir in (stale, running, recent):
+            os.makedirs(prjdir)
+            open(os.path.join(prjdir, assembler.RESUME_LOCK_FILE), 'w').close()
+        two_days_ago = time.time() - 2 * 24 * 3600
+        for prjdir in (stale, running):
+            os.utime(os.path.join(prjdir, assembler.RESUME_LOCK_FILE),
+                     (two_days_ago, two_days_ago))
+        with open(os.path.join(running, assembler.RESUME_LOCK_FILE)) as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            assembler._use_resumable_proj_dir('job')
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.isdir(running))
+        self.assertTrue(os.path.isdir(recent))
+        self.assertEqual(assembler.proj_dir, os.path.join(resume_dir, 'job'))
+
+        assembler._remove_resumable_proj_dir()
+        self.assertFalse(os.path.exists(os.path.join(resume_dir, 'job')))
+        self.assertIsNone(assembler._resume_lock)
+        # a job not run as resumable keeps its project dir
+        assembler.proj_dir = recent
+        assembler._remove_resumable_proj_dir()
+        self.assertTrue(os.path.isdir(recent))
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_spades_utils_phred_offset")
+    def test_spades_utils_phred_offset(self):
+        #
+        # test_spades_utils_phred_offset: the corrected reads cache key gets the phred offset
+        #
+        pacbio = {'type': 'pacbio', 'single reads': ['data/interleaved64.fq']}
+        self.assertEqual(self.spades_utils._phred_offset(
+            [{'type': 'paired-end', 'left reads': ['data/small.forward.fq'],
+              'right reads': ['data/small.reverse.fq']}, pacbio]), '33')
+        self.assertEqual(self.spades_utils._phred_offset(
+            [{'type': 'paired-end', 'interlaced reads': ['data/interleaved64.fq']}]), '64')
+        # reads of both offsets leave the offset undecided
+        self.assertIsNone(self.spades_utils._phred_offset(
+            [{'type': 'single', 'single reads': ['data/pl1.fq.gz']},
+             {'type': 'paired-end', 'interlaced reads': ['data/interleaved64.fq']}]))
@@ -12,6 +12,12 @@ import requests
 import shutil
 import gzip
 import inspect
+import io
+import json
+import threading
+import uuid
+import yaml
+from unittest import mock
 
 from installed_clients.AbstractHandleClient import AbstractHandle as HandleService
 from installed_clients.WorkspaceClient import Workspace as workspaceService
@@ -19,7 +25,9 @@ from installed_clients.baseclient import ServerError
 from installed_clients.ReadsUtilsClient import ReadsUtils
 
 from kb_SPAdes.kb_SPAdesImpl import kb_SPAdes
-from kb_SPAdes.kb_SPAdesServer import MethodContext
+from kb_SPAdes.kb_SPAdesServer import MethodContext, application
+from kb_SPAdes.utils import job_queue
+from kb_SPAdes.utils import kmer_selector
 
 
 # Set up for tests
@@ -483,6 +491,248 @@ class kb_SPAdesTest(unittest.TestCase):
                        'types KBaseAssembly.PairedEndLibrary and ' +
                        'KBaseFile.PairedEndLibrary are supported')
 
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_spades_sweep")
+    def test_spades_sweep(self):
+        #
+        # test_spades_sweep: sweep parameter checks, one assembly per DNA source and k-mer size
+        # set on reads corrected once per DNA source, and the assembly with the best N50 saved
+        # with a report of all of them (spades.py itself is mocked)
+        #
+        impl = self.getImpl()
+        base = {'workspace_name': self.getWsName(), 'read_libraries': ['reads'],
+                'output_contigset_name': 'sweep_out'}
+        for bad, error in (({}, 'kmer_size_sets must be a non-empty list'),
+                           ({'kmer_size_sets': [21, 33]}, 'must be a non-empty list'),
+                           ({'kmer_size_sets': [[]]}, 'must be a non-empty list'),
+                           ({'kmer_size_sets': [[21, 34]]}, 'must be odd integers'),
+                           ({'kmer_size_sets': [[21, 129]]}, 'less than 128'),
+                           ({'kmer_size_sets': [[33, 21]]}, 'ascending order'),
+                           ({'kmer_size_sets': [[21]], 'dna_sources': ['rna']},
+                            'Invalid DNA source'),
+                           ({'kmer_size_sets': [[21]], 'max_concurrent_variants': -1},
+                            'must be a positive integer')):
+            with self.assertRaisesRegex(ValueError, error):
+                impl.process_sweep_params(dict(base, **bad))
+
+        reads_data = [{'fwd_file': 'data/small.forward.fq', 'rev_file': 'data/small.reverse.fq',
+                       'reads_ref': 'ws/reads', 'reads_upa': '1/{}/1'.format(uuid.uuid4().int),
+                       'type': 'paired', 'seq_tech': 'Illumina', 'reads_name': 'ws/reads'}]
+        calls = []
+        lock = threading.Lock()
+
+        def exec_spades(dna_source, reads_data, phred_type, kmer_sizes, skip_error_correction,
+                        outdir=None, dataset_yaml=None, extra_opts=None, concurrent_runs=1):
+            with lock:
+                calls.append({'dna_source': dna_source, 'phred_type': phred_type,
+                              'kmer_sizes': kmer_sizes, 'dataset_yaml': dataset_yaml,
+                              'extra_opts': extra_opts, 'concurrent_runs': concurrent_runs})
+            os.makedirs(outdir, exist_ok=True)
+            if extra_opts and '--only-error-correction' in extra_opts:
+                corrected_dir = os.path.join(outdir, 'corrected')
+                os.makedirs(corrected_dir)
+                left = os.path.join(corrected_dir, 'left.cor.fastq')
+                right = os.path.join(corrected_dir, 'right.cor.fastq')
+                shutil.copy('data/small.forward.fq', left)
+                shutil.copy('data/small.reverse.fq', right)
+                with open(os.path.join(corrected_dir, 'corrected.yaml'), 'w') as yml_file:
+                    yaml.safe_dump([{'type': 'paired-end', 'orientation': 'fr',
+                                     'left reads': [left], 'right reads': [right]}], yml_file)
+                return outdir
+            if dna_source == 'plasmid' and kmer_sizes == '21,33,55':
+                raise ValueError('Error running SPAdes, return code: 1')
+            # larger k-mer sizes give longer contigs here, N50 100 bp per k-mer size
+            contig_length = 100 * len(kmer_sizes.split(',')) + (dna_source == 'plasmid')
+            with open(os.path.join(outdir, 'scaffolds.fasta'), 'w') as fasta:
+                for i in range(3):
+                    fasta.write('>contig{}\n{}\n'.format(i, 'A' * contig_length))
+            return outdir
+
+        params = dict(base, kmer_size_sets=[[21], [21, 33], [21, 33, 55]],
+                      dna_sources=[None, 'plasmid'], max_concurrent_variants=2)
+        saved = {}
+
+        def save_assembly(ctx, params, output_contigs, extra_report='', steps=None):
+            saved.update({'contigs': output_contigs, 'report': extra_report})
+            return 'report_name', 'report_ref'
+
+        with mock.patch.object(impl, 'exec_spades', side_effect=exec_spades), \
+                mock.patch.object(impl, 'get_reads_data', return_value=(reads_data, '33')), \
+                mock.patch.object(impl, 'save_assembly', side_effect=save_assembly):
+            output = impl.run_SPAdes_sweep(self.ctx, params)[0]
+        self.assertEqual(output, {'report_name': 'report_name', 'report_ref': 'report_ref'})
+
+        # the reads are error corrected once per DNA source, then every variant is assembled
+        # from the corrected reads without their phred offset
+        corrections = [c for c in calls if c['extra_opts']]
+        self.assertEqual([c['dna_source'] for c in corrections], [None, 'plasmid'])
+        assemblies = [c for c in calls if not c['extra_opts']]
+        self.assertEqual(sorted((str(c['dna_source']), c['kmer_sizes']) for c in assemblies),
+                         [('None', '21'), ('None', '21,33'), ('None', '21,33,55'),
+                          ('plasmid', '21'), ('plasmid', '21,33'), ('plasmid', '21,33,55')])
+        for call in assemblies:
+            self.assertIsNone(call['phred_type'])
+            self.assertTrue(os.path.isfile(call['dataset_yaml']))
+            self.assertEqual(call['concurrent_runs'], 2)
+
+        # the failed plasmid assembly with k up to 55 leaves the None one the best
+        self.assertEqual(os.path.basename(os.path.dirname(saved['contigs'])),
+                         'assembly_None_21_33_55')
+        report = saved['report']
+        self.assertIn('Parameter sweep results (6 assemblies, * = saved):', report)
+        self.assertIn('*  None\t21,33,55\t3\t300\t900\n', report)
+        self.assertIn('   plasmid\t21,33\t3\t201\t603\n', report)
+        self.assertIn('   plasmid\t21,33,55\tfailed: Error running SPAdes, return code: 1',
+                      report)
+
+        # a sweep whose assemblies all fail saves nothing
+        params = dict(base, kmer_size_sets=[[21, 33, 55]], dna_sources=['plasmid'],
+                      skip_error_correction=1)
+        with mock.patch.object(impl, 'exec_spades', side_effect=exec_spades), \
+                mock.patch.object(impl, 'get_reads_data', return_value=(reads_data, '33')):
+            with self.assertRaisesRegex(ValueError, 'All SPAdes sweep assemblies failed'):
+                impl.run_SPAdes_sweep(self.ctx, params)
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_server_batch_requests")
+    def test_server_batch_requests(self):
+        #
+        # test_server_batch_requests: a batch is answered entry by entry in one response
+        #
+        def call(body):
+            body = json.dumps(body).encode()
+            environ = {'REQUEST_METHOD': 'POST', 'CONTENT_LENGTH': str(len(body)),
+                       'wsgi.input': io.BytesIO(body), 'REMOTE_ADDR': '127.0.0.1'}
+            started = {}
+
+            def start_response(status, headers):
+                started['status'] = status
+            response = b''.join(application(environ, start_response))
+            return started['status'], json.loads(response) if response else None
+
+        status, responses = call([
+            {'method': 'kb_SPAdes.status', 'params': [], 'version': '1.1', 'id': '1'},
+            {'method': 'kb_SPAdes.no_such_method', 'params': [], 'version': '1.1', 'id': '2'},
+            {'params': [], 'version': '1.1', 'id': '3'},
+            {'method': 'kb_SPAdes.status', 'params': [], 'version': '1.1'}])
+        self.assertEqual(status, '200 OK')
+        self.assertEqual([r['id'] for r in responses], ['1', '2', '3'])
+        self.assertEqual(responses[0]['result'][0]['state'], 'OK')
+        self.assertEqual(responses[1]['error']['code'], -32601)
+        self.assertEqual(responses[2]['error']['code'], -32600)
+
+        status, responses = call([])
+        self.assertEqual(responses['error']['code'], -32600)
+        status, response = call({'method': 'kb_SPAdes.status', 'params': [],
+                                 'version': '1.1', 'id': '4'})
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(response['id'], '4')
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_job_queue")
+    def test_job_queue(self):
+        #
+        # test_job_queue: jobs start when their reservation fits, can be canceled and
+        # report their result or error
+        #
+        queue_dir = os.path.join(self.scratch, 'job_queue_test')
+        shutil.rmtree(queue_dir, ignore_errors=True)
+        queue = job_queue.JobQueue(queue_dir, job_threads=4, job_memory_gb=8, max_queued=2,
+                                   capacity={'threads': 8, 'memory_gb': 16})
+        # nothing is written before the first job
+        self.assertFalse(os.path.exists(queue_dir))
+        release = threading.Event()
+
+        def wait(ctx, value):
+            release.wait(10)
+            return [value]
+
+        def fail(ctx, value):
+            raise ValueError('bad ' + value)
+
+        ctx = {'user_id': 'someone'}
+        first = queue.submit(ctx, 'test.wait', wait, ['a'])
+        second = queue.submit(ctx, 'test.wait', wait, ['b'])
+        time.sleep(0.5)
+        third = queue.submit(ctx, 'test.wait', wait, ['c'])
+        fourth = queue.submit(ctx, 'test.fail', fail, ['d'])
+        with self.assertRaisesRegex(ValueError, 'queue is full'):
+            queue.submit(ctx, 'test.wait', wait, ['e'])
+        # two jobs fill the 8 threads, the others wait in order
+        self.assertEqual(queue.check(first)['job_state'], job_queue.RUNNING)
+        self.assertEqual(queue.check(second)['job_state'], job_queue.RUNNING)
+        self.assertEqual(queue.check(third)['position'], 1)
+        self.assertEqual(queue.check(fourth)['position'], 2)
+        with self.assertRaisesRegex(ValueError, 'No such job'):
+            queue.check(first, 'someone_else')
+
+        self.assertEqual(queue.cancel(third, 'someone')['finished'], 0)
+        queue.cancel(second, 'someone')
+        release.set()
+        for _ in range(50):
+            if queue.check(fourth)['finished']:
+                break
+            time.sleep(0.2)
+        self.assertEqual(queue.check(first)['result'], ['a'])
+        self.assertEqual(queue.check(first)['finished'], 1)
+        self.assertEqual(queue.check(second)['job_state'], job_queue.CANCELED)
+        self.assertIsNone(queue.check(second)['result'])
+        self.assertEqual(queue.check(third)['job_state'], job_queue.CANCELED)
+        self.assertIsNone(queue.check(third)['exec_start_time'])
+        error = queue.check(fourth)['error']
+        self.assertEqual(error['name'], 'ValueError')
+        self.assertEqual(error['message'], 'bad d')
+
+        # a job of a server process that ended before it finished is reported lost
+        with open(os.path.join(queue_dir, fourth + '.json')) as job_file:
+            lost = json.load(job_file)
+        lost.update(job_id=str(uuid.uuid4()), job_state=job_queue.RUNNING, error=None,
+                    process_start_time=lost['process_start_time'] - 1)
+        with open(os.path.join(queue_dir, lost['job_id'] + '.json'), 'w') as job_file:
+            json.dump(lost, job_file)
+        state = queue.check(lost['job_id'])
+        self.assertEqual(state['finished'], 1)
+        self.assertEqual(state['job_state'], job_queue.ERROR)
+        self.assertEqual(state['error']['name'], job_queue.LOST_ERROR)
+        lost.update(job_id=str(uuid.uuid4()), host='another-host')
+        with open(os.path.join(queue_dir, lost['job_id'] + '.json'), 'w') as job_file:
+            json.dump(lost, job_file)
+        self.assertEqual(queue.check(lost['job_id'])['finished'], 0)
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_exec_spades_kmer_sizes")
+    def test_exec_spades_kmer_sizes(self):
+        #
+        # test_exec_spades_kmer_sizes: k-mer sizes are picked from the short reads only, and not
+        # at all for an error correction only run (spades.py itself is mocked)
+        #
+        impl = self.getImpl()
+        short_fq = os.path.join(self.scratch, 'exec_kmer_short.fq')
+        long_fq = os.path.join(self.scratch, 'exec_kmer_nanopore.fq')
+        for fq_path, length in ((short_fq, 250), (long_fq, 5000)):
+            with open(fq_path, 'w') as fq:
+                for i in range(100):
+                    fq.write('@read{}\n{}\n+\n{}\n'.format(i, 'A' * length, 'I' * length))
+        reads_data = [{'fwd_file': short_fq, 'type': 'single', 'seq_tech': 'Illumina'},
+                      {'fwd_file': long_fq, 'type': 'single', 'seq_tech': 'NanoPore'},
+                      {'fwd_file': long_fq, 'type': 'single', 'seq_tech': 'PacBio CLR'}]
+        supervisor = mock.Mock(errors=[])
+        supervisor.process.returncode = 0
+        outdir = os.path.join(self.scratch, 'exec_kmer_out')
+        with mock.patch('kb_SPAdes.kb_SPAdesImpl.run_spades',
+                        return_value=supervisor) as run_spades, \
+                mock.patch('kb_SPAdes.utils.kmer_selector.select_kmer_sizes',
+                           wraps=kmer_selector.select_kmer_sizes) as select_kmer_sizes:
+            impl.exec_spades(None, reads_data, '33', None, 0, outdir=outdir)
+            select_kmer_sizes.assert_called_once_with([short_fq], None, reference=None)
+            self.assertIn('-k 21,33,55,77', run_spades.call_args[0][0])
+
+            impl.exec_spades(None, reads_data, '33', None, 0, outdir=outdir,
+                             extra_opts=['--only-error-correction'])
+            self.assertEqual(select_kmer_sizes.call_count, 1)
+            self.assertFalse([arg for arg in run_spades.call_args[0][0]
+                              if arg.startswith('-k ')])
+
 # TESTS removed since can't upload bad reads anymore using ReadsUtil.upload_reads()
 #    def test_bad_shock_filename(self):
 #
@@ -0,0 +1,82 @@
+import unittest
+import os
+from os import environ
+from configparser import ConfigParser
+from kb_SPAdes.utils import kmer_selector
+
+
+class kmer_selectorTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.token = environ.get('KB_AUTH_TOKEN')
+        config_file = environ.get('KB_DEPLOYMENT_CONFIG', None)
+        cls.cfg = {}
+        config = ConfigParser()
+        config.read(config_file)
+        for nameval in config.items('kb_SPAdes'):
+            cls.cfg[nameval[0]] = nameval[1]
+        cls.scratch = cls.cfg['scratch']
+        if not os.path.exists(cls.scratch):
+            os.makedirs(cls.scratch)
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_kmer_selector")
+    def test_kmer_selector(self):
+        #
+        # test_kmer_selector: k-mer sizes picked from the sampled read lengths per DNA source
+        #
+        def write_fastq(name, lengths):
+            fq_path = os.path.join(self.scratch, name)
+            with open(fq_path, 'w') as fq:
+                for i, length in enumerate(lengths):
+                    fq.write('@read{}\n{}\n+\n{}\n'.format(i, 'A' * length, 'I' * length))
+            return fq_path
+
+        short_fq = write_fastq('kmer_100bp.fq', [100] * 900 + [35] * 100)
+        long_fq = write_fastq('kmer_250bp.fq', [250] * 1000)
+        tiny_fq = write_fastq('kmer_36bp.fq', [36] * 1000)
+
+        distribution = kmer_selector.read_length_distribution([short_fq])
+        self.assertEqual(distribution['reads'], 1000)
+        self.assertEqual(distribution['median'], 100)
+        self.assertEqual(distribution['min'], 35)
+        self.assertEqual(distribution['p10'], 100)
+
+        selected = kmer_selector.select_kmer_sizes([short_fq])
+        self.assertEqual(selected['kmer_sizes'], [21, 33, 55])
+        self.assertEqual(selected['reference'], [21, 33, 55])
+        self.assertEqual(selected['savings'], 0)
+
+        selected = kmer_selector.select_kmer_sizes([long_fq])
+        # the ladder allows k up to 127, trimmed to the run time of the spades.py defaults
+        self.assertEqual(selected['kmer_sizes'], [21, 33, 55, 77])
+        self.assertEqual(selected['reference'], [21, 33, 55, 77])
+        self.assertGreaterEqual(selected['savings'], 0)
+        selected = kmer_selector.select_kmer_sizes([long_fq], reference=[21, 33, 55])
+        self.assertEqual(selected['kmer_sizes'], [21, 33, 55])
+        self.assertGreaterEqual(selected['savings'], 0)
+        selected = kmer_selector.select_kmer_sizes([long_fq], 'metagenomic')
+        self.assertEqual(selected['kmer_sizes'], [21, 33, 55, 77])
+        selected = kmer_selector.select_kmer_sizes([long_fq], 'rna')
+        self.assertEqual(selected['kmer_sizes'], [83, 125])
+
+        # reads too short for the larger default k-mer sizes
+        selected = kmer_selector.select_kmer_sizes([tiny_fq])
+        self.assertEqual(selected['kmer_sizes'], [21])
+        self.assertGreater(selected['savings'], 0.5)
+
+        empty_fq = write_fastq('kmer_empty.fq', [])
+        with self.assertRaisesRegex(ValueError, 'No reads found'):
+            kmer_selector.select_kmer_sizes([empty_fq])
+
+        # the k-mer sizes of a run: picked from the short reads, then checked against memory
+        fastq_files = [(long_fq, False), (tiny_fq, True)]
+        self.assertEqual(kmer_selector.plan_kmer_sizes(fastq_files, None, 64), '21,33,55,77')
+        self.assertEqual(kmer_selector.plan_kmer_sizes(fastq_files, '21,33', 64), '21,33')
+        self.assertIsNone(kmer_selector.plan_kmer_sizes(fastq_files, None, 64, auto=False))
+        self.assertIsNone(kmer_selector.plan_kmer_sizes(fastq_files, None, 64, assembly=False))
+        self.assertEqual(kmer_selector.plan_kmer_sizes(
+            fastq_files, None, 64, reference=[21, 33, 55], preflight=False), '21,33,55')
+        with self.assertRaisesRegex(ValueError, 'SPAdes assembly is predicted to need'):
+            kmer_selector.plan_kmer_sizes(fastq_files, '21', 0)
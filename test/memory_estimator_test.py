@@ -0,0 +1,51 @@
+import unittest
+import os
+from os import environ
+from configparser import ConfigParser
+from kb_SPAdes.utils import fastq_utils
+from kb_SPAdes.utils import memory_estimator
+
+
+class memory_estimatorTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.token = environ.get('KB_AUTH_TOKEN')
+        config_file = environ.get('KB_DEPLOYMENT_CONFIG', None)
+        cls.cfg = {}
+        config = ConfigParser()
+        config.read(config_file)
+        for nameval in config.items('kb_SPAdes'):
+            cls.cfg[nameval[0]] = nameval[1]
+        cls.scratch = cls.cfg['scratch']
+        if not os.path.exists(cls.scratch):
+            os.makedirs(cls.scratch)
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_memory_estimator_preflight")
+    def test_memory_estimator_preflight(self):
+        #
+        # test_memory_estimator_preflight: k-mer downgrades and fail-fast on predicted memory
+        #
+        self.assertEqual(fastq_utils.estimate_fastq_size('data/pl1.fq.gz'), (2000, 200000))
+        self.assertEqual(memory_estimator.fastq_stats(
+            [('data/pl1.fq.gz', False), ('data/pl1.fq.gz', True)]), (2000, 200000, 200000))
+        self.assertTrue(memory_estimator.is_long_read({'type': 'nanopore'}))
+        self.assertTrue(memory_estimator.is_long_read({'type': 'single', 'seq_tech': 'PacBio CLR'}))
+        self.assertFalse(memory_estimator.is_long_read({'type': 'paired', 'seq_tech': 'Illumina'}))
+
+        # 10 Gbases of 100bp reads fit in 64 GB with the spades.py default k-mer sizes
+        self.assertIsNone(memory_estimator.preflight_memory_check(
+            64, 10 * memory_estimator.GB, 10 ** 8))
+        # but a metagenome with k up to 127 needs the largest k-mer sizes dropped
+        self.assertEqual(memory_estimator.preflight_memory_check(
+            64, 10 * memory_estimator.GB, 10 ** 8, [21, 33, 55, 77, 99, 127], 'metagenomic'),
+            [21, 33])
+        # error correction that does not fit only gets a warning, the assembly drops k-mer sizes
+        self.assertEqual(memory_estimator.preflight_memory_check(
+            16, 10 * memory_estimator.GB, 10 ** 8), [21])
+        self.assertIsNone(memory_estimator.preflight_memory_check(
+            16, 10 * memory_estimator.GB, 10 ** 8, assembly=False))
+        # and fails when even the smallest k-mer size does not fit
+        with self.assertRaisesRegex(ValueError, 'SPAdes assembly is predicted to need'):
+            memory_estimator.preflight_memory_check(8, 10 * memory_estimator.GB, 10 ** 8)
@@ -0,0 +1,111 @@
+import unittest
+import os
+import time
+import fcntl
+import json
+from os import environ
+from configparser import ConfigParser
+import shutil
+import threading
+import subprocess
+from kb_SPAdes.utils.node_scheduler import NodeScheduler
+
+
+class node_schedulerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.token = environ.get('KB_AUTH_TOKEN')
+        config_file = environ.get('KB_DEPLOYMENT_CONFIG', None)
+        cls.cfg = {}
+        config = ConfigParser()
+        config.read(config_file)
+        for nameval in config.items('kb_SPAdes'):
+            cls.cfg[nameval[0]] = nameval[1]
+        cls.scratch = cls.cfg['scratch']
+        if not os.path.exists(cls.scratch):
+            os.makedirs(cls.scratch)
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_node_scheduler")
+    def test_node_scheduler(self):
+        #
+        # test_node_scheduler: runs reserve threads and memory in a ledger shared by all the
+        # processes of the node and wait for their turn when they do not fit
+        #
+        state_dir = os.path.join(self.scratch, 'node_scheduler_test')
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+        def scheduler(timeout=0, lease=60):
+            return NodeScheduler(state_dir, capacity={'threads': 8, 'memory_gb': 100},
+                                 poll_interval=0.05, timeout=timeout, lease=lease)
+
+        first = scheduler().acquire('first', 6, 60)
+        granted = []
+
+        def acquire(owner, threads, memory_gb):
+            granted.append(scheduler().acquire(owner, threads, memory_gb)['owner'])
+        waiters = [threading.Thread(target=acquire, args=('second', 4, 30)),
+                   threading.Thread(target=acquire, args=('third', 2, 10))]
+        for waiter in waiters:
+            waiter.start()
+            time.sleep(0.3)
+        # the third run fits next to the first but waits for its turn behind the second
+        state = scheduler().reservations()
+        self.assertEqual([r['owner'] for r in state['reservations']], ['first'])
+        self.assertEqual([w['owner'] for w in state['waiting']], ['second', 'third'])
+        self.assertEqual(state['reserved'], {'threads': 6, 'memory_gb': 60})
+        with self.assertRaisesRegex(ValueError, 'Gave up waiting'):
+            scheduler(timeout=0.1).acquire('impatient', 1, 1)
+
+        scheduler().release(first)
+        for waiter in waiters:
+            waiter.join(5)
+        self.assertEqual(granted, ['second', 'third'])
+        state = scheduler().reservations()
+        self.assertEqual(state['reserved'], {'threads': 6, 'memory_gb': 40})
+        self.assertEqual(state['waiting'], [])
+
+        # reservations of processes that are gone are dropped
+        gone = subprocess.Popen(['true'])
+        gone.wait()
+        ledger_path = os.path.join(state_dir, 'reservations.json')
+        with open(ledger_path) as ledger_file:
+            ledger = json.load(ledger_file)
+        for reservation in ledger['reservations']:
+            reservation['pid'] = gone.pid
+        with open(ledger_path, 'w') as ledger_file:
+            json.dump(ledger, ledger_file)
+        with scheduler().reserve('whole node', 8, 100) as reservation:
+            self.assertLess(reservation['waited'], 1)
+            self.assertEqual(len(scheduler().reservations()['reservations']), 1)
+        self.assertEqual(scheduler().reservations()['reservations'], [])
+
+        # entries of other hosts last as long as they are renewed
+        with open(ledger_path) as ledger_file:
+            ledger = json.load(ledger_file)
+        for owner, renewed in (('stale', time.time() - 120), ('fresh', time.time())):
+            ledger['reservations'].append(
+                {'id': ledger['next_id'], 'owner': owner, 'pid': 1, 'host': 'another-node',
+                 'threads': 1, 'memory_gb': 1, 'since': renewed - 60, 'renewed': renewed})
+            ledger['next_id'] += 1
+        with open(ledger_path, 'w') as ledger_file:
+            json.dump(ledger, ledger_file)
+        self.assertEqual([r['owner'] for r in scheduler().reservations()['reservations']],
+                         ['fresh'])
+        # and the reservations of this process are renewed until they are released
+        with scheduler(lease=0.2).reserve('renewed', 1, 1) as reservation:
+            time.sleep(0.3)
+            held = scheduler().reservations()['reservations'][-1]
+            self.assertEqual(held['owner'], 'renewed')
+            self.assertGreater(held['renewed'], reservation['since'])
+        time.sleep(0.2)
+        self.assertNotIn('renewed', [r['owner'] for r in
+                                     scheduler().reservations()['reservations']])
+
+        # the state is read without waiting for the lock or writing the ledger back
+        modified = os.path.getmtime(ledger_path)
+        with open(os.path.join(state_dir, 'reservations.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self.assertIn('reserved', scheduler().reservations())
+        self.assertEqual(os.path.getmtime(ledger_path), modified)
@@ -0,0 +1,56 @@
+import unittest
+import os
+from os import environ
+from configparser import ConfigParser
+from kb_SPAdes.utils import output_manifest
+
+
+class output_manifestTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.token = environ.get('KB_AUTH_TOKEN')
+        config_file = environ.get('KB_DEPLOYMENT_CONFIG', None)
+        cls.cfg = {}
+        config = ConfigParser()
+        config.read(config_file)
+        for nameval in config.items('kb_SPAdes'):
+            cls.cfg[nameval[0]] = nameval[1]
+        cls.scratch = cls.cfg['scratch']
+        if not os.path.exists(cls.scratch):
+            os.makedirs(cls.scratch)
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_output_manifest")
+    def test_output_manifest(self):
+        #
+        # test_output_manifest: intermediates are left out of the output zip and reported
+        #
+        out_dir = os.path.join(self.scratch, 'manifest_test_out')
+        for rel_path, size in [('contigs.fasta', 1000), ('scaffolds.fasta', 1000),
+                               ('assembly_graph.fastg', 1000), ('spades.log', 100),
+                               ('params.txt', 100), ('K21/final_contigs.fasta', 1000),
+                               ('corrected/left.cor.fastq.gz', 5000), ('tmp/x', 100),
+                               ('contigs.fasta.kbidx', 10)]:
+            path = os.path.join(out_dir, rel_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as out_file:
+                out_file.write(b'A' * size)
+
+        manifest = output_manifest.build_manifest(out_dir, skip_suffixes=('.kbidx',))
+        self.assertEqual(sorted(rel for _, rel in manifest['files']),
+                         ['assembly_graph.fastg', 'contigs.fasta', 'params.txt',
+                          'scaffolds.fasta', 'spades.log'])
+        self.assertEqual(sorted(s['category'] for s in manifest['skipped']),
+                         ['corrected_reads', 'kmer_dirs', 'tmp'])
+
+        manifest = output_manifest.build_manifest(
+            out_dir, ['assembly', 'graphs'], include=['K21/*'], exclude=['scaffolds.*'],
+            max_total_bytes=2500, skip_suffixes=('.kbidx',))
+        self.assertEqual([rel for _, rel in manifest['files']],
+                         ['K21/final_contigs.fasta', 'contigs.fasta'])
+        reasons = {s['path']: s['reason'] for s in manifest['skipped']}
+        self.assertEqual(reasons['scaffolds.fasta'], 'excluded by pattern')
+        self.assertIn('total size cap', reasons['assembly_graph.fastg'])
+        report = output_manifest.manifest_report(manifest)
+        self.assertIn('corrected_reads: 1 files', report)
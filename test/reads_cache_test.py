@@ -0,0 +1,101 @@
+import unittest
+import os
+import json
+import yaml
+from os import environ
+from configparser import ConfigParser
+import shutil
+from kb_SPAdes.utils.reads_cache import (ReadsCache, CorrectedReadsCache,
+                                        merge_corrected_dataset)
+
+
+class reads_cacheTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.token = environ.get('KB_AUTH_TOKEN')
+        config_file = environ.get('KB_DEPLOYMENT_CONFIG', None)
+        cls.cfg = {}
+        config = ConfigParser()
+        config.read(config_file)
+        for nameval in config.items('kb_SPAdes'):
+            cls.cfg[nameval[0]] = nameval[1]
+        cls.scratch = cls.cfg['scratch']
+        if not os.path.exists(cls.scratch):
+            os.makedirs(cls.scratch)
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_corrected_reads_cache")
+    def test_corrected_reads_cache(self):
+        #
+        # test_corrected_reads_cache: corrected reads are cached and reused with long reads
+        #
+        corrected_dir = os.path.join(self.scratch, 'ec_test_out', 'corrected')
+        os.makedirs(corrected_dir, exist_ok=True)
+        left = os.path.join(corrected_dir, 'left.cor.fastq.gz')
+        right = os.path.join(corrected_dir, 'right.cor.fastq.gz')
+        for fq in (left, right):
+            with open(fq, 'w') as fq_file:
+                fq_file.write('@r\nACGT\n+\nIIII\n')
+        with open(os.path.join(corrected_dir, 'corrected.yaml'), 'w') as yml_file:
+            json.dump([{'type': 'paired-end', 'orientation': 'fr',
+                        'left reads': [left], 'right reads': [right]},
+                       {'type': 'pacbio', 'single reads': ['/old/pacbio.fq']}], yml_file)
+
+        cache = CorrectedReadsCache(os.path.join(self.scratch, 'ec_test_cache'), 10 ** 9)
+        libs = [['1/2/3', 'paired', 'Illumina']]
+        options = {'phred_offset': '33', 'dna_source': None}
+        self.assertIsNone(cache.get_corrected(libs, options))
+        cached_yaml = cache.put_corrected(libs, options, corrected_dir)
+        # the SPAdes output keeps its corrected reads
+        self.assertTrue(os.path.isfile(left))
+        self.assertTrue(os.path.isfile(os.path.join(corrected_dir, 'corrected.yaml')))
+        self.assertEqual(cache.get_corrected(libs, options), cached_yaml)
+        self.assertIsNone(cache.get_corrected(libs, {'phred_offset': '64', 'dna_source': None}))
+
+        dataset_path = merge_corrected_dataset(
+            cached_yaml, [{'type': 'paired-end', 'left reads': ['/new/left.fq']},
+                          {'type': 'pacbio', 'single reads': ['/new/pacbio.fq']}],
+            os.path.join(self.scratch, 'ec_test_dataset.yaml'))
+        with open(dataset_path) as yml_file:
+            dataset = yaml.safe_load(yml_file)
+        self.assertEqual([lib['type'] for lib in dataset], ['paired-end', 'pacbio'])
+        self.assertTrue(os.path.isfile(dataset[0]['left reads'][0]))
+        self.assertEqual(dataset[1]['single reads'], ['/new/pacbio.fq'])
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_reads_cache_pinning")
+    def test_reads_cache_pinning(self):
+        #
+        # test_reads_cache_pinning: entries in use by a job are not evicted by other jobs
+        #
+        cache_dir = os.path.join(self.scratch, 'pin_test_cache')
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        job_cache = ReadsCache(cache_dir, 150)
+        other_cache = ReadsCache(cache_dir, 150)
+
+        def download(upa):
+            fq = os.path.join(self.scratch, 'pin_test_' + upa.replace('/', '_') + '.fq')
+            with open(fq, 'w') as fq_file:
+                fq_file.write('@r\n' + 'A' * 46 + '\n+\n' + 'I' * 46 + '\n')
+            return {'files': {'fwd': fq, 'type': 'single'}, 'sequencing_tech': 'Illumina'}
+
+        with job_cache.pinned():
+            first = job_cache.put('1/1/1', {}, download('1/1/1'))
+            second = job_cache.put('1/2/1', {}, download('1/2/1'))
+            # the cache is over its size, yet the entries of this job stay
+            self.assertTrue(os.path.isfile(first['files']['fwd']))
+            # another job cannot evict them either
+            other_cache.put('1/3/1', {}, download('1/3/1'))
+            self.assertTrue(os.path.isfile(first['files']['fwd']))
+            self.assertTrue(os.path.isfile(second['files']['fwd']))
+            # nor replace them while they are read
+            again = other_cache.put('1/1/1', {}, download('1/1/1'))
+            self.assertEqual(again['files']['fwd'], first['files']['fwd'])
+        self.assertIsNone(job_cache._pins())
+
+        # unpinned, the least recently used entries go
+        other_cache.put('1/4/1', {}, download('1/4/1'))
+        self.assertFalse(os.path.isfile(second['files']['fwd']))
+        self.assertIsNone(other_cache.get('1/2/1', {}))
+        self.assertIsNotNone(other_cache.get('1/4/1', {}))
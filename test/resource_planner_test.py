@@ -0,0 +1,51 @@
+import unittest
+import os
+from os import environ
+from configparser import ConfigParser
+from kb_SPAdes.utils import resource_planner
+
+
+class resource_plannerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.token = environ.get('KB_AUTH_TOKEN')
+        config_file = environ.get('KB_DEPLOYMENT_CONFIG', None)
+        cls.cfg = {}
+        config = ConfigParser()
+        config.read(config_file)
+        for nameval in config.items('kb_SPAdes'):
+            cls.cfg[nameval[0]] = nameval[1]
+        cls.scratch = cls.cfg['scratch']
+        if not os.path.exists(cls.scratch):
+            os.makedirs(cls.scratch)
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_resource_planner_cgroup_limits")
+    def test_resource_planner_cgroup_limits(self):
+        #
+        # test_resource_planner_cgroup_limits: cgroup v1 and v2 CPU and memory limits
+        #
+        cg_v2 = os.path.join(self.scratch, 'cgroup_v2')
+        os.makedirs(cg_v2, exist_ok=True)
+        for name, value in [('cpu.max', '250000 100000'), ('memory.max', '8000000000'),
+                            ('memory.current', '3000000000')]:
+            with open(os.path.join(cg_v2, name), 'w') as cg_file:
+                cg_file.write(value + '\n')
+        self.assertEqual(resource_planner.cgroup_cpu_limit(cg_v2), 3)
+        self.assertEqual(resource_planner.cgroup_memory_available(cg_v2), 5000000000)
+
+        cg_v1 = os.path.join(self.scratch, 'cgroup_v1')
+        os.makedirs(os.path.join(cg_v1, 'cpu'), exist_ok=True)
+        os.makedirs(os.path.join(cg_v1, 'memory'), exist_ok=True)
+        for name, value in [('cpu/cpu.cfs_quota_us', '-1'), ('cpu/cpu.cfs_period_us', '100000'),
+                            ('memory/memory.limit_in_bytes', '9223372036854771712'),
+                            ('memory/memory.usage_in_bytes', '1000')]:
+            with open(os.path.join(cg_v1, name), 'w') as cg_file:
+                cg_file.write(value + '\n')
+        self.assertIsNone(resource_planner.cgroup_cpu_limit(cg_v1))
+        self.assertIsNone(resource_planner.cgroup_memory_available(cg_v1))
+
+        plan = resource_planner.plan_resources(input_bytes=1000, cgroup_root=cg_v1)
+        self.assertLessEqual(plan['threads'], resource_planner.MAX_THREADS_SMALL_INPUT)
+        self.assertGreaterEqual(plan['memory_gb'], resource_planner.MIN_MEMORY_GB)
@@ -0,0 +1,43 @@
+import unittest
+import os
+from os import environ
+from configparser import ConfigParser
+from kb_SPAdes.utils import settings
+
+
+class settingsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.token = environ.get('KB_AUTH_TOKEN')
+        config_file = environ.get('KB_DEPLOYMENT_CONFIG', None)
+        cls.cfg = {}
+        config = ConfigParser()
+        config.read(config_file)
+        for nameval in config.items('kb_SPAdes'):
+            cls.cfg[nameval[0]] = nameval[1]
+        cls.scratch = cls.cfg['scratch']
+        if not os.path.exists(cls.scratch):
+            os.makedirs(cls.scratch)
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_settings_load_settings")
+    def test_settings_load_settings(self):
+        #
+        # test_settings_load_settings: both apps read the shared settings the same way
+        #
+        config = {'scratch': self.scratch, 'reads-cache-max-gb': '2',
+                  'node-scheduler-dir': os.path.join(self.scratch, 'settings_scheduler'),
+                  'hybrid-auto-kmer-sizes': 'True', 'preflight-memory-check': 'false'}
+        loaded = settings.load_settings(config)
+        self.assertEqual(loaded['reads_cache'].cache_dir,
+                         os.path.join(os.path.abspath(self.scratch), settings.READS_CACHE_DIR))
+        self.assertEqual(loaded['reads_cache'].max_bytes, 2 * settings.GB)
+        self.assertEqual(loaded['corrected_reads_cache'].max_bytes,
+                         settings.READS_CACHE_MAX_GB * settings.GB)
+        self.assertTrue(loaded['auto_kmer_sizes'])
+        self.assertTrue(loaded['hybrid_auto_kmer_sizes'])
+        self.assertFalse(loaded['memory_preflight'])
+        self.assertEqual(loaded['cancel_scratch_policy'], 'keep')
+        self.assertFalse(settings.load_settings({'scratch': self.scratch})[
+            'hybrid_auto_kmer_sizes'])
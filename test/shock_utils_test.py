@@ -0,0 +1,140 @@
+import unittest
+import os
+import json
+from os import environ
+from configparser import ConfigParser
+import threading
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import requests
+from kb_SPAdes.utils import shock_utils
+
+
+class MockShockServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MockShockHandler(BaseHTTPRequestHandler):
+    """
+    A stand-in for the Shock node API, enough for shock_utils.upload_file_to_shock: POST /node
+    with an 'upload' file or a 'parts' count, PUT /node/<id> with numbered parts and
+    GET /node/<id>. Parts in failures answer with a server error that many times, parts in
+    broken always do.
+    """
+    nodes = {}
+    puts = []
+    failures = {}
+    broken = set()
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _form(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        message = BytesParser().parsebytes(
+            b'Content-Type: ' + self.headers['Content-Type'].encode() + b'\r\n\r\n' + body)
+        return {part.get_param('name', header='content-disposition'): part.get_payload(
+            decode=True) for part in message.get_payload()}
+
+    def _reply(self, status, data):
+        out = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def _node(self, node_id):
+        node = self.nodes[node_id]
+        if node['parts'] and len(node['data']) == node['parts']:
+            node['file'] = b''.join(node['data'][p] for p in sorted(node['data']))
+        return {'data': {'id': node_id, 'file': {'size': len(node['file'])}}}
+
+    def do_POST(self):
+        form = self._form()
+        with self.lock:
+            node_id = str(len(self.nodes) + 1)
+            self.nodes[node_id] = {'parts': int(form.get('parts') or 0), 'data': {},
+                                   'file': form.get('upload') or b''}
+            self._reply(200, self._node(node_id))
+
+    def do_PUT(self):
+        node_id = self.path.split('/')[-1]
+        form = self._form()
+        with self.lock:
+            for part, data in form.items():
+                part = int(part)
+                self.puts.append(part)
+                if part in self.broken or self.failures.get(part, 0) > 0:
+                    self.failures[part] = self.failures.get(part, 0) - 1
+                    return self._reply(500, {'error': ['part {} lost'.format(part)]})
+                self.nodes[node_id]['data'][part] = data
+            self._reply(200, self._node(node_id))
+
+    def do_GET(self):
+        with self.lock:
+            self._reply(200, self._node(self.path.split('/')[-1]))
+
+
+class shock_utilsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.token = environ.get('KB_AUTH_TOKEN')
+        config_file = environ.get('KB_DEPLOYMENT_CONFIG', None)
+        cls.cfg = {}
+        config = ConfigParser()
+        config.read(config_file)
+        for nameval in config.items('kb_SPAdes'):
+            cls.cfg[nameval[0]] = nameval[1]
+        cls.scratch = cls.cfg['scratch']
+        if not os.path.exists(cls.scratch):
+            os.makedirs(cls.scratch)
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_shock_upload_chunked_resume")
+    def test_shock_upload_chunked_resume(self):
+        #
+        # test_shock_upload_chunked_resume: parts are retried, and resumed after a failure
+        #
+        server = MockShockServer(('127.0.0.1', 0), MockShockHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        shock_url = 'http://127.0.0.1:{}'.format(server.server_port)
+        upload_path = os.path.join(self.scratch, 'shock_upload_test.bin')
+        with open(upload_path, 'wb') as upload_file:
+            upload_file.write(os.urandom(2500000))
+        with open(upload_path, 'rb') as upload_file:
+            upload_data = upload_file.read()
+
+        max_attempts, retry_wait = shock_utils.SHOCK_MAX_ATTEMPTS, shock_utils.SHOCK_RETRY_WAIT
+        shock_utils.SHOCK_MAX_ATTEMPTS, shock_utils.SHOCK_RETRY_WAIT = 2, 0
+        try:
+            MockShockHandler.failures = {2: 1}
+            node = shock_utils.upload_file_to_shock(shock_url, self.token, upload_path,
+                                                    chunk_size=1000000, workers=2)
+            self.assertEqual(MockShockHandler.nodes[node['id']]['file'], upload_data)
+            self.assertEqual(node['stats']['parts'], 3)
+            self.assertEqual(sorted(MockShockHandler.puts), [1, 2, 2, 3])
+            self.assertFalse(os.path.exists(upload_path + shock_utils.UPLOAD_STATE_SUFFIX))
+
+            MockShockHandler.puts = []
+            MockShockHandler.broken = {3}
+            with self.assertRaises(requests.exceptions.HTTPError):
+                shock_utils.upload_file_to_shock(shock_url, self.token, upload_path,
+                                                 chunk_size=1000000, workers=1)
+            self.assertTrue(os.path.exists(upload_path + shock_utils.UPLOAD_STATE_SUFFIX))
+            MockShockHandler.puts = []
+            MockShockHandler.broken = set()
+            node = shock_utils.upload_file_to_shock(shock_url, self.token, upload_path,
+                                                    chunk_size=1000000, workers=1)
+            self.assertEqual(MockShockHandler.puts, [3])
+            self.assertEqual(node['stats']['parts_resumed'], 2)
+            self.assertEqual(MockShockHandler.nodes[node['id']]['file'], upload_data)
+
+            node = shock_utils.upload_file_to_shock(shock_url, self.token, upload_path,
+                                                    chunk_size=10000000)
+            self.assertEqual(MockShockHandler.nodes[node['id']]['file'], upload_data)
+        finally:
+            shock_utils.SHOCK_MAX_ATTEMPTS, shock_utils.SHOCK_RETRY_WAIT = max_attempts, retry_wait
+            server.shutdown()
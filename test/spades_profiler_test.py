@@ -0,0 +1,54 @@
+import unittest
+import os
+from os import environ
+from configparser import ConfigParser
+from kb_SPAdes.utils import spades_profiler
+
+
+class spades_profilerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.token = environ.get('KB_AUTH_TOKEN')
+        config_file = environ.get('KB_DEPLOYMENT_CONFIG', None)
+        cls.cfg = {}
+        config = ConfigParser()
+        config.read(config_file)
+        for nameval in config.items('kb_SPAdes'):
+            cls.cfg[nameval[0]] = nameval[1]
+        cls.scratch = cls.cfg['scratch']
+        if not os.path.exists(cls.scratch):
+            os.makedirs(cls.scratch)
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_spades_profiler_summary")
+    def test_spades_profiler_summary(self):
+        #
+        # test_spades_profiler_summary: per-stage resource summary of process tree samples
+        #
+        samples = [
+            {'time': 0, 'stage': None, 'processes': 1, 'cpu_percent': 0.0, 'rss': 10 ** 6,
+             'threads': 1, 'read_bytes': 0, 'write_bytes': 0},
+            {'time': 5, 'stage': 'K21', 'processes': 2, 'cpu_percent': 300.0,
+             'rss': 2 * 10 ** 9, 'threads': 8, 'read_bytes': 10 ** 8, 'write_bytes': 0},
+            {'time': 10, 'stage': 'K21', 'processes': 2, 'cpu_percent': 100.0,
+             'rss': 3 * 10 ** 9, 'threads': 4, 'read_bytes': 3 * 10 ** 8,
+             'write_bytes': 10 ** 7}]
+        summary = spades_profiler.summarize_profile(samples)
+        self.assertEqual([s['stage'] for s in summary], ['Startup', 'K21'])
+        self.assertEqual(summary[1]['peak_rss'], 3 * 10 ** 9)
+        self.assertEqual(summary[1]['mean_cpu_percent'], 200.0)
+        self.assertEqual(summary[1]['peak_threads'], 8)
+        self.assertEqual(summary[1]['read_bytes'], 3 * 10 ** 8)
+        self.assertIn('K21: 3000 MB, 200%/300%, 8 threads, 300 MB read, 10 MB written',
+                      spades_profiler.profile_report(summary))
+
+        # the spades.py process tree is sampled while it runs
+        sampler = spades_profiler.ProcessTreeSampler(os.getpid(), stage_of=lambda: 'K33')
+        self.assertEqual(sampler.sample()['stage'], 'K33')
+
+        steps = []
+        with spades_profiler.timed_step(steps, 'QUAST'):
+            pass
+        self.assertEqual([s['step'] for s in steps], ['QUAST'])
+        self.assertIn('QUAST: 0:00:00', spades_profiler.steps_report(steps))
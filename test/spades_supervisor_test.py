@@ -0,0 +1,139 @@
+import unittest
+import os
+import time
+from os import environ
+from configparser import ConfigParser
+import psutil
+import shutil
+import threading
+import sys
+import subprocess
+from kb_SPAdes.utils import spades_supervisor
+
+
+class spades_supervisorTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.token = environ.get('KB_AUTH_TOKEN')
+        config_file = environ.get('KB_DEPLOYMENT_CONFIG', None)
+        cls.cfg = {}
+        config = ConfigParser()
+        config.read(config_file)
+        for nameval in config.items('kb_SPAdes'):
+            cls.cfg[nameval[0]] = nameval[1]
+        cls.scratch = cls.cfg['scratch']
+        if not os.path.exists(cls.scratch):
+            os.makedirs(cls.scratch)
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_spades_supervisor_stages")
+    def test_spades_supervisor_stages(self):
+        #
+        # test_spades_supervisor_stages: stage events and durations parsed from spades.py output
+        #
+        fake_spades = os.path.join(self.scratch, 'fake_spades.sh')
+        with open(fake_spades, 'w') as script:
+            script.write('#!/bin/sh\n'
+                         'echo "===== Read error correction started."\n'
+                         'echo "===== Read error correction finished."\n'
+                         'echo "===== Assembling started."\n'
+                         'printf "not utf-8: \\377\\376\\n"\n'
+                         'echo "===== K21 started."\n'
+                         'echo "== Error ==  system call for: spades-core finished abnormally"\n'
+                         'exit 12\n')
+        os.chmod(fake_spades, 0o755)
+        stages_path = os.path.join(self.scratch, spades_supervisor.STAGES_FILE)
+        supervisor = spades_supervisor.run_spades([fake_spades], echo=False,
+                                                  stages_path=stages_path)
+        self.assertEqual(supervisor.process.returncode, 12)
+        self.assertEqual(supervisor.errors,
+                         ['system call for: spades-core finished abnormally'])
+        self.assertEqual([(e['stage'], e['event']) for e in supervisor.events],
+                         [('Read error correction', 'started'),
+                          ('Read error correction', 'finished'),
+                          ('Assembling', 'started'), ('K21', 'started')])
+
+        stages = spades_supervisor.load_stages(stages_path)
+        self.assertEqual([(s['stage'], s['finished']) for s in stages['stages']],
+                         [('Read error correction', True), ('Assembling', False),
+                          ('K21', False)])
+        report = spades_supervisor.stages_report(stages)
+        self.assertIn('Read error correction: 0:00:00', report)
+        self.assertIn('K21: 0:00:00 (unfinished)', report)
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_spades_supervisor_cancel")
+    def test_spades_supervisor_cancel(self):
+        #
+        # test_spades_supervisor_cancel: canceling a run terminates spades.py and its children
+        # and removes its scratch by policy
+        #
+        out_dir = os.path.join(self.scratch, 'cancel_test_out')
+        shutil.rmtree(out_dir, ignore_errors=True)
+        os.makedirs(out_dir)
+        with open(os.path.join(out_dir, 'checkpoint'), 'wb') as checkpoint:
+            checkpoint.write(b'x' * 1000)
+        fake_spades = os.path.join(self.scratch, 'fake_spades_cancel.sh')
+        with open(fake_spades, 'w') as script:
+            # the child ignores SIGTERM, so it has to be SIGKILLed
+            script.write('#!/bin/sh\n'
+                         'echo "===== Assembling started."\n'
+                         'printf "not utf-8: \\377\\376\\n"\n'
+                         'echo "===== K21 started."\n'
+                         'sh -c \'trap "" TERM; sleep 60\' &\n'
+                         'sleep 60\n')
+        os.chmod(fake_spades, 0o755)
+
+        result = {}
+
+        def run():
+            with spades_supervisor.cancel_group('cancel_test'):
+                try:
+                    spades_supervisor.run_spades(
+                        [fake_spades], echo=False, scratch_dirs=[out_dir],
+                        scratch_policy=spades_supervisor.SCRATCH_REMOVE)
+                except spades_supervisor.SPAdesCanceled as e:
+                    result['canceled'] = e
+        runner = threading.Thread(target=run)
+        runner.start()
+        time.sleep(1)
+        canceled = spades_supervisor.cancel_runs('cancel_test', 'test cancel', grace=1)
+        runner.join(10)
+        self.assertFalse(runner.is_alive())
+
+        self.assertEqual(len(canceled), 1)
+        info = result['canceled'].info
+        self.assertEqual(info['stage'], 'K21')
+        self.assertGreaterEqual(info['processes'], 3)
+        self.assertGreaterEqual(info['killed'], 1)
+        self.assertEqual(info['scratch_bytes'], 1000)
+        self.assertFalse(os.path.exists(out_dir))
+        self.assertIn('SPAdes run canceled (test cancel)', str(result['canceled']))
+        # the processes of the run are gone
+        self.assertEqual([p for p in psutil.process_iter(['cmdline'])
+                          if fake_spades in ' '.join(p.info['cmdline'] or [])], [])
+        self.assertEqual(spades_supervisor.cancel_runs('cancel_test'), [])
+
+        # canceling all the running runs does not refuse the later ones
+        self.assertEqual(spades_supervisor.cancel_runs(), [])
+        supervisor = spades_supervisor.run_spades(['true'], echo=False)
+        self.assertEqual(supervisor.process.returncode, 0)
+
+        # a SIGTERM to a job cancels its runs from a thread, the job ends with the report
+        job_script = os.path.join(self.scratch, 'cancel_signal_job.py')
+        with open(job_script, 'w') as script:
+            script.write('import os, signal, threading\n'
+                         'from kb_SPAdes.utils import spades_supervisor as s\n'
+                         'with s.cancel_group("job"):\n'
+                         '    s.install_cancel_handlers("job")\n'
+                         '    threading.Timer(1, os.kill, (os.getpid(), signal.SIGTERM)).start()\n'
+                         '    try:\n'
+                         '        s.run_spades(["sleep", "60"], echo=False)\n'
+                         '    except s.SPAdesCanceled as e:\n'
+                         '        print("CANCELED " + str(e))\n')
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        job = subprocess.run([sys.executable, job_script], env=env, timeout=30,
+                             stdout=subprocess.PIPE, universal_newlines=True)
+        self.assertEqual(job.returncode, 0)
+        self.assertIn('CANCELED SPAdes run canceled (received SIGTERM)', job.stdout)
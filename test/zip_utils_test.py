@@ -0,0 +1,87 @@
+import unittest
+import os
+from os import environ
+from configparser import ConfigParser
+import gzip
+import zipfile
+import io
+from kb_SPAdes.utils import zip_utils
+
+
+class zip_utilsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.token = environ.get('KB_AUTH_TOKEN')
+        config_file = environ.get('KB_DEPLOYMENT_CONFIG', None)
+        cls.cfg = {}
+        config = ConfigParser()
+        config.read(config_file)
+        for nameval in config.items('kb_SPAdes'):
+            cls.cfg[nameval[0]] = nameval[1]
+        cls.scratch = cls.cfg['scratch']
+        if not os.path.exists(cls.scratch):
+            os.makedirs(cls.scratch)
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_zip_utils_parallel")
+    def test_zip_utils_parallel(self):
+        #
+        # test_zip_utils_parallel: files read ahead while others are compressed make a valid archive
+        #
+        zip_dir = os.path.join(self.scratch, 'zip_test_out')
+        os.makedirs(zip_dir, exist_ok=True)
+        entries = []
+        for i in range(5):
+            txt = os.path.join(zip_dir, 'contigs{}.fasta'.format(i))
+            with open(txt, 'w') as txt_file:
+                txt_file.write('>c\n' + 'ACGT' * 10000 * (i + 1) + '\n')
+            entries.append((txt, os.path.join('zip_test_out', os.path.basename(txt))))
+        gz = os.path.join(zip_dir, 'reads.fq.gz')
+        with gzip.open(gz, 'wt') as gz_file:
+            gz_file.write('@r\nACGT\n+\nIIII\n')
+        entries.append((gz, 'zip_test_out/reads.fq.gz'))
+
+        output_path = os.path.join(self.scratch, 'zip_test.zip')
+        stats = zip_utils.zip_files(entries, output_path, level=1, workers=3)
+        self.assertEqual(stats['files'], 6)
+        self.assertEqual(stats['stored_files'], 1)
+        self.assertLess(stats['bytes_out'], stats['bytes_in'])
+        with zipfile.ZipFile(output_path) as zip_file:
+            self.assertIsNone(zip_file.testzip())
+            self.assertEqual([i.filename for i in zip_file.infolist()], [e[1] for e in entries])
+            self.assertEqual(zip_file.getinfo('zip_test_out/reads.fq.gz').compress_type,
+                             zipfile.ZIP_STORED)
+            with open(entries[2][0], 'rb') as txt_file:
+                self.assertEqual(zip_file.read(entries[2][1]), txt_file.read())
+        self.assertIn('6 files (1 stored', zip_utils.zip_report(stats))
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_zip_utils_stream")
+    def test_zip_utils_stream(self):
+        #
+        # test_zip_utils_stream: a streamed archive is complete without being written to disk
+        #
+        stream_dir = os.path.join(self.scratch, 'zip_stream_test_out')
+        os.makedirs(stream_dir, exist_ok=True)
+        entries = []
+        for i in range(3):
+            txt = os.path.join(stream_dir, 'scaffolds{}.fasta'.format(i))
+            with open(txt, 'w') as txt_file:
+                txt_file.write('>s\n' + 'ACGT' * 500000 + '\n')
+            entries.append((txt, os.path.basename(txt)))
+
+        def consume(chunks):
+            return b''.join(chunks)
+        data, stats = zip_utils.stream_zip_files(entries, consume, workers=2)
+        self.assertEqual(stats['files'], 3)
+        self.assertLess(stats['bytes_out'], len(data))
+        with zipfile.ZipFile(io.BytesIO(data)) as zip_file:
+            self.assertIsNone(zip_file.testzip())
+            self.assertEqual(zip_file.namelist(), [e[1] for e in entries])
+
+        def fail(chunks):
+            next(chunks)
+            raise IOError('upload failed')
+        with self.assertRaisesRegex(IOError, 'upload failed'):
+            zip_utils.stream_zip_files(entries, fail, workers=2)